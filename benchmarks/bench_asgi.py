@@ -0,0 +1,132 @@
+"""Benchmark of the ASGI app against the WSGI one under concurrent requests.
+
+The WSGI app runs on a single-threaded server, like a gunicorn sync worker,
+and the ASGI app on the built-in asyncio server. Both serve the same synthetic
+site, that includes a slow page, to several clients at the same time.
+
+    python benchmarks/bench_asgi.py --clients 16 --requests 40
+
+"""
+import argparse
+import asyncio
+import http.client
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from sitegen import generate_site
+
+from clay.asgi import make_asgi_app
+from clay.main import Clay
+from clay.server import make_app
+from clay.utils.asgi_server import serve
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Server(WSGIServer):
+    # Don't refuse connections, so the clients wait in line instead of retrying
+    request_queue_size = 128
+
+
+def start_wsgi(app):
+    """Starts a server that handles one request at a time, like a sync worker.
+    Returns its port.
+    """
+    server = make_server(
+        "127.0.0.1", 0, app, server_class=Server, handler_class=QuietHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port
+
+
+def start_asgi(app):
+    """Starts the built-in ASGI server in another thread. Returns its port."""
+    ready = threading.Event()
+    state = {}
+
+    def on_start(server):
+        state["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+
+    threading.Thread(
+        target=asyncio.run, args=(serve(app, "127.0.0.1", 0, on_start=on_start),), daemon=True
+    ).start()
+    ready.wait()
+    return state["port"]
+
+
+def fetch(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    start = time.perf_counter()
+    conn.request("GET", path)
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return path, time.perf_counter() - start
+
+
+def load(port, paths, clients):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda path: fetch(port, path), paths))
+    return time.perf_counter() - start, results
+
+
+def report(name, elapsed, results, slow_path):
+    fast = sorted(t for path, t in results if path != slow_path)
+    p95 = fast[int(len(fast) * 0.95) - 1]
+    print(
+        f"{name:<6} {len(results) / elapsed:>9.1f} req/s"
+        f" {statistics.median(fast) * 1000:>9.2f}ms {p95 * 1000:>9.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--slow", type=int, default=500,
+                        help="Size of the nested loops of the slow page")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        site = generate_site(Path(tmp) / "site", pages=args.pages)
+        # Render every request, to measure the concurrency and not the cache
+        (site / "clay.yaml").write_text("render_cache_size: 0\n")
+        (site / "slow.html").write_text(
+            f"{{% for i in range({args.slow}) %}}{{% for j in range({args.slow}) %}}"
+            "{% endfor %}{% endfor %}slow"
+        )
+        clay = Clay(site)
+        pages = [f"/{path}" for path in clay.list_pages() if path.endswith(".html")]
+        slow_path = "/slow.html"
+        paths = []
+        for i in range(args.requests):
+            paths.append(pages[i % len(pages)])
+            paths.append(f"/static/asset{i % 10}.bin")
+            if i % 10 == 0:
+                paths.append(slow_path)
+
+        print(f"{len(paths)} requests, {args.clients} clients")
+        print(f"{'server':<6} {'throughput':>13} {'fast p50':>11} {'fast p95':>11}")
+        for name, app, start in (
+            ("wsgi", make_app(Clay(site)), start_wsgi),
+            ("asgi", make_asgi_app(Clay(site)), start_asgi),
+        ):
+            port = start(app)
+            load(port, paths[:20], args.clients)  # warm up
+            elapsed, results = load(port, paths, args.clients)
+            report(name, elapsed, results, slow_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark of compiling templates with many `{% include ... with ... %}`
+tags, against the previous regex preprocessor. The time per include should
+stay flat as the template grows.
+
+    python benchmarks/bench_includewith.py
+
+"""
+import re
+import timeit
+
+import jinja2
+from jinja2.ext import Extension
+
+from clay.utils.jinja_includewith import IncludeWith
+
+
+class PreviousIncludeWith(Extension):
+    """The previous implementation, that rebuilt the whole source for each
+    include it found.
+    """
+
+    rx = re.compile(
+        r"\{\%-?[\s\n]*include[\s\n]+(?P<tmpl>[^\s\n]+)[\s\n]+with[\s\n]+"
+        r"(?P<context>.*?)[\s\n]*-?\%\}",
+        re.IGNORECASE | re.DOTALL,
+    )
+
+    def preprocess(self, source, name, filename=None):
+        lastpos = 0
+        while 1:
+            m = self.rx.search(source, lastpos)
+            if not m:
+                break
+
+            lastpos = m.end()
+            d = m.groupdict()
+            context = d["context"].replace("\n", " ").strip()
+            if context == "context":
+                continue
+
+            source = "".join(
+                [
+                    source[: m.start()],
+                    "{% with ",
+                    context,
+                    " %}",
+                    "{% include ",
+                    d["tmpl"].strip(),
+                    " %}",
+                    "{% endwith %}",
+                    source[m.end() :],
+                ]
+            )
+
+        return source
+
+
+def make_template(num_includes):
+    return "\n".join(
+        f"<li>{{% include '_card.html' with title='Card {i}', url='/cards/{i}.html' %}}</li>"
+        f"<p>{'lorem ipsum ' * 20}</p>"
+        for i in range(num_includes)
+    )
+
+
+def bench(extension, source, number, step):
+    env = jinja2.Environment(extensions=[extension])
+    # Without loading it, so the template cache is skipped
+    seconds = timeit.timeit(lambda: getattr(env, step)(source), number=number)
+    return seconds / number
+
+
+def main():
+    # `parse` is the preprocessing, tokenizing and parsing; `compile` adds
+    # the code generation, the same for both.
+    for step in ("parse", "compile"):
+        print(f"{step:>8} {'current':>12} {'previous':>12} {'speedup':>8}")
+        for num_includes in (10, 100, 500, 2000):
+            source = make_template(num_includes)
+            number = max(1, 2000 // num_includes)
+            current = bench(IncludeWith, source, number, step)
+            previous = bench(PreviousIncludeWith, source, number, step)
+            print(
+                f"{num_includes:>8} {current * 1000:>10.2f}ms {previous * 1000:>10.2f}ms "
+                f"{previous / current:>7.1f}x"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Microbenchmarks of the path matchers over a synthetic tree of 100k paths.
+
+    python benchmarks/bench_matcher.py
+
+"""
+import os
+import random
+import time
+from fnmatch import fnmatch
+from functools import reduce
+
+from clay.main import DEFAULT_CONFIG, EXCLUDE_PAGE_PATTERNS
+from clay.utils.binaries import KNOWN_BINARIES
+from clay.utils.make_matcher import _normalize_str, make_filter, make_matcher
+
+
+NUM_PATHS = 100_000
+EXTENSIONS = ("html", "css", "js", "png", "jpg", "svg", "woff2", "json", "txt", "md")
+
+
+def make_paths(num_paths, seed=0):
+    rnd = random.Random(seed)
+    folders = ["", "static", "static/img", "blog", "docs/api", "node_modules/lib",
+               ".git/objects", "_includes", "señal", "build"]
+    return [
+        os.path.join(
+            rnd.choice(folders),
+            f"{rnd.choice(('', '_', '.', '~'))}file{i}.{rnd.choice(EXTENSIONS)}",
+        )
+        for i in range(num_paths)
+    ]
+
+
+def make_previous_matcher(patterns):
+    """The previous implementation, with two `fnmatch` calls per pattern."""
+    patterns = [_normalize_str(pattern) for pattern in patterns]
+
+    def _fullmatch(path, pattern):
+        path = _normalize_str(str(path))
+        name = os.path.basename(path)
+        return fnmatch(name, pattern) or fnmatch(path, pattern)
+
+    def path_match(path):
+        return reduce(lambda r, pattern: r or _fullmatch(path, pattern), patterns, False)
+
+    return path_match
+
+
+def bench(name, make, paths):
+    is_binary = make(KNOWN_BINARIES)
+    must_filter = make_filter(make(DEFAULT_CONFIG["exclude"]), make(("favicon.ico",)))
+    exclude_page = make(DEFAULT_CONFIG["exclude"] + EXCLUDE_PAGE_PATTERNS)
+
+    results = []
+    for label, func in (
+        ("is_binary", is_binary),
+        ("must_filter", must_filter),
+        ("exclude_page", exclude_page),
+    ):
+        start = time.perf_counter()
+        matches = [func(path) for path in paths]
+        elapsed = time.perf_counter() - start
+        results.append(matches)
+        print(f"{name:>9} {label:>13} {elapsed * 1000:>9.1f}ms "
+              f"{elapsed / len(paths) * 1e9:>7.0f}ns/path")
+    return results
+
+
+def main():
+    paths = make_paths(NUM_PATHS)
+    print(f"{len(paths)} paths")
+    current = bench("current", make_matcher, paths)
+    previous = bench("previous", make_previous_matcher, paths)
+    assert current == previous, "The results are different!"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmark of the work done for every file of a build besides rendering
+it: the templating of its name and the context of its page. Against the
+previous versions, that compiled every name as a template.
+
+    python benchmarks/bench_paths.py --files 50000
+
+"""
+import argparse
+import time
+from pathlib import Path
+
+from clay.utils.active import make_active_helper
+from clay.utils.blueprint_render import get_context
+from clay.utils.jinja_render import JinjaRender
+from clay.utils.request import Request
+
+
+def previous_string(render, string, **data):
+    return render.env.from_string(string).render(**data)
+
+
+def previous_get_context(path=""):
+    request = Request()
+    request.path = str(path).replace("\\", "/").strip("/")
+    active = make_active_helper(request)
+    return {"request": request, "active": active}
+
+
+def run(names, string, get_context):
+    start = time.perf_counter()
+    for name in names:
+        dst_relpath = Path("section") / string(name)
+        get_context(dst_relpath)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50000)
+    args = parser.parse_args()
+
+    render = JinjaRender(".")
+    names = [f"page-{i}.html" for i in range(args.files)]
+    current = run(names, render.string, get_context)
+    previous = run(
+        names, lambda name: previous_string(render, name), previous_get_context
+    )
+    print(f"Per-file overhead of {args.files} files")
+    print(f"  current:  {current:8.3f}s ({current / args.files * 1e6:6.1f}us per file)")
+    print(f"  previous: {previous:8.3f}s ({previous / args.files * 1e6:6.1f}us per file)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark of building a `Request` and of reading `request.query` from
+a template, against the previous eager `Request` and `defaultdict`-based
+`MultiDict`.
+
+    python benchmarks/bench_request.py
+
+"""
+import timeit
+from collections import defaultdict
+
+import multipart
+from jinja2.sandbox import SandboxedEnvironment
+
+from clay.utils.request import Request
+
+
+class PreviousMultiDict(defaultdict):
+    def __init__(self):
+        super().__init__(list)
+
+    def get(self, key, default=None, *, index=-1):
+        values = self[key]
+        value = values[index] if values else None
+        return default if value is None else value
+
+
+class PreviousRequest:
+    """The previous implementation, that parsed everything up front."""
+
+    def __init__(self, environ=None, path=None):
+        environ = environ or {}
+        self.environ = environ
+        self.path = path or self.get_path()
+        self.query = self.get_query()
+        self.ajax = environ.get("HTTP_X_REQUESTED_WITH") == "XMLHttpRequest"
+        self.method = environ.get("REQUEST_METHOD", "GET").upper()
+        self.remote_addr = environ.get("REMOTE_ADDR", "127.0.0.1")
+
+    def get_path(self):
+        path = self.environ.get("PATH_INFO", "")
+        path = path.encode("iso-8859-1", "replace").decode("utf-8", "replace")
+        return path[1:] + "index.html" if path.endswith("/") else path[1:]
+
+    def get_query(self):
+        query = PreviousMultiDict()
+        query_string = self.environ.get("QUERY_STRING")
+        if query_string:
+            data = multipart.parse_qs(query_string, keep_blank_values=True)
+            for key, values in data.items():
+                query[key] = [True if value == "" else value for value in values]
+        return query
+
+
+ENVIRON = {
+    "PATH_INFO": "/blog/2024/some-post/",
+    "QUERY_STRING": "utm_source=news&utm_medium=email&utm_campaign=" + "x" * 40,
+    "REQUEST_METHOD": "GET",
+    "REMOTE_ADDR": "10.0.0.1",
+    "HTTP_HOST": "example.com",
+    "HTTP_USER_AGENT": "Mozilla/5.0",
+    "HTTP_ACCEPT_ENCODING": "gzip, br",
+}
+# A template that looks up query keys that are not there, like a filter form
+LOOKUPS = "".join(
+    f"{{{{ request.query.get('filter{i}', '') }}}}" for i in range(20)
+)
+
+
+def bench(func, number):
+    return timeit.timeit(func, number=number) / number
+
+
+def main():
+    env = SandboxedEnvironment()
+    template = env.from_string(LOOKUPS)
+    cases = (
+        ("construct", lambda cls: cls(ENVIRON), 20000),
+        ("construct + path", lambda cls: cls(ENVIRON).path, 20000),
+        ("20 query lookups", lambda cls: template.render(request=cls(ENVIRON)), 2000),
+    )
+    print(f"{'':<18} {'current':>10} {'previous':>10}")
+    for name, func, number in cases:
+        current = bench(lambda func=func: func(Request), number)
+        previous = bench(lambda func=func: func(PreviousRequest), number)
+        print(f"{name:<18} {current * 1e6:>8.2f}us {previous * 1e6:>8.2f}us")
+
+    print()
+    for name, cls in (("current", Request), ("previous", PreviousRequest)):
+        request = cls(ENVIRON)
+        template.render(request=request)
+        print(f"Keys in the {name} query after rendering: {len(request.query)}")
+
+
+if __name__ == "__main__":
+    main()
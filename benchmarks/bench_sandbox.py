@@ -0,0 +1,71 @@
+"""Benchmark of rendering attribute-heavy templates with and without the
+sandbox (the `sandbox: false` option of `clay.yaml`).
+
+    python benchmarks/bench_sandbox.py
+
+"""
+import tempfile
+import timeit
+from pathlib import Path
+
+from clay.utils.jinja_render import JinjaRender
+
+
+class Author:
+    def __init__(self, i):
+        self.name = f"Author {i}"
+        self.url = f"/authors/{i}.html"
+
+    def initials(self):
+        return "".join(part[0] for part in self.name.split())
+
+
+class Post:
+    def __init__(self, i):
+        self.title = f"Post {i}"
+        self.url = f"/blog/{i}.html"
+        self.author = Author(i % 10)
+        self.tags = [f"tag{j}" for j in range(i % 5)]
+        self.meta = {"words": i * 10, "draft": i % 7 == 0}
+
+
+TEMPLATES = {
+    "attributes": (
+        "{% for post in posts %}<a href='{{ post.url }}'>{{ post.title }}</a>"
+        "{{ post.author.name }}{{ post.author.url }}{{ post.author.initials() }}"
+        "{{ post.meta.words }}{{ post.meta['draft'] }}{{ post.tags|join(',') }}"
+        "{% endfor %}"
+    ),
+    "method calls": (
+        "{% for post in posts %}{{ post.title.upper() }}{{ post.url.split('/')|last }}"
+        "{{ post.meta.get('words') }}{{ post.tags|length }}{% endfor %}"
+    ),
+    "plain text": "{% for post in posts %}<li>post</li>{% endfor %}",
+}
+POSTS = [Post(i) for i in range(500)]
+
+
+def bench(render, name, number):
+    seconds = timeit.timeit(lambda: render.render(name, posts=POSTS), number=number)
+    return seconds / number
+
+
+def main():
+    with tempfile.TemporaryDirectory() as src:
+        for name, source in TEMPLATES.items():
+            (Path(src) / f"{name}.html").write_text(source)
+        sandboxed = JinjaRender(src)
+        trusted = JinjaRender(src, sandbox=False)
+
+        print(f"{'500 posts':<14} {'sandboxed':>10} {'trusted':>10} {'speedup':>8}")
+        for name in TEMPLATES:
+            current = bench(sandboxed, f"{name}.html", 200)
+            fast = bench(trusted, f"{name}.html", 200)
+            print(
+                f"{name:<14} {current * 1000:>8.2f}ms {fast * 1000:>8.2f}ms "
+                f"{current / fast:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
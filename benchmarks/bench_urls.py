@@ -0,0 +1,55 @@
+"""Benchmark of `make_absolute_urls_relative` against the number of links
+in a page. The time per link should stay flat as the page grows.
+
+    python benchmarks/bench_urls.py
+
+"""
+import re
+import timeit
+from pathlib import Path
+
+from clay.utils.urls import RX_ABS_URL, get_relative_url, make_absolute_urls_relative
+
+
+def make_page(num_links):
+    links = "\n".join(
+        f'<li><a href="/section-{i % 50}/page-{i}.html">Page {i}</a>'
+        f'<img src="/static/thumbs/{i}.png"></li>'
+        for i in range(num_links // 2)
+    )
+    return f"<html><body><ul>{links}</ul></body></html>"
+
+
+def previous_make_absolute_urls_relative(base_path, relpath, content):
+    """The previous implementation, with one full `re.sub` pass per URL."""
+    relpath = str(relpath)
+    for attr, url in RX_ABS_URL.findall(content):
+        newurl = get_relative_url(base_path, relpath, url)
+        repl = r' %s="%s"' % (attr, newurl)
+        content = re.sub(RX_ABS_URL, repl, content, count=1)
+    return content
+
+
+def bench(func, content, number, **kwargs):
+    base_path = Path("build")
+    seconds = timeit.timeit(
+        lambda: func(base_path, "a/b/index.html", content, **kwargs),
+        number=number,
+    )
+    return seconds / number
+
+
+def main():
+    print(f"{'links':>7} {'current':>12} {'per link':>10} {'previous':>12}")
+    for num_links in (250, 500, 1000, 2000, 4000):
+        content = make_page(num_links)
+        current = bench(make_absolute_urls_relative, content, number=20, folders=set())
+        previous = bench(previous_make_absolute_urls_relative, content, number=1)
+        print(
+            f"{num_links:>7} {current * 1000:>10.2f}ms {current / num_links * 1e6:>8.2f}us"
+            f" {previous * 1000:>10.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compares two results files saved by `run.py`.
+
+    python benchmarks/compare.py before.json after.json
+
+"""
+import argparse
+import json
+from pathlib import Path
+
+
+def compare(before, after):
+    rows = []
+    for name, stats in after["results"].items():
+        old = before["results"].get(name)
+        new_median = stats["median"]
+        if not old:
+            rows.append((name, None, new_median, None))
+            continue
+        old_median = old["median"]
+        ratio = new_median / old_median if old_median else None
+        rows.append((name, old_median, new_median, ratio))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    before = json.loads(Path(args.before).read_text())
+    after = json.loads(Path(args.after).read_text())
+
+    print(f"{'benchmark':<40} {'before':>12} {'after':>12} {'change':>9}")
+    for name, old, new, ratio in compare(before, after):
+        old_str = f"{old * 1000:.3f}ms" if old is not None else "-"
+        ratio_str = f"{ratio:.2f}x" if ratio is not None else "-"
+        print(f"{name:<40} {old_str:>12} {new * 1000:>10.3f}ms {ratio_str:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Benchmark suite for Clay.
+
+Generates a synthetic site (see `sitegen.py`) and times cold and warm builds,
+the dev-server request path and some of the utilities. Everything runs
+offline. The results can be saved as JSON and compared with `compare.py`.
+
+    python benchmarks/run.py --pages 500 --output before.json
+    # ...make some changes...
+    python benchmarks/run.py --pages 500 --output after.json
+    python benchmarks/compare.py before.json after.json
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from importlib.metadata import version
+from pathlib import Path
+
+from sitegen import generate_site
+
+from clay.main import Clay
+from clay.server import make_app
+from clay.utils.binaries import KNOWN_BINARIES
+from clay.utils.make_matcher import make_matcher
+from clay.utils.request import Request
+from clay.utils.urls import make_absolute_urls_relative
+
+
+def timed(func, repeat):
+    """Calls `func()` `repeat` times and returns the timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def quiet(func):
+    """Runs `func` without printing anything."""
+    def wrapper(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def reset_build(site):
+    shutil.rmtree(site / "build", ignore_errors=True)
+    shutil.rmtree(site / ".clay_cache", ignore_errors=True)
+
+
+def bench_builds(site, repeat, jobs):
+    results = {}
+
+    @quiet
+    def cold():
+        reset_build(site)
+        Clay(site).build(jobs=jobs)
+
+    @quiet
+    def warm():
+        Clay(site).build(jobs=jobs)
+
+    @quiet
+    def incremental():
+        Clay(site).build(jobs=jobs, incremental=True)
+
+    results["build.cold"] = timed(cold, repeat)
+    results["build.warm"] = timed(warm, repeat)
+    quiet(Clay(site).build)(incremental=True)
+    results["build.incremental_noop"] = timed(incremental, repeat)
+    return results
+
+
+def bench_server(site, repeat, requests):
+    clay = Clay(site)
+    app = make_app(clay)
+    paths = [
+        f"/{path}" for path in clay.list_pages() if path.endswith(".html")
+    ][:requests]
+    paths.append("/static/asset0.css")
+    paths.append("/does-not-exist")
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    @quiet
+    def serve():
+        for path in paths:
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": path,
+                "QUERY_STRING": "a=1&b=2",
+                "SERVER_NAME": "localhost",
+                "SERVER_PORT": "8080",
+                "wsgi.url_scheme": "http",
+            }
+            for _ in app(environ, start_response):
+                pass
+
+    serve()  # warm up the template cache
+    timings = timed(serve, repeat)
+    return {"server.requests": [t / len(paths) for t in timings]}
+
+
+def bench_utils(repeat):
+    paths = [f"folder{i % 50}/sub{i % 7}/file{i}.{ext}"
+             for i in range(10_000) for ext in ("html", "png")]
+    is_binary = make_matcher(KNOWN_BINARIES)
+    links = "".join(f'<a href="/folder{i}/page{i}.html">{i}</a>' for i in range(3000))
+    environ = {"PATH_INFO": "/a/b/index.html", "QUERY_STRING": "a=1&b=2&b=3"}
+
+    return {
+        "utils.make_matcher": timed(lambda: [is_binary(p) for p in paths], repeat),
+        "utils.make_absolute_urls_relative": timed(
+            lambda: make_absolute_urls_relative(
+                Path("build"), "a/b/index.html", links, folders=set()
+            ),
+            repeat,
+        ),
+        "utils.request": timed(
+            lambda: [Request(environ) for _ in range(10_000)], repeat
+        ),
+    }
+
+
+def summarize(timings):
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+        "runs": timings,
+    }
+
+
+def get_meta(args):
+    return {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "clay": version("clay"),
+        "jinja2": version("jinja2"),
+        "params": vars(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--partials", type=int, default=5)
+    parser.add_argument("--links", type=int, default=20)
+    parser.add_argument("--assets", type=int, default=10)
+    parser.add_argument("--asset-size", type=int, default=64 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        site = generate_site(
+            Path(tmp) / "site",
+            pages=args.pages,
+            depth=args.depth,
+            partials=args.partials,
+            links=args.links,
+            assets=args.assets,
+            asset_size=args.asset_size,
+        )
+        results = {}
+        results.update(bench_builds(site, args.repeat, args.jobs))
+        results.update(bench_server(site, args.repeat, args.requests))
+        results.update(bench_utils(args.repeat))
+
+    data = {
+        "meta": get_meta(args),
+        "results": {name: summarize(timings) for name, timings in results.items()},
+    }
+    for name, stats in data["results"].items():
+        print(f"{name:<40} {stats['median'] * 1000:>12.3f}ms")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(data, indent=2))
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Generator of synthetic Clay projects for the benchmarks.
+
+    python benchmarks/sitegen.py /tmp/site --pages 1000 --depth 3
+
+"""
+import argparse
+import random
+import shutil
+from pathlib import Path
+
+
+def generate_site(
+    dst,
+    *,
+    pages=200,
+    depth=2,
+    partials=5,
+    links=20,
+    folders=10,
+    assets=10,
+    asset_size=64 * 1024,
+    seed=0,
+):
+    """Writes a synthetic Clay project in `dst`.
+
+    - pages: Number of pages.
+    - depth: Levels of layout inheritance (`_layouts/level0.html` is the root).
+    - partials: Number of partials included by the last layout.
+    - links: Number of absolute links in each page.
+    - folders: Number of folders the pages are distributed in.
+    - assets: Number of files in `static/`.
+    - asset_size: Size in bytes of each of those files.
+
+    The content is deterministic for the same arguments.
+    """
+    rnd = random.Random(seed)
+    dst = Path(dst)
+    if dst.exists():
+        shutil.rmtree(dst)
+    (dst / "_layouts").mkdir(parents=True)
+    (dst / "_partials").mkdir()
+    (dst / "static").mkdir()
+
+    for level in range(depth):
+        if level == 0:
+            body = (
+                "<!DOCTYPE html><html><head><title>{% block title %}{% endblock %}"
+                '</title><link rel="stylesheet" href="/static/asset0.css"></head>'
+                "<body>{% block body %}{% endblock %}</body></html>\n"
+            )
+        else:
+            parent = "body" if level == 1 else f"content{level - 1}"
+            body = (
+                f"{{% extends '_layouts/level{level - 1}.html' %}}"
+                f'{{% block {parent} %}}<div class="level{level}">'
+                f"{{% block content{level} %}}{{% endblock %}}</div>{{% endblock %}}\n"
+            )
+        (dst / "_layouts" / f"level{level}.html").write_text(body)
+
+    for i in range(partials):
+        (dst / "_partials" / f"partial{i}.html").write_text(
+            f'<nav class="partial{i}">'
+            "{% for item in items %}"
+            '<a href="/folder{{ item }}/index.html" class="{{ active(\'/folder\' ~ item) }}">'
+            "{{ item|upper }}</a>{% endfor %}</nav>\n"
+        )
+
+    last = depth - 1
+    block = f"content{last}" if last else "body"
+    includes = "".join(
+        f"{{% include '_partials/partial{i}.html' %}}" for i in range(partials)
+    )
+    for i in range(pages):
+        folder = dst / f"folder{i % folders}"
+        folder.mkdir(exist_ok=True)
+        page_links = "".join(
+            f'<a href="/folder{rnd.randrange(folders)}/page{rnd.randrange(pages)}.html">'
+            f"link {n}</a>"
+            for n in range(links)
+        )
+        (folder / f"page{i}.html").write_text(
+            f"{{% extends '_layouts/level{last}.html' %}}"
+            f"{{% block title %}}Page {i}{{% endblock %}}"
+            f"{{% block {block} %}}{{% set items = range({folders}) %}}{includes}"
+            f"<p>{{{{ request.path }}}}</p>{page_links}{{% endblock %}}\n"
+        )
+
+    for i in range(assets):
+        ext = "css" if i == 0 else "bin"
+        (dst / "static" / f"asset{i}.{ext}").write_bytes(rnd.randbytes(asset_size))
+
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dst")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--partials", type=int, default=5)
+    parser.add_argument("--links", type=int, default=20)
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--assets", type=int, default=10)
+    parser.add_argument("--asset-size", type=int, default=64 * 1024)
+    args = parser.parse_args()
+    generate_site(
+        args.dst,
+        pages=args.pages,
+        depth=args.depth,
+        partials=args.partials,
+        links=args.links,
+        folders=args.folders,
+        assets=args.assets,
+        asset_size=args.asset_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,9 @@
+from importlib.metadata import PackageNotFoundError, version
+
+
+try:
+    __version__ = version("clay")
+except PackageNotFoundError:  # pragma: no cover
+    __version__ = "0.0.0"
+
 from .cli import cli  # noqa
@@ -0,0 +1,246 @@
+"""ASGI version of the development server.
+
+Run it with the built-in server, `clay run --asgi`, or with any ASGI server,
+using the `CLAY_SOURCE` environment variable to point to the project:
+
+    CLAY_SOURCE=mysite uvicorn --factory clay.asgi:create_app
+
+"""
+import asyncio
+import mimetypes
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+
+from .main import Clay
+from .server import METRICS_PATH, STATIC_ROUTE, WSGIApp, _display_running_message
+from .utils import asgi_server
+from .utils.compress import ENCODINGS, choose_encoding, is_compressible
+from .utils.metrics import RequestTimer
+from .utils.request import Request
+
+
+__all__ = ("ASGIApp", "make_asgi_app", "create_app")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ASGIApp:
+    """Serves a Clay project as an ASGI app.
+
+    The pages are rendered, with the same caches and instrumentation of
+    the WSGI app, on a pool of at most `max_workers` threads, so a slow page
+    doesn't block the others. The static files are read in chunks without
+    blocking the event loop, and all the responses are streamed.
+    """
+
+    def __init__(self, clay, max_workers=None, chunk_size=CHUNK_SIZE):
+        self.clay = clay
+        self.app = WSGIApp(clay)
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.chunk_size = chunk_size
+        self.static_path = str(clay.static_path)
+        self.static_prefix = f"/{clay.static_path.name}/"
+        self._executor = None
+        self._pid = None
+
+    @property
+    def executor(self):
+        # Created in the process that serves the requests, not before a fork
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="clay-render"
+            )
+        return self._executor
+
+    @property
+    def metrics(self):
+        return self.app.metrics
+
+    @property
+    def render_cache(self):
+        return self.app.render_cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"]
+        if path == METRICS_PATH:
+            body, headers = self.app.get_metrics()
+            await self.send_response(send, 200, headers, body)
+            return
+
+        timer = RequestTimer()
+        if path.startswith(self.static_prefix):
+            with timer.measure("static"):
+                filepath = self.find_static_file(path[len(self.static_prefix):])
+            if filepath:
+                timer.route = STATIC_ROUTE
+                await self.serve_static(scope, send, filepath, timer)
+                self.app.log_request(self.get_environ(scope), timer)
+                return
+
+        environ = self.get_environ(scope)
+        loop = asyncio.get_running_loop()
+        body, status, headers = await loop.run_in_executor(
+            self.executor, self.call, environ, timer
+        )
+        headers.append(("Server-Timing", timer.header()))
+        if isinstance(body, bytes):
+            await self.send_response(send, status, headers, body)
+        else:
+            await self.send_stream(send, status, headers, body)
+        self.app.log_request(environ, timer)
+
+    def call(self, environ, timer):
+        """Starts rendering the page. Runs in the thread pool."""
+        with timer.measure("resolve"):
+            request = Request(environ)
+        body, status, headers = self.app.call(request, timer)
+        if isinstance(body, (str, bytes)):
+            if hasattr(body, "encode"):
+                body = body.encode("utf8")
+            headers.append(("Content-Length", str(len(body))))
+        return body, int(status.split(" ", 1)[0]), headers
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._pid = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def find_static_file(self, relpath):
+        relpath = posixpath.normpath(relpath or ".")
+        if relpath.startswith(("../", "/")) or relpath == "..":
+            return None
+        filepath = os.path.join(self.static_path, relpath)
+        if os.path.isdir(filepath):
+            filepath = os.path.join(filepath, "index.html")
+        return filepath if os.path.isfile(filepath) else None
+
+    def find_precompressed(self, filepath, accept_encoding):
+        """Returns the path and encoding of the best precompressed sibling of
+        `filepath` the client accepts, if it's current, or `(filepath, None)`.
+        """
+        if not is_compressible(filepath):
+            return filepath, None
+        encodings = {}
+        for encoding, (suffix, _) in ENCODINGS.items():
+            try:
+                stat = os.stat(filepath + suffix)
+            except OSError:
+                continue
+            if stat.st_mtime_ns == os.stat(filepath).st_mtime_ns:
+                encodings[encoding] = filepath + suffix
+        encoding = choose_encoding(accept_encoding, encodings)
+        if encoding is None:
+            return filepath, None
+        return encodings[encoding], encoding
+
+    async def serve_static(self, scope, send, filepath, timer):
+        loop = asyncio.get_running_loop()
+        with timer.measure("static"):
+            mime = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+            accept_encoding = dict(scope.get("headers", [])).get(b"accept-encoding", b"")
+            filepath, encoding = await loop.run_in_executor(
+                None, self.find_precompressed, filepath, accept_encoding.decode("latin-1")
+            )
+            stat = await loop.run_in_executor(None, os.stat, filepath)
+            headers = [
+                ("Content-Type", mime),
+                ("Content-Length", str(stat.st_size)),
+                ("Last-Modified", formatdate(stat.st_mtime, usegmt=True)),
+                ("Cache-Control", "no-cache"),
+            ]
+            if is_compressible(filepath) or encoding:
+                headers.append(("Vary", "Accept-Encoding"))
+            if encoding:
+                headers.append(("Content-Encoding", encoding))
+        headers.append(("Server-Timing", timer.header()))
+        await send({"type": "http.response.start", "status": 200, "headers": _encode(headers)})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        fileobj = await loop.run_in_executor(None, open, filepath, "rb")
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, fileobj.read, self.chunk_size)
+                more_body = len(chunk) == self.chunk_size
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not more_body:
+                    break
+        finally:
+            fileobj.close()
+
+    async def send_response(self, send, status, headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": _encode(headers)})
+        size = self.chunk_size
+        for start in range(0, len(body), size):
+            end = start + size
+            await send({
+                "type": "http.response.body",
+                "body": body[start:end],
+                "more_body": end < len(body),
+            })
+        if not body:
+            await send({"type": "http.response.body", "body": b""})
+
+    async def send_stream(self, send, status, headers, chunks):
+        """Sends the `chunks` of a page as they are rendered, each one
+        in the thread pool.
+        """
+        await send({"type": "http.response.start", "status": status, "headers": _encode(headers)})
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                body = chunk.encode("utf8") if isinstance(chunk, str) else chunk
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    def run(self, host, port):  # pragma: no cover
+        asgi_server.run(
+            self, host, port, on_start=lambda _: _display_running_message(host, port)
+        )
+
+    def get_environ(self, scope):
+        """Translates the ASGI scope into the WSGI keys `Request` uses."""
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            # Like in WSGI, the path is decoded as latin-1
+            "PATH_INFO": scope["path"].encode("utf8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "REMOTE_ADDR": (scope.get("client") or ("127.0.0.1", 0))[0],
+        }
+        for name, value in scope.get("headers", []):
+            key = "HTTP_" + name.decode("latin-1").upper().replace("-", "_")
+            environ[key] = value.decode("latin-1")
+        return environ
+
+
+def _encode(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+def make_asgi_app(clay, max_workers=None):
+    return ASGIApp(clay, max_workers=max_workers)
+
+
+def create_app():
+    """App factory for external ASGI servers."""
+    return make_asgi_app(Clay(os.environ.get("CLAY_SOURCE", ".")))
@@ -0,0 +1,119 @@
+"""Server for the static version of a project, the `build` folder.
+
+Unlike the development server, it doesn't render anything: the files are
+indexed once, at startup, with their headers already computed, and served
+with `wsgi.file_wrapper` (that gunicorn implements with `sendfile`).
+
+    clay serve --workers 4
+
+"""
+import os
+
+from whitenoise import WhiteNoise
+from whitenoise.scantree import scantree
+
+from .server import GunicornMiddleware, _display_running_message
+from .utils.compress import SUFFIXES
+from .utils.fingerprint import AssetManifest
+
+
+__all__ = ("BuildServer", "make_build_app")
+
+NOT_FOUND_PAGES = ("not-found.html", "404.html")
+
+
+class BuildServer(WhiteNoise):
+    """Serves the files of the `root` folder, indexed at startup.
+
+    Like any WhiteNoise app, each file has its `Content-Type`, `ETag` and
+    `Last-Modified` headers precomputed, and it's sent precompressed if the
+    client accepts it and there is a `.gz` or `.br` copy of it as current
+    as the file. The fingerprinted files, those whose URLs are in
+    `fingerprinted`, are sent with headers to cache them forever.
+
+    The hidden files are never served. The files added or changed after the
+    server starts aren't seen until it restarts.
+    """
+
+    def __init__(self, root, fingerprinted=(), **kwargs):
+        self.fingerprinted = frozenset(fingerprinted)
+        kwargs.setdefault("index_file", True)
+        kwargs.setdefault("immutable_file_test", self.is_fingerprinted)
+        kwargs["autorefresh"] = False
+        self.not_found_body = None
+        super().__init__(self.not_found, root=root, **kwargs)
+        for name in NOT_FOUND_PAGES:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    self.not_found_body = f.read()
+                break
+
+    def update_files_dictionary(self, root, prefix):
+        stat_cache = {
+            path: stat for path, stat in scantree(root)
+            if not _is_hidden(path[len(root):])
+        }
+        # A compressed copy not updated with its file would send old content
+        for path in list(stat_cache):
+            if _is_stale_variant(path, stat_cache):
+                del stat_cache[path]
+        for path in stat_cache:
+            url = prefix + path[len(root):].replace("\\", "/")
+            self.add_file_to_dictionary(url, path, stat_cache=stat_cache)
+
+    def is_fingerprinted(self, path, url):
+        return url in self.fingerprinted
+
+    def add_mime_headers(self, headers, path, url):
+        # Like WhiteNoise's, but without quoting the charset
+        media_type = self.media_types.get_type(path)
+        if media_type.startswith("text/") or media_type == "application/javascript":
+            media_type = f"{media_type}; charset={self.charset}"
+        headers["Content-Type"] = media_type
+
+    def not_found(self, environ, start_response):
+        if self.not_found_body is None:
+            body = f"File {environ.get('PATH_INFO', '/')} not found.".encode("utf8")
+            mime = "text/plain; charset=utf-8"
+        else:
+            body = self.not_found_body
+            mime = "text/html; charset=utf-8"
+        start_response("404 Not Found", [
+            ("Content-Type", mime),
+            ("Content-Length", str(len(body))),
+        ])
+        return [body]
+
+    def run(self, host, port, **options):  # pragma: no cover
+        server = GunicornMiddleware(
+            self,
+            bind=f"{host}:{port}",
+            accesslog="-",
+            access_log_format="%(h)s %(m)s %(U)s -> HTTP %(s)s",
+            on_starting=lambda server: _display_running_message(host, port),
+            **options,
+        )
+        server.run()
+
+
+def _is_hidden(relpath):
+    return any(part.startswith(".") for part in relpath.replace("\\", "/").split("/"))
+
+
+def _is_stale_variant(path, stat_cache):
+    for suffix in SUFFIXES:
+        if path.endswith(suffix):
+            stat = stat_cache.get(path[: -len(suffix)])
+            return stat is not None and stat.st_mtime_ns != stat_cache[path].st_mtime_ns
+    return False
+
+
+def make_build_app(clay, **kwargs):
+    """Returns a `BuildServer` for the `build` folder of `clay`. Only the
+    files named by the last fingerprinted build are cached forever.
+    """
+    assets = AssetManifest(clay.source_path, clay.build_path, folder=clay.state_path)
+    assets.load()
+    kwargs.setdefault("fingerprinted", ("/" + name for name in assets.assets.values()))
+    return BuildServer(str(clay.build_path), **kwargs)
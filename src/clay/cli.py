@@ -3,6 +3,8 @@ from pathlib import Path
 
 import proper_cli
 
+from .asgi import make_asgi_app
+from .build_server import make_build_app
 from .main import BLUEPRINT, STATIC_FOLDER, Clay
 from .server import make_app
 from .utils import vcs
@@ -14,7 +16,12 @@ from .utils.name_generator import get_random_name
 class ClayCLI(proper_cli.Cli):
     """Welcome to Clay"""
 
-    def new(self, dest: str = "", tmpl: str | Path = BLUEPRINT) -> None:
+    def new(
+        self,
+        dest: str = "",
+        tmpl: str | Path = BLUEPRINT,
+        sandbox: bool = True,
+    ) -> None:
         """Creates a new Clay project at `dest`
 
         The `clay new` command creates a new Clay project with a default
@@ -23,6 +30,8 @@ class ClayCLI(proper_cli.Cli):
         Arguments:
         - dest: Where to create the new project.
         - tmpl: Optional template to use to create the project.
+        - sandbox: Render the template in a sandbox. Use `--no-sandbox` only
+          with templates you trust. `True` by default.
 
         You can also specify an optional project template as can be an absolute or
         relative path or a git URL. For the URLs, "gh:" works as a shortcut of
@@ -60,6 +69,7 @@ class ClayCLI(proper_cli.Cli):
             block_end_string="%]",
             variable_start_string="[[",
             variable_end_string="]]",
+            sandbox=sandbox,
         )
         render(name=dest)
 
@@ -67,7 +77,16 @@ class ClayCLI(proper_cli.Cli):
         print(" and do `clay run` to start the server.\n")
 
     def run(
-        self, host: str = "0.0.0.0", port: int = 8080, source: str = "."
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        source: str = ".",
+        livereload: bool = False,
+        asgi: bool = False,
+        workers: int = 1,
+        worker_class: str = "",
+        threads: int = 1,
+        preload: bool = False,
     ) -> None:  # pragma: no cover
         """Runs Clay development server.
 
@@ -75,23 +94,113 @@ class ClayCLI(proper_cli.Cli):
         - host: 0.0.0.0 by default
         - port: 8080 by default
         - source: Where to find the project. By default in the current folder.
+        - livereload: Reload the open pages when the templates they use change,
+          and update the stylesheets without reloading. `False` by default.
+        - asgi: Use the ASGI server, that renders the pages concurrently on
+          a pool of `threads` threads. It doesn't support `livereload` nor
+          the other options below. `False` by default.
+        - workers: Number of server processes. 1 by default.
+        - worker_class: "sync" or "gthread". By default "gthread" if
+          `threads` is more than 1, or "sync" otherwise.
+        - threads: Number of threads of each worker. 1 by default.
+        - preload: Compile the templates before starting the workers, so they
+          share them instead of compiling their own. `False` by default.
         """
         clay = Clay(source)
-        app = make_app(clay)
-        app.run(host, port)
+        if asgi:
+            threads = int(threads)
+            app = make_asgi_app(clay, max_workers=threads if threads > 1 else None)
+            app.run(host, int(port))
+            return
+        app = make_app(clay, livereload=livereload)
+        app.run(
+            host,
+            int(port),
+            workers=workers,
+            worker_class=worker_class or None,
+            threads=threads,
+            preload=preload,
+        )
 
-    def build(self, source: str = ".", raw: bool = False) -> None:
+    def build(
+        self,
+        source: str = ".",
+        raw: bool = False,
+        jobs: int = 1,
+        incremental: bool = False,
+        sync: bool = False,
+        link: bool = False,
+        profile: bool = False,
+        compress: bool = False,
+        fingerprint: bool = False,
+    ) -> None:
         """Generates a static copy of the project in a `build` folder.
 
         Arguments:
         - source: Where to find the project. By default in the current folder.
         - raw: Do not relativize URLs. `False` by default.
+        - jobs: Number of processes used to render the pages. 1 by default.
+        - incremental: Only render again the pages that have changed, or that
+          use a template that has changed, since the last incremental build.
+          `False` by default.
+        - sync: Only copy again the static files that have changed since the
+          last build. Implied by `incremental`. `False` by default.
+        - link: Use hard links instead of copies for the static files.
+          Use it only for read-only deploys. `False` by default.
+        - profile: Print a report of the time spent on each page and template,
+          and save it, in JSON and speedscope formats, in the project folder.
+          Implies `jobs=1`. The peak memory is measured too, which makes
+          every time longer. `False` by default.
+        - compress: Also write a compressed `.gz` copy (and `.br`, if the
+          `brotli` package is installed) of the text files bigger than
+          `compress_min_size`. Only the copies of the files that changed are
+          made again. `False` by default.
+        - fingerprint: Add a hash of their content to the names of the static
+          files, so they can be cached forever, and update the references
+          to them in the pages and stylesheets. `False` by default.
         """
         clay = Clay(source, relativize_urls=not raw)
-        clay.build()
+        clay.build(
+            jobs=int(jobs),
+            incremental=incremental,
+            sync=sync,
+            link=link,
+            profile=profile,
+            compress=compress,
+            fingerprint=fingerprint,
+        )
         print("\n Done! You'll find a static version of your ")
         print(" project in the `build` folder.\n")
 
+    def serve(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        source: str = ".",
+        workers: int = 1,
+        threads: int = 1,
+    ) -> None:  # pragma: no cover
+        """Serves the static version of the project, in the `build` folder,
+        as a production server would.
+
+        The files are indexed when the server starts, so restart it after
+        building again. Their `.gz` and `.br` copies, made with
+        `clay build --compress`, are used when the browser accepts them.
+
+        Arguments:
+        - host: 0.0.0.0 by default
+        - port: 8080 by default
+        - source: Where to find the project. By default in the current folder.
+        - workers: Number of server processes. 1 by default.
+        - threads: Number of threads of each worker. 1 by default.
+        """
+        clay = Clay(source)
+        if not clay.build_path.is_dir():
+            print("\n There is no `build` folder. Run `clay build` first.\n")
+            return
+        app = make_build_app(clay)
+        app.run(host, int(port), workers=int(workers), threads=int(threads))
+
     def pages(self, source: str = ".") -> None:
         """Prints a list of the available pages
 
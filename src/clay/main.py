@@ -1,5 +1,6 @@
 import os
 import random
+from contextlib import nullcontext
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -7,10 +8,21 @@ import jinja2
 import yaml
 
 from .utils.binaries import KNOWN_BINARIES
-from .utils.blueprint_render import BlueprintRender
+from .utils.blueprint_render import BlueprintRender, printf
+from .utils.bytecode_cache import ClayBytecodeCache
+from .utils.compress import compress_tree
+from .utils.jinja_fragment_cache import (
+    FragmentCache,
+    FragmentCacheExtension,
+    fragment_depends_on,
+)
 from .utils.jinja_includewith import IncludeWith
 from .utils.load_config import load_config
-from .utils.make_matcher import make_filter, make_matcher
+from .utils.make_matcher import make_filter, make_matcher, make_pruner
+from .utils.page_index import PageIndex
+from .utils.profiler import BuildProfiler
+from .utils.render_cache import mark_volatile, no_cache
+from .utils.walk import TreeWalker
 
 
 MESSAGES = [
@@ -29,14 +41,46 @@ MESSAGES = [
 
 BUILD_FOLDER = "build"
 STATIC_FOLDER = "static"
+PROFILE_FILE = ".clay-profile.json"
+# Where the manifests of the incremental and fingerprinted builds are kept,
+# outside the build folder, so they aren't published with it
+STATE_FOLDER = ".clay_cache"
+SPEEDSCOPE_FILE = ".clay-profile.speedscope.json"
+# Dependencies of the cached fragments that list the pages or link to
+# fingerprinted static files
+PAGES_SIGNATURE = ":pages"
+ASSETS_SIGNATURE = ":assets"
 
 
 def utcnow():
+    mark_volatile()
     return datetime.now(tz=timezone.utc)
 
 
+class VolatileDatetime(datetime):
+    """The `datetime` of the templates. Asking it for the current time
+    makes the page volatile, like `now()`.
+    """
+
+    @classmethod
+    def now(cls, tz=None):
+        mark_volatile()
+        return datetime.now(tz)
+
+    @classmethod
+    def utcnow(cls):
+        mark_volatile()
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    @classmethod
+    def today(cls):
+        mark_volatile()
+        return datetime.today()
+
+
 @jinja2.pass_context
 def shuffle(context, value):
+    mark_volatile()
     iter = value[:]
     random.shuffle(iter)
     return iter
@@ -49,7 +93,8 @@ JINJA_GLOBALS = {
     "map": map,
     "zip": zip,
     "len": len,
-    "datetime": datetime,
+    "datetime": VolatileDatetime,
+    "no_cache": no_cache,
 }
 JINJA_FILTERS = {"shuffle": shuffle}
 
@@ -67,10 +112,50 @@ DEFAULT_CONFIG = {
         "package.json",
         "package-lock.json",
     ),
-    "include": ("favicon.ico"),
-    "jinja_extensions": (IncludeWith,),
+    "include": ("favicon.ico",),
+    "jinja_extensions": (IncludeWith, FragmentCacheExtension),
+    # Render the templates in a sandbox, that checks every attribute access
+    # and call. Use `false` to render faster the templates you trust.
+    "sandbox": True,
     "binaries": [],
+    # Folder, relative to the project, where the compiled templates are stored
+    # between runs. Use `false` to disable it.
+    "bytecode_cache": ".clay_cache",
+    # Maximum size, in megabytes, of the `bytecode_cache` folder.
+    "bytecode_cache_max_size": 100,
+    # How many compiled templates are kept in memory.
+    "cache_size": 400,
+    # Maximum size, in megabytes, of the rendered pages the server keeps
+    # in memory. Use 0 to disable it.
+    "render_cache_size": 64,
+    # Shell-style patterns of pages the server must always render again.
+    # Pages using `now()`, `shuffle` or `no_cache()` are never cached.
+    "render_cache_exclude": [],
+    # Maximum size, in megabytes, of the fragments rendered by the
+    # `{% cache %}` tag kept in memory. Use 0 to disable it.
+    "fragment_cache_size": 16,
+    # Folder, relative to the project, where those fragments are also stored
+    # between builds. Use `false` (the default) to keep them only in memory.
+    "fragment_cache_folder": False,
+    # Fraction of the requests to the server that are logged, with their
+    # timings, at the DEBUG level of the `clay.server` logger.
+    "log_sample_rate": 1.0,
+    # Text files smaller than this, in bytes, are never compressed, neither
+    # by `clay build --compress` nor by the server.
+    "compress_min_size": 1024,
 }
+# Folders that never have templates, so the server doesn't watch them
+UNWATCHED_PATTERNS = (
+    f"{BUILD_FOLDER}/*",
+    f"{STATE_FOLDER}/*",
+    ".git/*",
+    ".hg/*",
+    ".svn/*",
+    "node_modules/*",
+    "*/node_modules/*",
+    "__pycache__/*",
+    "*/__pycache__/*",
+)
 EXCLUDE_PAGE_PATTERNS = (
     "clay.yaml",
     "clay.yml",
@@ -86,17 +171,39 @@ class Clay:
         self.source_path = Path(source_path).resolve()
         self.build_path = self.source_path / BUILD_FOLDER
         self.static_path = self.source_path / STATIC_FOLDER
+        self.state_path = self.source_path / STATE_FOLDER
         self.config = config = self.load_config()
 
         must_exclude = make_matcher(config["exclude"])
         must_include = make_matcher(config["include"])
         self.must_filter = make_filter(must_exclude, must_include)
         self.is_binary = make_matcher(config["binaries"])
+        self.must_prune = make_pruner(
+            config["exclude"], config["include"], src=self.source_path
+        )
+        # Unlike `must_prune`, it keeps the folders of the layouts and
+        # partials (like `_layouts/`), so their changes are noticed.
+        self.must_prune_index = make_pruner(
+            UNWATCHED_PATTERNS
+            + tuple(
+                f"{folder}/*"
+                for folder in (config["bytecode_cache"], config["fragment_cache_folder"])
+                if folder
+            )
+        )
+
+        self.bytecode_cache = None
+        if config["bytecode_cache"]:
+            self.bytecode_cache = ClayBytecodeCache(
+                self.source_path / config["bytecode_cache"],
+                max_size=int(config["bytecode_cache_max_size"]) * 1024 * 1024,
+            )
 
         globals_ = JINJA_GLOBALS.copy()
         globals_.update(
             {
                 "list_pages": self.list_pages,
+                "asset_url": self.asset_url,
             }
         )
         self.render = BlueprintRender(
@@ -104,13 +211,37 @@ class Clay:
             dst=self.build_path,
             must_filter=self.must_filter,
             is_binary=self.is_binary,
+            must_prune=self.must_prune,
             static_folder=STATIC_FOLDER,
+            state_folder=self.state_path,
             globals_=globals_,
             filters_=JINJA_FILTERS,
             extensions=config["jinja_extensions"],
             relativize_urls=relativize_urls,
+            bytecode_cache=self.bytecode_cache,
+            cache_size=int(config["cache_size"]),
+            sandbox=bool(config["sandbox"]),
         )
         self.exclude_page = make_matcher(self.config["exclude"] + EXCLUDE_PAGE_PATTERNS)
+        self.prune_page = make_pruner(self.config["exclude"] + EXCLUDE_PAGE_PATTERNS)
+        self.page_index = PageIndex(
+            self.source_path, must_prune=self.prune_page, exclude=self.exclude_page
+        )
+
+        self.fragment_cache = None
+        if config["fragment_cache_size"] or config["fragment_cache_folder"]:
+            folder = config["fragment_cache_folder"]
+            self.fragment_cache = FragmentCache(
+                self.source_path,
+                folder=self.source_path / folder if folder else None,
+                max_size=int(config["fragment_cache_size"]) * 1024 * 1024,
+            )
+            self.fragment_cache.signatures.update({
+                PAGES_SIGNATURE: self.page_index.signature,
+                ASSETS_SIGNATURE: self.render.assets_signature,
+            })
+        self.render.render.env.fragment_cache = self.fragment_cache
+        self.render.signatures[PAGES_SIGNATURE] = self.page_index.signature
 
     def file_exists(self, path):
         if self.must_filter(path):
@@ -120,37 +251,151 @@ class Clay:
     def render_file(self, path, **data):
         return self.render.render_content(path, **data)
 
-    def build(self, **data):
-        self.render(**data)
+    def stream_file(self, path, **data):
+        """Like `render_file`, but returns an iterator of chunks."""
+        return self.render.stream_content(path, **data)
+
+    def asset_url(self, url):
+        """Template global that returns the URL of a static file with its
+        fingerprinted name, when building with `fingerprint=True`:
+        `{{ asset_url('/static/main.js') }}`.
+        """
+        fragment_depends_on(ASSETS_SIGNATURE)
+        return self.render.asset_url(url)
+
+    @property
+    def dependencies(self):
+        """Names of the templates used by the last page rendered."""
+        return self.render.render.dependencies
+
+    def build(
+        self,
+        jobs=1,
+        incremental=False,
+        sync=False,
+        link=False,
+        profile=False,
+        compress=False,
+        fingerprint=False,
+        **data,
+    ):
+        profiler = BuildProfiler() if profile else None
+        if profiler:
+            profiler.start()
+        try:
+            self._build(
+                jobs=jobs,
+                incremental=incremental,
+                sync=sync,
+                link=link,
+                profiler=profiler,
+                compress=compress,
+                fingerprint=fingerprint,
+                **data,
+            )
+        finally:
+            # Even if the build failed, so the templates aren't left patched
+            if profiler:
+                self.render.profiler = self.render.render.env.profiler = None
+                profiler.stop()
+
+        if profiler:
+            self.save_profile(profiler)
         self.print_random_messages(num=3)
 
-    def list_pages(self, folder=".", sub=True):
-        """List all the available pages outside the static and build folders.
+    def _build(self, *, jobs, incremental, sync, link, profiler, compress, fingerprint, **data):
+        # Once for the whole build, and before forking any workers
+        self.page_index.scan()
 
-        If `folder` is not None, it list only the pages inside that folder.
-        Use `folder="."` to show the pages of the root folder but not those in subfolders
+        fragments = self.fragment_cache
+        hits, misses = (fragments.hits, fragments.misses) if fragments is not None else (0, 0)
+        # The sources don't change during the build
+        with fragments.frozen() if fragments is not None else nullcontext():
+            self.render(
+                jobs=jobs,
+                incremental=incremental,
+                sync=sync,
+                link=link,
+                profiler=profiler,
+                fingerprint=fingerprint,
+                **data,
+            )
+        if fragments is not None and (fragments.hits, fragments.misses) != (hits, misses):
+            printf(
+                "fragments",
+                f"{fragments.hits - hits} cached, {fragments.misses - misses} rendered",
+                color="white",
+            )
+        if compress:
+            self.compress_build()
+
+    def warm_up(self):
+        """Compiles the templates of the project, up to `cache_size`,
+        so they are ready before the first request.
+
+        Called by `clay run --preload` before starting the workers, so they
+        all share the compiled templates instead of compiling their own.
+        Returns the number of templates compiled.
         """
-        source_path = self.source_path / folder.replace("..", "")
+        env = self.render.render.env
+        limit = int(self.config["cache_size"])
+        # Unlike the pages, the partials and layouts can start with "_"
+        must_prune = make_pruner(
+            [pattern for pattern in self.config["exclude"] if not pattern.startswith("_")]
+            + list(EXCLUDE_PAGE_PATTERNS)
+        )
+        count = 0
+        for _, relpath, files in TreeWalker(self.source_path, must_prune=must_prune):
+            for file in files:
+                name = os.path.join(relpath, file).replace(os.sep, "/")
+                if self.is_binary(name) or name in EXCLUDE_PAGE_PATTERNS:
+                    continue
+                try:
+                    env.get_template(name)
+                except (jinja2.TemplateError, UnicodeDecodeError):
+                    continue
+                count += 1
+                if count >= limit:
+                    return count
+        return count
 
-        pages = []
-        for root, _, files in os.walk(source_path):
-            relpath = str(Path(root).relative_to(source_path))
-            if relpath == ".":
-                relpath = ""
+    def compress_build(self):
+        """Writes the precompressed siblings of the text files of the build."""
+        compressed, skipped = compress_tree(
+            self.build_path,
+            min_size=int(self.config["compress_min_size"]),
+        )
+        printf("compressed", f"{compressed} files ({skipped} already current)", color="white")
+
+    def save_profile(self, profiler):
+        print()
+        print(profiler.summary())
+        profiler.save(
+            self.source_path / PROFILE_FILE,
+            speedscope_path=self.source_path / SPEEDSCOPE_FILE,
+        )
+        print(f"\n Profile saved to `{PROFILE_FILE}` and `{SPEEDSCOPE_FILE}`")
+        print(" (open the last one in https://www.speedscope.app)\n")
 
-            if relpath and not sub:
-                break
+    def list_pages(self, folder=".", sub=True, sort=None, reverse=False, page=None, per_page=None):
+        """List all the available pages outside the static and build folders.
 
-            if self.exclude_page(relpath):
-                continue
+        If `folder` is not None, it list only the pages inside that folder.
+        Use `sub=False` to show the pages of that folder but not those in
+        its subfolders.
 
-            for file in sorted(files):
-                page = os.path.join(relpath, file)
-                if self.exclude_page(page):
-                    continue
-                pages.append(page)
+        By default, the files of the folder come first and then those of its
+        subfolders, but they can be sorted by "path", "size", "mtime" or any
+        field of their metadata, and split in pages of `per_page` pages.
+        See `PageIndex.list()`.
 
-        return pages
+        The pages are indexed once, so calling it again is cheap.
+        """
+        fragment_depends_on(PAGES_SIGNATURE)
+        self.render.render.depends_on(PAGES_SIGNATURE)
+        return self.page_index.list(
+            folder, sub=sub, sort=sort, reverse=reverse, page=page, per_page=per_page
+        )
 
     def load_config(self):
         try:
@@ -164,7 +409,7 @@ class Clay:
 
         config["binaries"] = tuple(set(config["binaries"] + KNOWN_BINARIES))
 
-        for key in "exclude,include,jinja_extensions".split(","):
+        for key in "exclude,include,jinja_extensions,render_cache_exclude".split(","):
             config[key] = tuple(config[key])
         return config
 
@@ -1,4 +1,7 @@
+import itertools
+import logging
 import mimetypes
+import random
 import socket
 from urllib.parse import quote
 
@@ -6,9 +9,23 @@ import gunicorn.app.base
 from whitenoise import WhiteNoise
 
 from .utils.active import make_active_helper
+from .utils.compress import choose_encoding, compress, is_compressible
+from .utils.livereload import LIVERELOAD_PATH, LiveReload
+from .utils.make_matcher import make_matcher
+from .utils.metrics import Metrics, RequestTimer
+from .utils.render_cache import RenderCache
 from .utils.request import Request
+from .utils.source_index import SourceIndex
 
 
+logger = logging.getLogger("clay.server")
+
+METRICS_PATH = "/__clay/metrics"
+STATIC_ROUTE = "static"
+NOT_FOUND_ROUTE = "not_found"
+WORKER_CLASSES = ("sync", "gthread")
+LIVERELOAD_THREADS = 32
+
 def _get_local_ip():
     ip = socket.gethostbyname(socket.gethostname())
     if not ip.startswith("127."):
@@ -70,15 +87,67 @@ class GunicornMiddleware(gunicorn.app.base.BaseApplication):
 
 
 class WSGIApp:
-    def __init__(self, clay):
+    def __init__(self, clay, livereload=False):
         self.clay = clay
+        config = clay.config
+        self.render_cache = RenderCache(
+            clay.source_path,
+            max_size=int(config["render_cache_size"]) * 1024 * 1024,
+        )
+        self.no_cache = make_matcher(config["render_cache_exclude"])
+        self.index = SourceIndex(
+            clay.source_path,
+            must_filter=clay.must_filter,
+            must_prune=clay.must_prune_index,
+        )
+        self.index.listeners.append(self.update_pages)
+        self.metrics = Metrics()
+        self.log_sample_rate = float(config["log_sample_rate"])
+        self.compress_min_size = int(config["compress_min_size"])
+        self.livereload = None
+        if livereload:
+            self.livereload = LiveReload(self.index, static_folder=clay.static_path.name)
+
+    def update_pages(self, changed):
+        """Keeps the pages listed by `list_pages()` up to date. The cached
+        pages could be using the old lists, so they are rendered again.
+        """
+        if self.clay.page_index.update(changed):
+            self.render_cache.clear()
 
     def __call__(self, environ, start_response):
-        return self.wsgi(environ, start_response)
+        if environ.get("PATH_INFO") == METRICS_PATH:
+            return self.serve_metrics(start_response)
+        if self.livereload and environ.get("PATH_INFO") == LIVERELOAD_PATH:
+            return self.serve_livereload(environ, start_response)
+
+        timer = RequestTimer()
+        environ["clay.timer"] = timer
+
+        def timed_start_response(status, headers, exc_info=None):
+            if timer.route is None:
+                # Not handled by `wsgi`, so it was served by WhiteNoise
+                timer.route = STATIC_ROUTE
+                timer.phases["static"] = timer.elapsed
+            headers.append(("Server-Timing", timer.header()))
+            return start_response(status, headers, exc_info)
+
+        response = self.wsgi(environ, timed_start_response)
+        if isinstance(response, list) or timer.route == STATIC_ROUTE:
+            self.log_request(environ, timer)
+            return response
+        # Streamed, so it's logged after the server sends the whole page
+        return _ClosingIterator(response, lambda: self.log_request(environ, timer))
 
     def wsgi(self, environ, start_response):
-        request = Request(environ)
-        body, status, headers = self.call(request)
+        timer = environ.get("clay.timer") or RequestTimer()
+        with timer.measure("resolve"):
+            request = Request(environ)
+        body, status, headers = self.call(request, timer)
+        if not isinstance(body, (str, bytes)):
+            # Without a `Content-Length`, the response is sent in chunks
+            start_response(status, headers)
+            return _encode_chunks(body)
         if hasattr(body, "encode"):
             body = body.encode("utf8")
 
@@ -86,58 +155,296 @@ class WSGIApp:
         start_response(status, headers)
         return [body]
 
-    def call(self, request):
-        path = request.path
-        print(path)
-        if not self.clay.file_exists(path):
-            print("file doesnt exists", path)
-            path += "/index.html"
-            if not self.clay.file_exists(path):
-                return self.not_found(request)
+    def call(self, request, timer=None):
+        timer = timer or RequestTimer()
+        with timer.measure("resolve"):
+            path = request.path
+        with timer.measure("exists"):
+            found = self.index.exists(path)
+            if not found:
+                path += "/index.html"
+                found = self.index.exists(path)
+        if not found:
+            timer.route = NOT_FOUND_ROUTE
+            with timer.measure("render"):
+                body, status, headers = self.not_found(request)
+            if not isinstance(body, str):
+                body = _measure_chunks(body, timer, "render")
+            return body, status, headers
 
-        active = make_active_helper(request)
+        timer.route = path
         if request.method == "HEAD":
             body = ""
         else:
-            print("rendering file", path)
-            body = self.clay.render_file(path, request=request, active=active)
+            with timer.measure("render"):
+                body = self.render(path, request)
+            if not isinstance(body, (str, bytes)):
+                # The rest of the page is rendered while it's being sent
+                body = _measure_chunks(body, timer, "render")
         mime = mimetypes.guess_type(path)[0] or "text/plain"
+        if self.livereload and mime == "text/html" and body:
+            if isinstance(body, str):
+                body = self.livereload.inject(body, path)
+            elif not isinstance(body, bytes):
+                body = self.livereload.inject_stream(body, path)
         response_headers = [("Content-Type", mime)]
+        if isinstance(body, str) and is_compressible(path) and not self.livereload:
+            body = self.compress(path, request, body, response_headers)
         return body, "200 OK", response_headers
 
+    def render(self, path, request):
+        """Renders the page at `path`, or returns it from the render cache
+        if none of its templates have changed since.
+
+        The cached pages are keyed by everything of the request they can use
+        to render: the file, the URL path that was requested (`/foo`, `/foo/`
+        and `/foo/index.html` are the same file), the query and if it's an
+        AJAX request.
+
+        Otherwise, returns an iterator of the chunks of the page, with the
+        first one already rendered so any early error can still be reported.
+        """
+        cache = self.render_cache
+        if not cache.max_size or self.no_cache(path):
+            return _prime(self.render_page(path, request))
+
+        key = self.cache_key(path, request)
+        body = cache.get(key)
+        if body is not None:
+            return body
+
+        return _prime(self.cache_page(key, self.render_page(path, request)))
+
+    def cache_key(self, path, request):
+        environ = request.environ
+        return (
+            path,
+            environ.get("PATH_INFO", ""),
+            environ.get("QUERY_STRING", ""),
+            request.ajax,
+        )
+
+    def compress(self, path, request, body, headers):
+        """Returns the cached `body` compressed with the best encoding the
+        client accepts, adding the headers to `headers`.
+
+        The compressed body is saved with the cached one, so each version
+        of a page is compressed once and not on every request.
+        """
+        headers.append(("Vary", "Accept-Encoding"))
+        if len(body) < self.compress_min_size:
+            return body
+        encoding = choose_encoding(request.environ.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None:
+            return body
+        headers.append(("Content-Encoding", encoding))
+        return self.render_cache.get_compressed(
+            self.cache_key(path, request), body, encoding, compress
+        )
+
+    def cache_page(self, key, chunks):
+        """Yields the `chunks` of a page and, at the end, saves it in the
+        render cache unless it's volatile or too big.
+        """
+        cache = self.render_cache
+        tracker = {"volatile": False}
+        parts = []
+        size = 0
+        for chunk in cache.track_stream(chunks, tracker):
+            if parts is not None:
+                size += len(chunk)
+                parts.append(chunk)
+                if size > cache.max_size or not isinstance(chunk, str):
+                    parts = None
+            yield chunk
+        if parts is not None and not tracker["volatile"]:
+            cache.set(key, "".join(parts), self.clay.dependencies)
+
+    def render_page(self, path, request, page=None):
+        """Generator of the chunks of the page."""
+        active = make_active_helper(request)
+        yield from self.clay.stream_file(path, request=request, active=active)
+        if self.livereload:
+            binary = self.clay.is_binary(path)
+            dependencies = () if binary else self.clay.dependencies
+            self.livereload.record(page or path, dependencies)
+
     def not_found(self, request):
         mime = "text/plain"
         body = f"File {request.path} not found."
-        active = make_active_helper(request)
 
         for path in ["not-found.html", "_notfound.html", "404.html"]:
-            if self.clay.file_exists(path):
+            if self.index.exists(path):
                 mime = "text/html"
-                body = self.clay.render_file(path, request=request, active=active)
+                # Recorded as `request.path`, so the tab reloads if it's created
+                body = self.render_page(path, request, page=request.path)
+                if self.livereload:
+                    body = self.livereload.inject_stream(body, request.path)
+                body = _prime(body)
                 break
 
-        response_headers = [
-            ("Content-Type", mime),
-            ("Content-Length", str(len(body)))
+        return body, "404 Not Found", [("Content-Type", mime)]
+
+    def log_request(self, environ, timer):
+        """Records the timings of the request and logs a sample of them."""
+        elapsed = timer.elapsed
+        self.metrics.observe(timer.route or STATIC_ROUTE, elapsed, timer.phases)
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        if self.log_sample_rate < 1 and random.random() >= self.log_sample_rate:
+            return
+        logger.debug(
+            "%s %s (%s) %.2fms",
+            environ.get("REQUEST_METHOD", "GET"),
+            environ.get("PATH_INFO", "/"),
+            timer.route,
+            elapsed * 1000,
+        )
+
+    def serve_metrics(self, start_response):
+        body, headers = self.get_metrics()
+        start_response("200 OK", headers)
+        return [body]
+
+    def get_metrics(self):
+        extra = _get_cache_metrics("clay_render_cache", self.render_cache.stats())
+        if self.clay.fragment_cache is not None:
+            extra.update(
+                _get_cache_metrics("clay_fragment_cache", self.clay.fragment_cache.stats())
+            )
+        body = self.metrics.to_prometheus(extra).encode("utf8")
+        return body, [
+            ("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+            ("Content-Length", str(len(body))),
+            ("Cache-Control", "no-store"),
         ]
-        return body, "404 Not Found", response_headers
+
+    def serve_livereload(self, environ, start_response):
+        livereload = self.livereload
+        if livereload is None:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Live reload is not enabled."]
+        page = Request(environ).query.get("page") or ""
+        start_response("200 OK", [
+            ("Content-Type", "text/event-stream"),
+            ("Cache-Control", "no-store"),
+            ("X-Accel-Buffering", "no"),
+        ])
+        return livereload.stream(page)
 
     def redirect_to(self, path):
         return "", "302 Found", [("Location", quote(path.encode("utf8")))]
 
-    def run(self, host, port):  # pragma: no cover
+    def get_server_options(self, workers=1, worker_class=None, threads=1, preload=False):
+        """Gunicorn options for running the app with `workers` processes
+        of `threads` threads each.
+        """
+        workers = int(workers or 1)
+        threads = int(threads or 1)
+        if self.livereload and threads == 1:
+            # Each open tab keeps a connection, so a sync worker would block
+            threads = LIVERELOAD_THREADS
+        if not worker_class:
+            worker_class = "gthread" if threads > 1 else "sync"
+        if worker_class not in WORKER_CLASSES:
+            raise ValueError(
+                f"Invalid worker class {worker_class!r}, use one of {WORKER_CLASSES}"
+            )
+        if worker_class == "sync" and threads > 1:
+            raise ValueError("A `sync` worker can't use more than one thread")
+        return {
+            "workers": workers,
+            "worker_class": worker_class,
+            "threads": threads,
+            "preload_app": bool(preload),
+        }
+
+    def run(
+        self, host, port, workers=1, worker_class=None, threads=1, preload=False
+    ):  # pragma: no cover
+        options = self.get_server_options(
+            workers=workers, worker_class=worker_class, threads=threads, preload=preload
+        )
+        if preload:
+            # Forked workers share, copy-on-write, the compiled templates
+            print(f" Compiled {self.clay.warm_up()} templates")
         server = GunicornMiddleware(
             self,
             bind=f"{host}:{port}",
             accesslog="-",
             access_log_format="%(h)s %(m)s %(U)s -> HTTP %(s)s",
-            on_starting=on_starting
+            on_starting=on_starting,
+            **options,
         )
         server.run()
 
 
-def make_app(clay):
-    app = WSGIApp(clay)
+def _prime(chunks):
+    """Renders the first chunk, so the errors at the start of the page are
+    raised before the response starts.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return ""
+    return itertools.chain((first,), chunks)
+
+
+def _measure_chunks(chunks, timer, phase):
+    """Yields the `chunks` of a page, adding the time spent rendering
+    each one to the `phase` of the `timer`.
+    """
+    chunks = iter(chunks)
+    try:
+        while True:
+            with timer.measure(phase):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class _ClosingIterator:
+    """Calls `on_close` when the server closes the response, after sending
+    all of it or when the client goes away.
+    """
+
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._on_close()
+
+
+def _encode_chunks(chunks):
+    for chunk in chunks:
+        if chunk:
+            yield chunk.encode("utf8") if isinstance(chunk, str) else chunk
+
+
+def _get_cache_metrics(prefix, stats):
+    """The hits and misses of a cache only grow, so they are counters."""
+    return {
+        f"{prefix}_{name}_total" if name in ("hits", "misses") else f"{prefix}_{name}": value
+        for name, value in stats.items()
+    }
+
+
+def make_app(clay, livereload=False):
+    app = WSGIApp(clay, livereload=livereload)
     wn = WhiteNoise(
         app.wsgi,
         root=clay.static_path,
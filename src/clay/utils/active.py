@@ -1,17 +1,30 @@
 import re
 from fnmatch import fnmatch
+from functools import lru_cache
 
 
 __all__ = ("make_active_helper", )
 
+RX_INDEX = re.compile(r"index\.html$")
+
 
 def make_active_helper(request):
+    curr_path = None
+
     def active(*url_patterns, partial=False, class_name="active"):
-        curr_path = re.sub("index.html$", "", request.path).strip("/")
+        nonlocal curr_path
+        if curr_path is None:
+            curr_path = _strip_index(request.path)
         for urlp in url_patterns:
-            urlp = re.sub("index.html$", "", urlp.strip("/")).strip("/")
+            urlp = _strip_index(urlp.strip("/"))
             if fnmatch(curr_path, urlp) or (partial and curr_path.startswith(urlp)):
                 return class_name
         return ""
 
     return active
+
+
+# The same patterns are used in every page, like in a navigation
+@lru_cache(maxsize=1024)
+def _strip_index(path):
+    return RX_INDEX.sub("", path).strip("/")
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from urllib.parse import unquote
+
+
+__all__ = ("serve", "run")
+
+MAX_HEADER_SIZE = 64 * 1024
+
+logger = logging.getLogger("clay.server")
+
+
+async def serve(app, host="127.0.0.1", port=8080, on_start=None):
+    """A minimal HTTP/1.1 server for ASGI apps, good enough for development
+    and for testing offline.
+
+    It supports keep-alive connections and streams the responses, using
+    chunked encoding when the app doesn't set a `Content-Length`.
+    It doesn't do TLS, HTTP/2 or websockets.
+    """
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle(app, reader, writer),
+        host,
+        port,
+        limit=MAX_HEADER_SIZE,
+    )
+    async with server:
+        if on_start:
+            on_start(server)
+        await server.serve_forever()
+
+
+def run(app, host="127.0.0.1", port=8080, on_start=None):  # pragma: no cover
+    try:
+        asyncio.run(serve(app, host, port, on_start=on_start))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _handle(app, reader, writer):
+    client = writer.get_extra_info("peername") or ("127.0.0.1", 0)
+    server = writer.get_extra_info("sockname") or ("127.0.0.1", 0)
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+
+            try:
+                method, target, version, headers = _parse_head(head)
+                length = _get_length(headers)
+            except ValueError:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                break
+
+            body = await reader.readexactly(length) if length else b""
+            connection = (_get_header(headers, b"connection") or b"").lower()
+            keep_alive = (
+                connection == b"keep-alive"
+                if version == "1.0"
+                else connection != b"close"
+            )
+
+            path, _, query = target.partition("?")
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0", "spec_version": "2.3"},
+                "http_version": version,
+                "method": method,
+                "scheme": "http",
+                "path": unquote(path),
+                "raw_path": path.encode("latin-1"),
+                "query_string": query.encode("latin-1"),
+                "root_path": "",
+                "headers": headers,
+                "client": client[:2],
+                "server": server[:2],
+            }
+            response = _Response(writer, method, version, keep_alive)
+            try:
+                await app(scope, _make_receive(body), response.send)
+            except Exception:
+                logger.exception("Error handling %s %s", method, target)
+                if not response.started:
+                    writer.write(
+                        b"HTTP/1.1 500 Internal Server Error\r\n"
+                        b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                    )
+                break
+            if not response.finished:
+                response.abort()
+                break
+            await writer.drain()
+            if not response.keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def _parse_head(head):
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, protocol = lines[0].split(" ", 2)
+    if not protocol.startswith("HTTP/"):
+        raise ValueError(protocol)
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+    return method.upper(), target, protocol[5:], headers
+
+
+def _get_header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def _get_length(headers):
+    value = _get_header(headers, b"content-length")
+    if value is None:
+        return 0
+    value = value.strip()
+    if not value.isdigit():
+        raise ValueError(value)
+    return int(value)
+
+
+def _make_receive(body):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # Nothing else will come until the response is sent
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return receive
+
+
+class _Response:
+    def __init__(self, writer, method, version, keep_alive):
+        self.writer = writer
+        self.method = method
+        self.version = version
+        self.keep_alive = keep_alive
+        self.chunked = False
+        self.started = False
+        self.finished = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self._start(message["status"], message.get("headers", []))
+            return
+        if message["type"] != "http.response.body":
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if body and self.method != "HEAD":
+            if self.chunked:
+                self.writer.write(b"%x\r\n%s\r\n" % (len(body), body))
+            else:
+                self.writer.write(body)
+        if not more_body:
+            if self.chunked and self.method != "HEAD":
+                self.writer.write(b"0\r\n\r\n")
+            self.finished = True
+        await self.writer.drain()
+
+    def abort(self):
+        self.keep_alive = False
+
+    def _start(self, status, headers):
+        self.started = True
+        names = {name.lower() for name, _ in headers}
+        if b"content-length" not in names:
+            if self.version == "1.1":
+                self.chunked = True
+                headers = [*headers, (b"transfer-encoding", b"chunked")]
+            else:
+                self.keep_alive = False
+        if not self.keep_alive:
+            headers = [*headers, (b"connection", b"close")]
+
+        try:
+            phrase = HTTPStatus(status).phrase
+        except ValueError:
+            phrase = ""
+        lines = [f"HTTP/1.1 {status} {phrase}".encode("latin-1")]
+        lines.extend(bytes(name) + b": " + bytes(value) for name, value in headers)
+        self.writer.write(b"\r\n".join(lines) + b"\r\n\r\n")
@@ -1,24 +1,33 @@
 import filecmp
+import hashlib
+import json
+import multiprocessing
 import os
-import shutil
+import posixpath
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 
 from proper_cli import confirm, echo
 
 from .active import make_active_helper
+from .build_manifest import BuildManifest
+from .compress import SUFFIXES
+from .fast_copy import fast_copy
+from .fingerprint import AssetManifest, fingerprint_url
 from .jinja_render import JinjaRender
 from .request import Request
-from .urls import make_absolute_urls_relative
+from .urls import make_absolute_urls_relative, make_absolute_urls_relative_stream
+from .walk import TreeWalker
 
 
 __all__ = ("BlueprintRender", "printf")
 
 
 def get_context(path=""):
-    request = Request()
-    request.path = str(path).replace("\\", "/").strip("/")
-    active = make_active_helper(request)
-    return {"request": request, "active": active}
+    request = Request(path=str(path).replace("\\", "/").strip("/"))
+    return {"request": request, "active": make_active_helper(request)}
 
 
 class BlueprintRender:
@@ -29,7 +38,9 @@ class BlueprintRender:
         *,
         must_filter,
         is_binary,
+        must_prune=None,
         static_folder="static",
+        state_folder=None,
         force=False,
         globals_=None,
         filters_=None,
@@ -41,17 +52,169 @@ class BlueprintRender:
         self.force = force
         self.must_filter = must_filter
         self.is_binary = is_binary
+        self.must_prune = must_prune
         self.static_folder = static_folder
+        # Where the manifests of the incremental and fingerprinted builds
+        # are saved, outside the destination folder so they aren't published
+        self.state_folder = Path(state_folder) if state_folder else self.dst
         self.relativize_urls = relativize_urls
+        # Relative paths of the folders of the output, once known
+        self.folders = None
+        self.profiler = None
+        # Fingerprinted names of the static files, if enabled
+        self.assets = {}
+        # Functions returning the state of the dependencies of the pages
+        # that are not files, for the manifest of incremental builds
+        self.signatures = {}
 
         self.render = JinjaRender(src, globals_=globals_, filters_=filters_, **envops)
 
-    def __call__(self, **data):
-        src = str(self.src)
-        for folder, _, files in os.walk(src):
-            self.render_folder(Path(folder), files, **data)
+    def __call__(
+        self,
+        jobs=1,
+        incremental=False,
+        sync=False,
+        link=False,
+        profiler=None,
+        fingerprint=False,
+        **data,
+    ):
+        """Render the whole source tree.
+
+        With `jobs` > 1, the pages are rendered by a pool of that many processes,
+        each one with its own copy of the Jinja environment. The files are still
+        written, and reported, by this process and in the same order as in a
+        serial build, so the output is identical.
+
+        With `incremental=True`, a manifest of the build is saved in the
+        `state_folder`, and the next build only renders again the pages
+        whose source, or any of the templates they use, have changed. The outputs
+        of sources that no longer exist are deleted.
+
+        With `sync=True` the manifest is used only for the files that are copied
+        as-is, like those in the static folder: a file is only copied again if its
+        size or mtime changed *and* its content hash is different. If nothing
+        changed, that's just one `stat()` per file.
+
+        With `link=True`, the copied files are hard links to the sources instead,
+        so use it only for read-only deploys.
+
+        With a `profiler` (a `BuildProfiler`), the time of each phase of every
+        page and of every template is measured. That only works in a single
+        process, so `jobs` is ignored.
+
+        With `fingerprint=True`, the files of the static folder are copied
+        with a hash of their content in their names, and the references to
+        them in the pages and stylesheets are rewritten to match, even if
+        the URLs are not relativized. See `AssetManifest`. A copy with the
+        original name is kept too, for the references that weren't rewritten,
+        like those in scripts or in `srcset` attributes.
+        """
+        self.profiler = self.render.env.profiler = profiler
+        if profiler is not None:
+            jobs = 1
+
+        tasks = []
+        walker = TreeWalker(self.src, must_prune=self._must_prune)
+        for folder, _, files in walker:
+            tasks.extend(self.get_folder_tasks(Path(folder), files, **data))
+        if walker.pruned:
+            printf("pruned", f"{walker.pruned} excluded folders", color="white")
+
+        self.folders = self._get_folders(tasks)
+        assets = None
+        assets_changed = False
+        self.assets = {}
+        # The outputs of the fingerprinted files, with their original names
+        originals = {}
+        if fingerprint:
+            assets = AssetManifest(self.src, self.dst, folder=self.state_folder)
+            assets.load()
+            assets_changed = assets.update(
+                task[2] for task in tasks if task[0] and self._is_static(task[2])
+            )
+            self.assets = assets.assets
+            fingerprinted = [self._fingerprint_task(task) for task in tasks]
+            originals = {
+                _key(task[2]): task[3]
+                for task, new_task in zip(tasks, fingerprinted, strict=True)
+                if new_task is not task
+            }
+            tasks = fingerprinted
+
+        manifest = None
+        fresh = set()
+        if incremental or sync:
+            key = self._get_build_key(fingerprint=fingerprint, **data)
+            manifest = BuildManifest(
+                self.src,
+                self.dst,
+                key=key,
+                signatures=self.signatures,
+                folder=self.state_folder,
+            )
+            manifest.load()
+            fresh = self._get_fresh(
+                tasks,
+                manifest,
+                pages=incremental,
+                assets_changed=assets_changed,
+                old_assets=assets.old_assets if assets else None,
+            )
+
+        if jobs > 1 and _can_fork():
+            rendered = self._render_parallel(tasks, jobs, fresh, **data)
+        else:
+            rendered = self._render_serial(tasks, fresh, **data)
+
+        for task, tmp_path, deps in rendered:
+            copy, src_path, src_relpath, dst_relpath = task
+            if src_relpath in fresh:
+                printf("identical", dst_relpath)
+                continue
+            # Outputs made by a previous build, and not modified after,
+            # are ours to overwrite.
+            overwrite = manifest is not None and manifest.owns_output(
+                src_relpath, dst_relpath
+            )
+            self._make_folder(dst_relpath.parent)
+            original = originals.get(_key(src_relpath))
+            # Made by a previous fingerprinted build
+            owns_original = bool(assets and _key(src_relpath) in assets.old_assets)
+            content = assets.contents.get(_key(src_relpath)) if assets else None
+            if content is not None:
+                # A stylesheet with the references to other files rewritten
+                self.save_file(content, dst_relpath, overwrite=overwrite)
+                if original is not None:
+                    self.save_file(content, original, overwrite=owns_original)
+            elif copy:
+                self.copy_file(src_path, dst_relpath, overwrite=overwrite, link=link)
+                if original is not None:
+                    self.copy_file(src_path, original, overwrite=owns_original, link=link)
+            else:
+                self.save_rendered(tmp_path, dst_relpath, overwrite=overwrite)
+            if manifest is not None:
+                manifest.record(src_relpath, dst_relpath, deps)
+
+        if manifest is not None:
+            manifest.save()
+        if assets is not None:
+            assets.save()
 
     def render_folder(self, folder, files, **data):
+        for copy, src_path, src_relpath, dst_relpath in self.get_folder_tasks(
+            folder, files, **data
+        ):
+            self._make_folder(dst_relpath.parent)
+            if copy:
+                self.copy_file(src_path, dst_relpath)
+            else:
+                self.render_file(src_relpath, dst_relpath, **data)
+
+    def get_folder_tasks(self, folder, files, **data):
+        """Returns a `(copy, src_path, src_relpath, dst_relpath)` tuple for
+        each file of the folder that must be rendered or copied.
+        """
         src_relfolder = str(folder) \
             .replace(str(self.src), "", 1) \
             .lstrip(os.path.sep)
@@ -61,67 +224,284 @@ class BlueprintRender:
         src_relfolder = Path(src_relfolder)
         dst_relfolder = Path(dst_relfolder)
 
+        tasks = []
         for name in files:
             src_path = folder / name
             src_relpath = src_relfolder / name
             if self.must_filter(src_relpath):
                 continue
-            self._make_folder(dst_relfolder)
             name = self.render.string(name, **data)
             dst_relpath = dst_relfolder / name
+            copy = bool(is_static or self.is_binary(src_relpath))
+            tasks.append((copy, src_path, src_relpath, dst_relpath))
 
-            if is_static or self.is_binary(src_relpath):
-                self.copy_file(src_path, dst_relpath)
-            else:
-                self.render_file(src_relpath, dst_relpath, **data)
+        return tasks
+
+    def asset_url(self, url):
+        """Returns the absolute `url` of a static file with its fingerprinted
+        name, if the build is fingerprinting them, or as is otherwise.
+        """
+        return fingerprint_url(url, self.assets)
+
+    def assets_signature(self):
+        """Returns a hash of the fingerprinted names of the static files,
+        that changes if any of them does.
+        """
+        data = json.dumps(self.assets, sort_keys=True)
+        return hashlib.sha1(data.encode("utf8")).hexdigest()
 
     def render_content(self, src_relpath, **data):
         if self.is_binary(src_relpath):
             return (self.src / src_relpath).read_bytes()
         return self.render(src_relpath, **data)
 
+    def stream_content(self, src_relpath, **data):
+        """Like `render_content`, but returns an iterator of chunks."""
+        if self.is_binary(src_relpath):
+            return iter([(self.src / src_relpath).read_bytes()])
+        return self.render.stream(src_relpath, **data)
+
     def render_file(self, src_relpath, dst_relpath, **data):
+        content = self.render_page(src_relpath, dst_relpath, **data)
+        self.save_file(content, dst_relpath)
+
+    def render_page(self, src_relpath, dst_relpath, **data):
+        context = get_context(dst_relpath)
+        context.update(data)
+        with self._phase(dst_relpath, "render"):
+            content = self.render(src_relpath, **context)
+        if not (self.relativize_urls or self.assets):
+            return content
+        with self._phase(dst_relpath, "relativize"):
+            return make_absolute_urls_relative(
+                self.dst,
+                dst_relpath,
+                content,
+                self.folders,
+                assets=self.assets,
+                relativize=self.relativize_urls,
+            )
+
+    def stream_page(self, src_relpath, dst_relpath, **data):
+        """Like `render_page`, but returns an iterator of chunks."""
         context = get_context(dst_relpath)
         context.update(data)
-        content = self.render(src_relpath, **context)
-        if self.relativize_urls:
-            new_content = make_absolute_urls_relative(self.dst, dst_relpath, content)
+        chunks = self.render.stream(src_relpath, **context)
+        if not (self.relativize_urls or self.assets):
+            return chunks
+        return make_absolute_urls_relative_stream(
+            self.dst,
+            dst_relpath,
+            chunks,
+            self.folders,
+            assets=self.assets,
+            relativize=self.relativize_urls,
+        )
+
+    def write_page(self, src_relpath, dst_relpath, **data):
+        """Renders the page, chunk by chunk, to a temporary file in the
+        destination folder and returns its path, to be moved in place
+        by `save_rendered()`.
+        """
+        if self.profiler is None:
+            chunks = self.stream_page(src_relpath, dst_relpath, **data)
         else:
-            new_content = content
-        self.save_file(new_content, dst_relpath)
+            # Render and write in separate steps, to measure each phase
+            chunks = [self.render_page(src_relpath, dst_relpath, **data)]
+
+        self.dst.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.dst / f".clay-{uuid.uuid4().hex}.tmp"
+        try:
+            with self._phase(dst_relpath, "write"), tmp_path.open("x") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return tmp_path
 
-    def save_file(self, content, dst_relpath):
+    def save_rendered(self, tmp_path, dst_relpath, overwrite=False):
+        """Moves the page rendered by `write_page()` to `dst_relpath`."""
         dst_path = self.dst / dst_relpath
         if dst_path.exists():
-            if self._contents_are_identical(content, dst_path):
+            if filecmp.cmp(str(tmp_path), str(dst_path), shallow=False):
                 printf("identical", dst_relpath)
+                os.remove(tmp_path)
                 return
-            if not self._confirm_overwrite(dst_relpath):
+            if not (overwrite or self._confirm_overwrite(dst_relpath)):
                 printf("skipped", dst_relpath, color="yellow")
+                os.remove(tmp_path)
                 return
             printf("updated", dst_relpath, color="yellow")
         else:
             printf("created", dst_relpath, color="green")
+        os.replace(tmp_path, dst_path)
 
-        dst_path.write_text(content)
-
-    def copy_file(self, src_path, dst_relpath):
+    def save_file(self, content, dst_relpath, overwrite=False):
         dst_path = self.dst / dst_relpath
         if dst_path.exists():
-            if self._files_are_identical(src_path, dst_path):
+            if self._contents_are_identical(content, dst_path):
                 printf("identical", dst_relpath)
                 return
-            if not self._confirm_overwrite(dst_relpath):
+            if not (overwrite or self._confirm_overwrite(dst_relpath)):
                 printf("skipped", dst_relpath, color="yellow")
                 return
             printf("updated", dst_relpath, color="yellow")
         else:
             printf("created", dst_relpath, color="green")
 
-        shutil.copy2(str(src_path), str(dst_path))
+        with self._phase(dst_relpath, "write"):
+            dst_path.write_text(content)
+
+    def copy_file(self, src_path, dst_relpath, overwrite=False, link=False):
+        """Copies `src_path` to `dst_relpath`.
+
+        With `overwrite`, the destination is already known to be different
+        (because the manifest says so), so it's replaced without comparing
+        it or asking first.
+        """
+        dst_path = self.dst / dst_relpath
+        if dst_path.exists():
+            if not overwrite:
+                if self._files_are_identical(src_path, dst_path):
+                    printf("identical", dst_relpath)
+                    return
+                if not self._confirm_overwrite(dst_relpath):
+                    printf("skipped", dst_relpath, color="yellow")
+                    return
+            printf("updated", dst_relpath, color="yellow")
+        else:
+            printf("created", dst_relpath, color="green")
+
+        with self._phase(dst_relpath, "copy"):
+            fast_copy(src_path, dst_path, link=link)
 
     # Private
 
+    def _phase(self, page, name):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(page, name)
+
+    def _is_static(self, src_relpath):
+        parts = Path(src_relpath).parts
+        return bool(parts) and parts[0] == self.static_folder
+
+    def _fingerprint_task(self, task):
+        copy, src_path, src_relpath, dst_relpath = task
+        fingerprinted = self.assets.get(_key(src_relpath)) if copy else None
+        if fingerprinted is None:
+            return task
+        return copy, src_path, src_relpath, dst_relpath.with_name(Path(fingerprinted).name)
+
+    def _must_prune(self, relfolder):
+        # Never render the output of a previous build as a source
+        if self.src / relfolder == self.dst:
+            return True
+        return bool(self.must_prune and self.must_prune(relfolder))
+
+    def _get_folders(self, tasks):
+        folders = set()
+        for *_, dst_relpath in tasks:
+            folders.update(str(parent) for parent in dst_relpath.parents)
+        return folders
+
+    def _get_build_key(self, **data):
+        """Everything, besides the sources, that can change the output of
+        every page.
+        """
+        config = [
+            path.read_text() for path in (self.src / "clay.yaml", self.src / "clay.yml")
+            if path.is_file()
+        ]
+        key = json.dumps(
+            [self.relativize_urls, repr(sorted(data.items())), config]
+        )
+        return hashlib.sha1(key.encode("utf8")).hexdigest()
+
+    def _get_fresh(
+        self, tasks, manifest, pages=True, assets_changed=False, old_assets=None
+    ):
+        """Returns the source paths of the tasks whose output from the
+        previous build is still valid, and deletes the outputs of the sources
+        that are gone, and their copies with the original name if they were
+        fingerprinted (`old_assets`).
+
+        With `pages=False` only the copied files are considered. With
+        `assets_changed=True`, because the pages could link to the old
+        fingerprinted names, all of them are rendered again.
+        """
+        known = len(manifest.outputs)
+        originals = {
+            fingerprinted: relpath for relpath, fingerprinted in (old_assets or {}).items()
+        }
+        for dst_relpath in manifest.forget_missing(task[2] for task in tasks):
+            self._delete_output(dst_relpath)
+            original = originals.get(dst_relpath)
+            if original is None:
+                continue
+            original = Path(dst_relpath).with_name(posixpath.basename(original))
+            if (self.dst / original).is_file():
+                self._delete_output(original)
+
+        # Adding or removing pages can change the output of any page, so in
+        # that case all of them are rendered again. The pages using
+        # `list_pages()` also depend on its signature, so they are rendered
+        # again when any other page, or its metadata, changes.
+        pages_changed = assets_changed or len(manifest.outputs) != known or any(
+            manifest.is_new(src_relpath) for _, _, src_relpath, _ in tasks
+        )
+        return {
+            src_relpath
+            for copy, _, src_relpath, dst_relpath in tasks
+            if (copy or (pages and not pages_changed))
+            and manifest.is_fresh(src_relpath, dst_relpath)
+        }
+
+    def _delete_output(self, dst_relpath):
+        dst_path = self.dst / dst_relpath
+        dst_path.unlink(missing_ok=True)
+        # and its precompressed copies, if any
+        for suffix in SUFFIXES:
+            Path(f"{dst_path}{suffix}").unlink(missing_ok=True)
+        printf("deleted", dst_relpath, color="yellow")
+
+    def _render_serial(self, tasks, fresh, **data):
+        for task in tasks:
+            copy, _, src_relpath, dst_relpath = task
+            if copy or src_relpath in fresh:
+                yield task, None, ()
+            else:
+                tmp_path = self.write_page(src_relpath, dst_relpath, **data)
+                yield task, tmp_path, set(self.render.dependencies)
+
+    def _render_parallel(self, tasks, jobs, fresh, **data):
+        pages = [
+            (src_relpath, dst_relpath, data)
+            for copy, _, src_relpath, dst_relpath in tasks
+            if not (copy or src_relpath in fresh)
+        ]
+        chunksize = max(1, len(pages) // (jobs * 4))
+        # Forked workers inherit this renderer (and its globals) without pickling it.
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self,),
+        ) as executor:
+            rendered = executor.map(_render_in_worker, pages, chunksize=chunksize)
+            fragments = self.render.env.fragment_cache
+            for task in tasks:
+                if task[0] or task[2] in fresh:
+                    yield task, None, ()
+                    continue
+                tmp_path, deps, (hits, misses) = next(rendered)
+                if fragments is not None:
+                    # Counted by the workers, but shown by this process
+                    fragments.hits += hits
+                    fragments.misses += misses
+                yield task, tmp_path, deps
+
     def _make_folder(self, rel_folder):
         path = self.dst / rel_folder
         if path.exists():
@@ -134,6 +514,8 @@ class BlueprintRender:
             printf("created", display, color="green")
 
     def _files_are_identical(self, src_path, dst_path):
+        if os.path.samefile(src_path, dst_path):
+            return True
         return filecmp.cmp(str(src_path), str(dst_path), shallow=False)
 
     def _contents_are_identical(self, content, dst_path):
@@ -146,6 +528,33 @@ class BlueprintRender:
         return confirm(" Overwrite?")
 
 
+_worker_render = None
+
+
+def _can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _init_worker(render):
+    global _worker_render
+    _worker_render = render
+
+
+def _render_in_worker(page):
+    src_relpath, dst_relpath, data = page
+    render = _worker_render
+    fragments = render.render.env.fragment_cache  # type: ignore
+    hits, misses = (fragments.hits, fragments.misses) if fragments is not None else (0, 0)
+    tmp_path = render.write_page(src_relpath, dst_relpath, **data)  # type: ignore
+    if fragments is not None:
+        hits, misses = fragments.hits - hits, fragments.misses - misses
+    return tmp_path, sorted(render.render.dependencies), (hits, misses)  # type: ignore
+
+
+def _key(relpath):
+    return str(relpath).replace("\\", "/")
+
+
 def printf(verb, msg="", color="cyan", indent=10):
     verb = str(verb).rjust(indent, " ")
     verb = f"<fg={color}>{verb}</>"
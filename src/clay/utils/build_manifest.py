@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+__all__ = ("BuildManifest", "MANIFEST_NAME")
+
+MANIFEST_NAME = ".clay-manifest.json"
+MANIFEST_VERSION = 2
+
+
+def file_digest(path):
+    hasher = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BuildManifest:
+    """Remembers, between builds, the state of every source file and the
+    templates each page was rendered from.
+
+    The state of a file is its `(mtime_ns, size, sha1)`. The hash is only
+    calculated when the mtime or the size have changed, so a file that was
+    only touched is still considered unchanged. For the outputs, only the
+    `(mtime_ns, size)` are recorded, to detect if they were modified
+    after the build.
+
+    A dependency can also be one of the `signatures`, a function that returns
+    a string that changes when something other than a file does, like the
+    metadata of the pages. Its state is `[0, 0, signature()]`.
+
+    The manifest is saved as a JSON file in `folder`, by default the build
+    folder, although it's better to keep it out of what is published:
+
+        {
+            "version": 2,
+            "key": "...",
+            "files": {"path": [mtime_ns, size, sha1], ...},
+            "outputs": {"src_relpath": "dst_relpath", ...},
+            "output_states": {"dst_relpath": [mtime_ns, size], ...},
+            "deps": {"src_relpath": ["template", ...], ...}
+        }
+
+    """
+
+    def __init__(self, src, dst, key="", signatures=None, folder=None):
+        self.src = Path(src)
+        self.dst = Path(dst)
+        self.path = Path(folder or dst) / MANIFEST_NAME
+        self.key = key
+        self.signatures = signatures or {}
+        self.files = {}
+        self.outputs = {}
+        self.output_states = {}
+        self.deps = {}
+        self.new_files = {}
+        self._changed = {}
+
+    def load(self):
+        """Reads the manifest of the previous build. The manifest is discarded
+        if it's missing, invalid or was made with a different `key`.
+        """
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") != MANIFEST_VERSION or data.get("key") != self.key:
+            return
+        self.files = data.get("files", {})
+        self.outputs = data.get("outputs", {})
+        self.output_states = data.get("output_states", {})
+        self.deps = data.get("deps", {})
+
+    def save(self):
+        files = dict(self.files)
+        files.update(self.new_files)
+        used = set(self.outputs)
+        outputs = set(self.outputs.values())
+        for deps in self.deps.values():
+            used.update(deps)
+        data = {
+            "version": MANIFEST_VERSION,
+            "key": self.key,
+            "files": {name: state for name, state in files.items() if name in used},
+            "outputs": self.outputs,
+            "output_states": {
+                dst_relpath: state
+                for dst_relpath, state in self.output_states.items()
+                if dst_relpath in outputs
+            },
+            "deps": self.deps,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(data, sort_keys=True))
+        # Saved there by the previous versions
+        if self.path != self.dst / MANIFEST_NAME:
+            (self.dst / MANIFEST_NAME).unlink(missing_ok=True)
+
+    def has_changed(self, relpath):
+        """Returns `True` if the source file is different than in the
+        previous build (or if it didn't exist then).
+        """
+        relpath = _key(relpath)
+        if relpath in self._changed:
+            return self._changed[relpath]
+
+        old_state = self.files.get(relpath)
+        state = self._get_state(relpath, old_state)
+        self.new_files[relpath] = state
+        if relpath not in self.files:
+            changed = True
+        elif old_state is None or state is None:
+            changed = old_state != state
+        else:
+            changed = state[2] != old_state[2]
+        self._changed[relpath] = changed
+        return changed
+
+    def is_new(self, src_relpath):
+        return _key(src_relpath) not in self.outputs
+
+    def is_fresh(self, src_relpath, dst_relpath):
+        """Returns `True` if the output of `src_relpath` from the previous build
+        is still valid: same output path, the output file still exists and
+        neither the source nor any of its dependencies have changed.
+        """
+        if not self.owns_output(src_relpath, dst_relpath):
+            return False
+        src_relpath = _key(src_relpath)
+        if self.has_changed(src_relpath):
+            return False
+        return not any(self.has_changed(dep) for dep in self.deps.get(src_relpath, ()))
+
+    def owns_output(self, src_relpath, dst_relpath):
+        """Returns `True` if `dst_relpath` was made from `src_relpath` by the
+        previous build and hasn't been modified since.
+        """
+        dst_relpath = _key(dst_relpath)
+        if self.outputs.get(_key(src_relpath)) != dst_relpath:
+            return False
+        state = self._get_output_state(dst_relpath)
+        if state is None:
+            return False
+        old_state = self.output_states.get(dst_relpath)
+        return old_state is None or old_state == state
+
+    def record(self, src_relpath, dst_relpath, deps=()):
+        src_relpath = _key(src_relpath)
+        dst_relpath = _key(dst_relpath)
+        self.outputs[src_relpath] = dst_relpath
+        self.output_states[dst_relpath] = self._get_output_state(dst_relpath)
+        self.deps[src_relpath] = sorted(_key(dep) for dep in deps)
+        self.has_changed(src_relpath)
+        for dep in self.deps[src_relpath]:
+            self.has_changed(dep)
+
+    def forget_missing(self, src_relpaths):
+        """Forgets the sources that are not in `src_relpaths` anymore and returns
+        the relative paths of their outputs.
+        """
+        current = {_key(relpath) for relpath in src_relpaths}
+        stale = []
+        for src_relpath in list(self.outputs):
+            if src_relpath in current:
+                continue
+            stale.append(self.outputs.pop(src_relpath))
+            self.deps.pop(src_relpath, None)
+
+        outputs = set(self.outputs.values())
+        return [dst_relpath for dst_relpath in stale if dst_relpath not in outputs]
+
+    # Private
+
+    def _get_output_state(self, dst_relpath):
+        try:
+            stat = os.stat(self.dst / dst_relpath)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _get_state(self, relpath, old_state):
+        signature = self.signatures.get(relpath)
+        if signature is not None:
+            return [0, 0, signature()]
+        try:
+            stat = os.stat(self.src / relpath)
+        except OSError:
+            return None
+        mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        if old_state and old_state[0] == mtime_ns and old_state[1] == size:
+            return old_state
+        return [mtime_ns, size, file_digest(self.src / relpath)]
+
+
+def _key(relpath):
+    return str(relpath).replace("\\", "/")
@@ -0,0 +1,149 @@
+import os
+import threading
+from pathlib import Path
+
+import jinja2
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+from .. import __version__
+
+
+__all__ = ("ClayBytecodeCache",)
+
+# Fraction of `max_size` to keep after an eviction, so it doesn't have to
+# run again on every new template.
+EVICT_TO = 0.8
+
+
+class ClayBytecodeCache(FileSystemBytecodeCache):
+    """A persistent cache of compiled templates, that can be shared by
+    `clay build`, `clay run` and every server worker.
+
+    The entries are keyed by the Jinja and Clay versions, because the Clay
+    extensions are compiled into the templates too, the options of the
+    environment that affect the compiled code and the hash of the template
+    source, so a different version of a template never overwrites the other.
+
+    When the total size of the cache goes over `max_size` bytes, the least
+    recently used entries are deleted.
+
+    The directory is only created when the first template is saved.
+
+    It can be used by several threads at the same time.
+    """
+
+    def __init__(self, directory, max_size=0):
+        super().__init__(str(Path(directory)), pattern="clay_%s.cache")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, environment, name, filename, source):
+        checksum = self.get_source_checksum(source)
+        fingerprint = self._get_fingerprint(environment)
+        key = self.get_cache_key(f"{fingerprint}:{name}:{checksum}", filename)
+        bucket = Bucket(environment, key, checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        with self._lock:
+            if bucket.code is None:
+                self.misses += 1
+                return
+            self.hits += 1
+        try:
+            # Mark it as recently used
+            os.utime(self._get_cache_filename(bucket))
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+        if not self.max_size:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._get_entries())
+            else:
+                try:
+                    self._size += os.path.getsize(self._get_cache_filename(bucket))
+                except OSError:
+                    pass
+            if self._size > self.max_size:
+                self._evict(int(self.max_size * EVICT_TO))
+
+    def evict(self, max_size):
+        """Delete the least recently used entries until the total size
+        of the cache is under `max_size` bytes.
+        """
+        with self._lock:
+            self._evict(max_size)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    # Private
+
+    def _evict(self, max_size):
+        entries = sorted(self._get_entries())
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
+
+    def _get_entries(self):
+        """Returns a `(mtime, size, path)` tuple for each entry."""
+        suffix = self.pattern.split("%s")[-1]
+        entries = []
+        try:
+            scandir_it = os.scandir(self.directory)
+        except OSError:
+            return entries
+        with scandir_it:
+            for entry in scandir_it:
+                if not entry.name.endswith(suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _get_fingerprint(self, environment):
+        fingerprint = self._fingerprints.get(id(environment))
+        if fingerprint is None:
+            fingerprint = repr((
+                jinja2.__version__,
+                __version__,
+                type(environment).__name__,
+                environment.block_start_string,
+                environment.block_end_string,
+                environment.variable_start_string,
+                environment.variable_end_string,
+                environment.comment_start_string,
+                environment.comment_end_string,
+                environment.line_statement_prefix,
+                environment.line_comment_prefix,
+                environment.trim_blocks,
+                environment.lstrip_blocks,
+                environment.newline_sequence,
+                environment.keep_trailing_newline,
+                environment.optimized,
+                getattr(environment.autoescape, "__qualname__", environment.autoescape),
+                sorted(environment.extensions),
+            ))
+            self._fingerprints[id(environment)] = fingerprint
+        return fingerprint
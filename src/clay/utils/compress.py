@@ -0,0 +1,165 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .walk import TreeWalker
+
+
+try:
+    import brotli  # ty: ignore[unresolved-import]
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+__all__ = (
+    "ENCODINGS",
+    "SUFFIXES",
+    "choose_encoding",
+    "compress",
+    "compress_tree",
+    "is_compressible",
+)
+
+COMPRESSIBLE_EXTENSIONS = {
+    ".css", ".csv", ".htm", ".html", ".js", ".json", ".map", ".md", ".mjs",
+    ".rss", ".svg", ".txt", ".webmanifest", ".xhtml", ".xml",
+}
+CHUNK_SIZE = 256 * 1024
+
+
+class _GzipCompressor:
+    def __init__(self):
+        # A gzip header without a name or mtime, so the same content
+        # always makes the same file
+        self._obj = zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _BrotliCompressor:  # pragma: no cover
+    def __init__(self):
+        self._obj = brotli.Compressor()  # type: ignore
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.finish()
+
+
+# Of the precompressed files of every encoding, even if not available
+SUFFIXES = (".br", ".gz")
+
+# In order of preference, with the suffix of the precompressed files
+ENCODINGS = {"gzip": (".gz", _GzipCompressor)}
+if brotli is not None:  # pragma: no cover
+    ENCODINGS = {"br": (".br", _BrotliCompressor), **ENCODINGS}
+
+
+def is_compressible(path):
+    return os.path.splitext(str(path))[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def compress(data, encoding):
+    compressor = ENCODINGS[encoding][1]()
+    return compressor.compress(data) + compressor.flush()
+
+
+def choose_encoding(accept_encoding, encodings=None):
+    """Returns the preferred encoding of `encodings` (all the available by
+    default) that is acceptable according to the `Accept-Encoding` header,
+    or `None`.
+    """
+    encodings = ENCODINGS if encodings is None else encodings
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    default = accepted.get("*", 0.0)
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_tree(root, min_size=1024, jobs=None):
+    """Writes a compressed sibling (`.gz`, and `.br` if the `brotli` package
+    is installed) of every text file of `root` of at least `min_size` bytes.
+    Hidden files and folders, like the manifests of the build, are skipped,
+    because they are never served.
+
+    The siblings get the mtime of their file, so the next time only those of
+    the files that changed are compressed again. The files are compressed in
+    parallel, by `jobs` threads.
+
+    Returns the number of files compressed and the number skipped because
+    their siblings were current.
+    """
+    paths = []
+    for folder, _, files in TreeWalker(root, must_prune=_is_hidden):
+        paths.extend(
+            os.path.join(folder, name) for name in files
+            if is_compressible(name) and not _is_hidden(name)
+        )
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda path: _compress_file(path, min_size), paths))
+    compressed = sum(1 for result in results if result)
+    skipped = sum(1 for result in results if result is False)
+    return compressed, skipped
+
+
+def _is_hidden(relpath):
+    return os.path.basename(relpath).startswith(".")
+
+
+def _compress_file(path, min_size):
+    """Returns `True` if the file was compressed, `False` if its siblings were
+    current and `None` if it's too small.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.st_size < min_size:
+        return None
+
+    stale = [
+        (suffix, make_compressor) for suffix, make_compressor in ENCODINGS.values()
+        if not _is_current(path + suffix, stat)
+    ]
+    if not stale:
+        return False
+
+    for suffix, make_compressor in stale:
+        tmp_path = f"{path}{suffix}.tmp"
+        compressor = make_compressor()
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            while chunk := src.read(CHUNK_SIZE):
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path, path + suffix)
+    return True
+
+
+def _is_current(sibling, stat):
+    try:
+        return os.stat(sibling).st_mtime_ns == stat.st_mtime_ns
+    except OSError:
+        return False
@@ -0,0 +1,76 @@
+import os
+import shutil
+
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Not on Windows
+    fcntl = None  # ty: ignore[invalid-assignment]
+
+
+__all__ = ("fast_copy",)
+
+# Linux ioctl to make `dst` share the data blocks of `src` (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def fast_copy(src, dst, link=False):
+    """Copies the file `src` to `dst`, including its metadata, using the
+    cheapest mechanism the filesystem offers:
+
+    1. A hard link, but only if `link` is `True`, because then both files
+       are the same, so only use it if the destination is read-only.
+    2. A reflink (copy-on-write clone) of the file.
+    3. `os.copy_file_range()`, that copies the data inside the kernel.
+    4. `shutil.copyfile()`.
+
+    Returns the name of the mechanism used.
+    """
+    src = str(src)
+    dst = str(dst)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if link:
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass
+
+    method = _clone(src, dst)
+    if method is None:
+        shutil.copyfile(src, dst)
+        method = "copy"
+    shutil.copystat(src, dst)
+    return method
+
+
+def _clone(src, dst):
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    return "reflink"
+                except OSError:
+                    pass
+
+            if not hasattr(os, "copy_file_range"):
+                return None
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                    if not sent:
+                        break
+                    copied += sent
+            except OSError:
+                if copied:
+                    raise
+                return None
+            if copied < size:
+                return None
+            return "copy_file_range"
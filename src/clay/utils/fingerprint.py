@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import posixpath
+import re
+from pathlib import Path
+
+from .build_manifest import file_digest
+
+
+__all__ = (
+    "ASSETS_NAME",
+    "AssetManifest",
+    "fingerprint_url",
+    "rewrite_css_urls",
+)
+
+ASSETS_NAME = ".clay-assets.json"
+ASSETS_VERSION = 1
+HASH_LENGTH = 10
+
+RX_CSS_URL = re.compile(
+    r"""(url\(\s*)(['"]?)([^'")\s]+)(\2\s*\))|(@import\s+)(['"])([^'"]+)(\6)""",
+    re.IGNORECASE,
+)
+RX_QUERY = re.compile(r"[?#]")
+# Pages, even if in the static folder, are visited by their names
+NEVER_FINGERPRINTED = (".html", ".htm")
+
+
+def fingerprint_url(url, assets):
+    """Returns the absolute `url` of a static file with its fingerprinted
+    name from `assets`, or as is if it's not there.
+    """
+    if not assets or not url.startswith("/"):
+        return url
+    path, rest = _split_query(url)
+    fingerprinted = assets.get(path[1:])
+    if fingerprinted is None:
+        return url
+    return "/" + fingerprinted + rest
+
+
+def rewrite_css_urls(content, css_relpath, assets):
+    """Rewrites the `url()` and `@import` references of the stylesheet at
+    `css_relpath` to the fingerprinted names from `assets`, keeping them
+    relative or absolute as they were.
+    """
+    folder = posixpath.dirname(css_relpath)
+
+    def replace(match):
+        start, quote, url, end = _get_css_url(match)
+        resolved = _resolve_css_url(url, folder)
+        if resolved is None:
+            return match.group(0)
+        relpath, path, rest = resolved
+        fingerprinted = assets.get(relpath)
+        if fingerprinted is None:
+            return match.group(0)
+        path = posixpath.join(posixpath.dirname(path), posixpath.basename(fingerprinted))
+        return f"{start}{quote}{path}{rest}{end}"
+
+    return RX_CSS_URL.sub(replace, content)
+
+
+class AssetManifest:
+    """The fingerprinted names of the static files, saved between builds
+    in `folder`, by default the build folder:
+
+        {
+            "version": 1,
+            "assets": {"static/main.css": "static/main.0123abcdef.css", ...},
+            "states": {"static/logo.png": [mtime_ns, size, sha1], ...}
+        }
+
+    The names are made from the hash of the content, so an unchanged file
+    keeps its name across builds. The hashes of the files whose mtime and
+    size haven't changed are taken from the previous build.
+
+    The references to other static files inside the stylesheets are
+    rewritten first, so the name of a stylesheet changes if any of
+    the files it uses changes. The stylesheets used by another one, with
+    `@import` or `url()`, are done before it, so its name doesn't depend
+    on the order they are found.
+
+    `old_assets` are the names of the previous build.
+    """
+
+    def __init__(self, src, dst, folder=None):
+        self.src = Path(src)
+        self.dst = Path(dst)
+        self.path = Path(folder or dst) / ASSETS_NAME
+        self.assets = {}
+        self.states = {}
+        self.old_assets = {}
+        # Rewritten content of the stylesheets
+        self.contents = {}
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") != ASSETS_VERSION:
+            return
+        self.assets = self.old_assets = data.get("assets", {})
+        self.states = data.get("states", {})
+
+    def update(self, relpaths):
+        """Calculates the fingerprinted names of the files at `relpaths`,
+        relative to `src`. Returns `True` if any is different than in the
+        previous build.
+        """
+        old_assets = self.assets
+        old_states = self.states
+        self.assets = {}
+        self.states = {}
+        self.contents = {}
+
+        stylesheets = {}
+        for relpath in relpaths:
+            relpath = str(relpath).replace("\\", "/")
+            ext = posixpath.splitext(relpath)[1].lower()
+            if not ext or ext in NEVER_FINGERPRINTED:
+                continue
+            if ext == ".css":
+                try:
+                    stylesheets[relpath] = (self.src / relpath).read_text()
+                except (OSError, UnicodeDecodeError):
+                    pass
+                continue
+            state = self._get_state(relpath, old_states.get(relpath))
+            if state is None:
+                continue
+            self.states[relpath] = state
+            self.assets[relpath] = _add_hash(relpath, state[2])
+
+        started = set()
+
+        def add_stylesheet(relpath):
+            # In a cycle of imports, the first one found is done last
+            if relpath in started:
+                return
+            started.add(relpath)
+            content = stylesheets[relpath]
+            for dependency in _get_css_references(content, relpath):
+                if dependency in stylesheets:
+                    add_stylesheet(dependency)
+            content = rewrite_css_urls(content, relpath, self.assets)
+            digest = hashlib.sha1(content.encode("utf8")).hexdigest()
+            self.contents[relpath] = content
+            self.assets[relpath] = _add_hash(relpath, digest)
+
+        for relpath in stylesheets:
+            add_stylesheet(relpath)
+
+        return self.assets != old_assets
+
+    def save(self):
+        data = {
+            "version": ASSETS_VERSION,
+            "assets": self.assets,
+            "states": self.states,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(data, sort_keys=True))
+        # Saved there by the previous versions
+        if self.path != self.dst / ASSETS_NAME:
+            (self.dst / ASSETS_NAME).unlink(missing_ok=True)
+
+    # Private
+
+    def _get_state(self, relpath, old_state):
+        try:
+            stat = os.stat(self.src / relpath)
+        except OSError:
+            return None
+        mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        if old_state and old_state[0] == mtime_ns and old_state[1] == size:
+            return old_state
+        return [mtime_ns, size, file_digest(self.src / relpath)]
+
+
+def _get_css_url(match):
+    """Returns the `(start, quote, url, end)` of a match of `RX_CSS_URL`."""
+    if match.group(3) is not None:
+        return match.group(1, 2, 3, 4)
+    return match.group(5, 6, 7, 8)
+
+
+def _resolve_css_url(url, folder):
+    """Returns the `(relpath, path, rest)` of a URL of a stylesheet in
+    `folder`, or `None` if it's not a local file.
+    """
+    if url.startswith(("data:", "#")) or "//" in url:
+        return None
+    path, rest = _split_query(url)
+    if path.startswith("/"):
+        relpath = path[1:]
+    else:
+        relpath = posixpath.normpath(posixpath.join(folder, path))
+    return relpath, path, rest
+
+
+def _get_css_references(content, css_relpath):
+    """Returns the relative paths of the local files used by a stylesheet."""
+    folder = posixpath.dirname(css_relpath)
+    references = []
+    for match in RX_CSS_URL.finditer(content):
+        resolved = _resolve_css_url(_get_css_url(match)[2], folder)
+        if resolved is not None:
+            references.append(resolved[0])
+    return references
+
+
+def _split_query(url):
+    """Splits the query and fragment from the path of `url`."""
+    match = RX_QUERY.search(url)
+    if match is None:
+        return url, ""
+    return url[:match.start()], url[match.start():]
+
+
+def _add_hash(relpath, digest):
+    root, ext = posixpath.splitext(relpath)
+    return f"{root}.{digest[:HASH_LENGTH]}{ext}"
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from .jinja_render import TrackingMixin
+from .render_cache import mark_volatile, track_volatile
+
+
+__all__ = ("FragmentCache", "FragmentCacheExtension", "fragment_depends_on")
+
+_signatures: ContextVar[set | None] = ContextVar("clay_fragment_signatures", default=None)
+
+
+def fragment_depends_on(name):
+    """Adds `name`, one of the `FragmentCache.signatures`, to the dependencies
+    of the fragments being rendered, so they are rendered again when it
+    changes. Used by `list_pages()`.
+    """
+    names = _signatures.get()
+    if names is not None:
+        names.add(name)
+
+
+class FragmentCacheExtension(Extension):
+    """A Jinja2 extension to render a fragment once and reuse it, in this and
+    in every other page:
+
+        {% cache "footer" %}...{% endcache %}
+        {% cache "menu", vary=request.path %}...{% endcache %}
+
+    The fragments are cached by their key and `vary` value, so the same key
+    can be used in several templates, in the `fragment_cache` of the
+    environment (see `FragmentCache`). Without one, they are always rendered.
+
+    Fragments using `now()`, `datetime.now()`, `shuffle` or `no_cache()`
+    are never cached.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        vary = nodes.Const(None)
+        if parser.stream.skip_if("comma"):
+            parser.stream.expect("name:vary")
+            parser.stream.expect("assign")
+            vary = parser.parse_expression()
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        args = [nodes.Const(parser.name), key, vary]
+        return nodes.CallBlock(
+            self.call_method("_render_fragment", args), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_fragment(self, name, key, vary, caller):
+        cache = getattr(self.environment, "fragment_cache", None)
+        if cache is None:
+            return caller()
+
+        # Shared by every template using the same key
+        cache_key = repr((key, vary))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            body, dependencies = cached
+            self._add_dependencies(cache, dependencies)
+            return Markup(body)
+
+        env = self.environment
+        if not isinstance(env, TrackingMixin):
+            env = None
+        # The templates used by the fragment, apart from those of the page
+        outer = None if env is None else env.loaded
+        loaded = set()
+        if env is not None:
+            env.loaded = loaded
+        signatures = set()
+        token = _signatures.set(signatures)
+        try:
+            with track_volatile() as tracker:
+                body = caller()
+        finally:
+            _signatures.reset(token)
+            if env is not None:
+                env.loaded = outer
+
+        dependencies = loaded | signatures
+        if name:
+            dependencies.add(name)
+        self._add_dependencies(cache, dependencies)
+        if tracker["volatile"]:
+            mark_volatile()
+        else:
+            cache.set(cache_key, str(body), dependencies)
+        return body
+
+    def _add_dependencies(self, cache, dependencies):
+        """The page, or the fragment around this one, depends on the same
+        templates and signatures, even if this fragment wasn't rendered.
+        """
+        env = self.environment
+        loaded = env.loaded if isinstance(env, TrackingMixin) else None
+        signatures = _signatures.get()
+        for name in dependencies:
+            if name in cache.signatures and signatures is not None:
+                signatures.add(name)
+            # The signatures too, for the dependencies of the page
+            if loaded is not None:
+                loaded.add(name)
+
+
+class FragmentCache:
+    """The fragments rendered by the `{% cache %}` tag.
+
+    Each entry remembers the state (mtime and size) of the templates used to
+    render it, the one with the tag and those it includes or imports, and the
+    value of the `signatures` it depends on, so it's discarded as soon as any
+    of them changes. `signatures` maps a name to a function that returns a
+    string that changes when something other than a template does, like the
+    list of pages.
+
+    The total size of the fragments kept in memory is kept under `max_size`
+    bytes, discarding the least recently used ones first. With a `folder`,
+    they are also stored there, one file each, so the next build, or the
+    other workers of this one, can use them.
+
+    It can be used by several threads at the same time.
+    """
+
+    def __init__(self, src, *, folder=None, max_size=0):
+        self.src = str(src)
+        self.folder = Path(folder) if folder else None
+        self.max_size = max_size
+        self.signatures = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key: (body, states)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # The states already read, while frozen
+        self._states = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns a `(body, dependencies)` tuple for `key`, if it's still
+        valid, or `None`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        folder = self.folder
+        if entry is None and folder is not None:
+            entry = self._load(folder, key)
+        if entry is not None:
+            body, states = entry
+            if all(self._get_state(name) == state for name, state in states.items()):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return body, set(states)
+            self.discard(key)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, body, dependencies):
+        states = {name: self._get_state(name) for name in dependencies}
+        self._remember(key, body, states)
+        folder = self.folder
+        if folder is not None:
+            self._save(folder, key, body, states)
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    @contextmanager
+    def frozen(self):
+        """While inside, the sources are assumed not to change, like during
+        a build, so the state of each template is only read once.
+        """
+        self._states = {}
+        try:
+            yield self
+        finally:
+            self._states = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "size": self.size,
+        }
+
+    # Private
+
+    def _remember(self, key, body, states):
+        size = len(body)
+        if not self.max_size or size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, states)
+            self.size += size
+            while self.size > self.max_size and self._entries:
+                _, (old_body, _) = self._entries.popitem(last=False)
+                self.size -= len(old_body)
+
+    def _get_path(self, folder, key):
+        name = hashlib.sha1(key.encode("utf8")).hexdigest()
+        return folder / f"{name}.json"
+
+    def _load(self, folder, key):
+        try:
+            data = json.loads(self._get_path(folder, key).read_text(encoding="utf8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("key") != key:
+            return None
+        entry = (data["body"], data["states"])
+        self._remember(key, *entry)
+        return entry
+
+    def _save(self, folder, key, body, states):
+        path = self._get_path(folder, key)
+        data = json.dumps({"key": key, "body": body, "states": states})
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(data, encoding="utf8")
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+
+    def _get_state(self, name):
+        states = self._states
+        if states is not None and name in states:
+            return states[name]
+        signature = self.signatures.get(name)
+        if signature is not None:
+            state = signature()
+        else:
+            try:
+                stat = os.stat(os.path.join(self.src, name))
+            except OSError:
+                state = None
+            else:
+                # A list, like after being read from a file
+                state = [stat.st_mtime_ns, stat.st_size]
+        if states is not None:
+            states[name] = state
+        return state
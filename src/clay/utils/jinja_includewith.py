@@ -1,50 +1,82 @@
-import re
-
+from jinja2 import nodes
 from jinja2.ext import Extension
+from jinja2.lexer import Token
 
 
 __all__ = ("IncludeWith",)
 
+# The tag `include ... with` is parsed as. It has a space, so it can't be
+# written in a template and is only reached through `filter_stream()`.
+TAG = "include with"
+
 
 class IncludeWith(Extension):
-    """A Jinja2 preprocessor extension that let you update the `include`
-    context like this:
+    """A Jinja2 extension that let you update the `include` context like this:
 
         {% include "something.html" with foo=bar %}
         {% include "something.html" with a=3, b=2+2, c='yes' %}
+
+    that works like:
+
+        {% with a=3, b=2+2, c='yes' %}{% include "something.html" %}{% endwith %}
+
+    `include` is a built-in tag, so the extension renames the ones followed
+    by `with` (but not `with context`) in the token stream, and parses them
+    with `parse()`.
     """
 
-    rx = re.compile(
-        r"\{\%-?[\s\n]*include[\s\n]+(?P<tmpl>[^\s\n]+)[\s\n]+with[\s\n]+"
-        r"(?P<context>.*?)[\s\n]*-?\%\}",
-        re.IGNORECASE | re.DOTALL,
-    )
-
-    def preprocess(self, source, name, filename=None):
-        lastpos = 0
-        while 1:
-            m = self.rx.search(source, lastpos)
-            if not m:
-                break
-
-            lastpos = m.end()
-            d = m.groupdict()
-            context = d["context"].replace("\n", " ").strip()
-            if context == "context":
+    tags = {TAG}
+
+    def filter_stream(self, stream):
+        for token in stream:
+            yield token
+            if token.type != "block_begin" or not stream.current.test("name:include"):
                 continue
 
-            source = "".join(
-                [
-                    source[: m.start()],
-                    "{% with ",
-                    context,
-                    " %}",
-                    "{% include ",
-                    d["tmpl"].strip(),
-                    " %}",
-                    "{% endwith %}",
-                    source[m.end() :],
-                ]
-            )
-
-        return source
+            tokens = [next(stream)]
+            while not stream.current.test_any("block_end", "eof"):
+                tokens.append(next(stream))
+            if _has_with(tokens):
+                include = tokens[0]
+                tokens[0] = Token(include.lineno, "name", TAG)
+            yield from tokens
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        template = parser.parse_expression()
+        ignore_missing = False
+        if parser.stream.current.test("name:ignore") and parser.stream.look().test(
+            "name:missing"
+        ):
+            parser.stream.skip(2)
+            ignore_missing = True
+        parser.stream.expect("name:with")
+
+        # Like the arguments of `{% with %}`
+        targets = []
+        values = []
+        while parser.stream.current.type != "block_end":
+            if targets:
+                parser.stream.expect("comma")
+            target = parser.parse_assign_target()
+            target.set_ctx("param")
+            targets.append(target)
+            parser.stream.expect("assign")
+            values.append(parser.parse_expression())
+
+        include = nodes.Include(lineno=lineno)
+        include.template = template
+        include.with_context = True
+        include.ignore_missing = ignore_missing
+        return nodes.With(targets, values, [include], lineno=lineno)
+
+
+def _has_with(tokens):
+    """Returns `True` if the tokens of an `include` tag have a `with`
+    followed by anything but `context`.
+    """
+    for i, token in enumerate(tokens):
+        if token.test("name:with"):
+            rest = tokens[i + 1:]
+            return not (len(rest) == 1 and rest[0].test("name:context"))
+    return False
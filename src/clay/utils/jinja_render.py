@@ -1,7 +1,59 @@
+import threading
+
 import jinja2
 from jinja2.sandbox import SandboxedEnvironment
 
 
+CHUNK_SIZE = 64 * 1024
+
+
+class TrackingMixin(jinja2.Environment):
+    """Makes an environment remember the name of every template it was
+    asked to load, including those pulled in by `extends`, `include` and
+    `import`, so they can be used as dependencies of a page.
+
+    The names are kept per thread, so concurrent renders don't mix them.
+
+    It extends `jinja2.Environment`, the base of every environment, so it
+    can go before any of them, like `SandboxedEnvironment`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+        self.profiler = None
+        # A `FragmentCache`, for the `{% cache %}` tag
+        self.fragment_cache = None
+
+    @property
+    def loaded(self):
+        loaded = getattr(self._local, "loaded", None)
+        if loaded is None:
+            loaded = self._local.loaded = set()
+        return loaded
+
+    @loaded.setter
+    def loaded(self, value):
+        self._local.loaded = value
+
+    def _load_template(self, name, globals):
+        self.loaded.add(name)
+        tmpl = super()._load_template(name, globals)
+        if self.profiler is not None:
+            self.profiler.wrap_template(tmpl)
+        return tmpl
+
+
+class TrackingEnvironment(TrackingMixin, SandboxedEnvironment):
+    """A sandboxed environment that tracks the templates it loads."""
+
+
+class TrustedTrackingEnvironment(TrackingMixin, jinja2.Environment):
+    """Like `TrackingEnvironment`, but without the sandbox, that checks every
+    attribute access and call of the templates. Only for trusted templates.
+    """
+
+
 class JinjaRender:
     @property
     def globals(self):
@@ -15,13 +67,39 @@ class JinjaRender:
     def tests(self):
         return self.env.tests
 
-    def __init__(self, src_path, globals_=None, filters_=None, **envops):
+    @property
+    def dependencies(self):
+        """Names of the templates loaded by the last `render()` call."""
+        return self.env.loaded
+
+    def depends_on(self, name):
+        """Adds `name`, something other than a template, to the dependencies
+        of the page being rendered.
+        """
+        self.env.loaded.add(name)
+
+    def __init__(self, src_path, globals_=None, filters_=None, sandbox=True, **envops):
         envops["loader"] = jinja2.FileSystemLoader(str(src_path))
         envops.setdefault("autoescape", False)
         envops.setdefault("keep_trailing_newline", True)
-        self.env = SandboxedEnvironment(**envops)
+        if sandbox:
+            self.env = TrackingEnvironment(**envops)
+        else:
+            self.env = TrustedTrackingEnvironment(**envops)
         self.env.filters.update(filters_ or {})
         self.env.globals.update(**(globals_ or {}))
+        # Compiled templates of the strings rendered with `string()`
+        self._strings = {}
+        self._marks = tuple(
+            mark for mark in (
+                self.env.block_start_string,
+                self.env.variable_start_string,
+                self.env.comment_start_string,
+                self.env.line_statement_prefix,
+                self.env.line_comment_prefix,
+            )
+            if mark
+        )
 
     def __call__(self, relpath, **data):
         relpath = str(relpath)
@@ -29,9 +107,50 @@ class JinjaRender:
 
     def render(self, relpath, **data):
         relpath = str(relpath)
+        self.env.loaded = set()
         tmpl = self.env.get_template(relpath)
         return tmpl.render(**data)
 
+    def stream(self, relpath, chunk_size=CHUNK_SIZE, **data):
+        """Like `render()`, but yields the output in chunks of about
+        `chunk_size` characters, without building the whole page in memory.
+
+        The templates included or imported while rendering are only known at
+        the end, when `dependencies` is complete. Each chunk can be pulled from
+        a different thread.
+        """
+        relpath = str(relpath)
+        loaded = self.env.loaded = set()
+        tmpl = self.env.get_template(relpath)
+        events = tmpl.generate(**data)
+        buffer = []
+        size = 0
+        while True:
+            # The names of the templates are tracked per thread
+            self.env.loaded = loaded
+            for event in events:
+                buffer.append(event)
+                size += len(event)
+                if size >= chunk_size:
+                    break
+            else:
+                if buffer:
+                    yield "".join(buffer)
+                return
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+
     def string(self, string, **data):
-        tmpl = self.env.from_string(string)
+        """Renders `string` as a template, like the names of the files and
+        folders.
+
+        The strings without any template syntax, almost all of them, are
+        returned as they are, and the others are compiled only once.
+        """
+        if not any(mark in string for mark in self._marks):
+            return string
+        tmpl = self._strings.get(string)
+        if tmpl is None:
+            tmpl = self._strings[string] = self.env.from_string(string)
         return tmpl.render(**data)
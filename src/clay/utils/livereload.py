@@ -0,0 +1,157 @@
+import json
+import os
+import queue
+import threading
+import time
+
+
+__all__ = ("LiveReload", "LIVERELOAD_PATH")
+
+LIVERELOAD_PATH = "/__clay/livereload"
+HEARTBEAT = 15
+
+SCRIPT = """<script>(function () {
+  var source = new EventSource("%(url)s?page=" + encodeURIComponent(%(page)s));
+  source.addEventListener("reload", function () { location.reload(); });
+  source.addEventListener("css", function (event) {
+    var links = document.querySelectorAll("link[rel=stylesheet]");
+    var url = event.data;
+    var matched = Array.prototype.filter.call(links, function (link) {
+      return new URL(link.href).pathname === url;
+    });
+    (matched.length ? matched : links).forEach(function (link) {
+      var href = new URL(link.href);
+      href.searchParams.set("livereload", Date.now());
+      link.href = href.toString();
+    });
+  });
+})();</script>"""
+# For a JSON string inside a `<script>`
+SCRIPT_ESCAPES = str.maketrans({
+    "<": "\\u003c",
+    ">": "\\u003e",
+    "&": "\\u0026",
+})
+
+
+class LiveReload:
+    """Tells the browser tabs connected through Server-Sent Events
+    to reload when the files used by the page they are showing change.
+
+    The templates used by each page are recorded when the page is rendered,
+    so editing a partial reloads only the tabs showing pages that include it.
+    Changes to CSS files of the `static` folder are sent to all the tabs, so
+    they can swap the stylesheets without reloading the page.
+    """
+
+    def __init__(self, index, static_folder="static", interval=0.2):
+        self.index = index
+        self.static_prefix = static_folder.rstrip("/") + "/"
+        self.interval = interval
+        self.pages = {}
+        self.clients = set()
+        self._lock = threading.Lock()
+        self._pid = None
+        index.listeners.append(self.notify)
+
+    def record(self, page, dependencies):
+        """Remembers the templates used to render `page`."""
+        self.pages[page] = frozenset(dependencies) | {page}
+
+    def inject(self, body, page):
+        """Adds the live-reload script at the end of an HTML `body`."""
+        script = self._get_script(page)
+        pos = body.rfind("</body>")
+        if pos == -1:
+            return body + script
+        return body[:pos] + script + body[pos:]
+
+    def inject_stream(self, chunks, page):
+        """Like `inject`, but for an iterator of chunks of HTML."""
+        script = self._get_script(page)
+        keep = len("</body>") - 1
+        carry = ""
+        chunks = iter(chunks)
+        for chunk in chunks:
+            text = carry + chunk
+            pos = text.find("</body>")
+            if pos != -1:
+                yield text[:pos] + script + text[pos:]
+                yield from chunks
+                return
+            # The end could be the start of a "</body>" cut in half
+            carry = text[-keep:]
+            if len(text) > keep:
+                yield text[:-keep]
+        yield carry + script
+
+    def stream(self, page):
+        """Generator of the events for a tab showing `page`."""
+        self.start()
+        client = (page, queue.SimpleQueue())
+        with self._lock:
+            self.clients.add(client)
+        try:
+            yield b"retry: 1000\n\n"
+            while True:
+                try:
+                    event, data = client[1].get(timeout=HEARTBEAT)
+                except queue.Empty:
+                    yield b": ping\n\n"
+                    continue
+                yield f"event: {event}\ndata: {data}\n\n".encode("utf8")
+        finally:
+            with self._lock:
+                self.clients.discard(client)
+
+    def notify(self, changed):
+        """Sends the events for the `changed` paths to the connected tabs."""
+        changed = set(changed)
+        stylesheets = {
+            path for path in changed
+            if path.startswith(self.static_prefix) and path.endswith(".css")
+        }
+        changed -= stylesheets
+
+        with self._lock:
+            clients = list(self.clients)
+        for page, events in clients:
+            if self._must_reload(page, changed):
+                events.put(("reload", ""))
+                continue
+            for path in sorted(stylesheets):
+                events.put(("css", "/" + path))
+
+    def start(self):
+        """Starts, once per process, the thread that watches the files."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._watch, daemon=True, name="clay-livereload")
+        thread.start()
+
+    # Private
+
+    def _get_script(self, page):
+        # The page can be the path of any request, so it must not be able
+        # to close the script
+        page = json.dumps(page).translate(SCRIPT_ESCAPES)
+        return SCRIPT % {"url": LIVERELOAD_PATH, "page": page}
+
+    def _must_reload(self, page, changed):
+        if not changed:
+            return False
+        dependencies = self.pages.get(page)
+        if dependencies is None:
+            # Rendered by a previous run of the server, so we can't know
+            return True
+        return any(
+            path in dependencies or path.startswith(self.static_prefix)
+            for path in changed
+        )
+
+    def _watch(self):
+        while True:
+            self.index.refresh()
+            time.sleep(self.interval)
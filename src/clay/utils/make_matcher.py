@@ -1,10 +1,17 @@
 import os
+import re
 import unicodedata
-from fnmatch import fnmatch
-from functools import reduce
+from fnmatch import translate
+from functools import lru_cache
 
 
-__all__ = ("make_matcher", "make_filter", "no_filter")
+__all__ = ("make_matcher", "make_filter", "make_pruner", "no_filter")
+
+# How many normalized paths to remember
+CACHE_SIZE = 8192
+
+RX_EXT_PATTERN = re.compile(r"^\*\.([^.*?\[\]/\\]+)$")
+RX_WILDCARD = re.compile(r"[*?\[]")
 
 
 def _normalize_str(text, form="NFD"):
@@ -12,17 +19,32 @@ def _normalize_str(text, form="NFD"):
     return unicodedata.normalize(form, text)
 
 
-def _fullmatch(path, pattern):
-    path = _normalize_str(str(path))
-    name = os.path.basename(path)
-    return fnmatch(name, pattern) or fnmatch(path, pattern)
+@lru_cache(maxsize=CACHE_SIZE)
+def _split_path(path):
+    """Returns the normalized path and its basename, ready to be matched."""
+    if not path.isascii():
+        path = _normalize_str(path)
+    # On Windows, this also replaces the "/" with "\\"
+    path = os.path.normcase(path)
+    return path, path.rpartition(os.sep)[2]
 
 
-def _match(path, patterns):
-    return reduce(
-        lambda r, pattern: r or _fullmatch(path, pattern),
-        patterns,
-        False)
+def _compile(patterns):
+    """Split the patterns into a set of extensions, for the plain `*.ext`
+    patterns, and a single regular expression for the rest.
+    """
+    exts = set()
+    rest = []
+    for pattern in patterns:
+        pattern = os.path.normcase(_normalize_str(pattern))
+        match = RX_EXT_PATTERN.match(pattern)
+        if match:
+            exts.add(match.group(1))
+        else:
+            rest.append(translate(pattern))
+
+    rx = re.compile("|".join(rest)) if rest else None
+    return frozenset(exts), rx
 
 
 def make_matcher(patterns):
@@ -32,15 +54,80 @@ def make_matcher(patterns):
     This is neccesary because the way `os.walk` read unicode paths could vary.
     For instance, it might returns a decomposed unicode string reading,
     for example, the character "ñ" as `\u0303` instead of `\xf1`.
+
+    A path matches if either its full path or its basename match a pattern,
+    like with `fnmatch`. The patterns are compiled once into a set of
+    extensions, for the `*.ext` ones, and a single regular expression.
     """
-    patterns = [_normalize_str(pattern) for pattern in patterns]
+    exts, rx = _compile(patterns)
 
     def path_match(path):
-        return _match(path, patterns)
+        path, name = _split_path(str(path))
+        if exts:
+            _, dot, ext = name.rpartition(".")
+            if dot and ext in exts:
+                return True
+        if rx is None:
+            return False
+        return bool(rx.match(name) or rx.match(path))
 
     return path_match
 
 
+def make_pruner(exclude, include=(), src=None):
+    """Returns a function that evaluates if everything inside a folder
+    is excluded, so the folder doesn't need to be walked at all.
+
+    That is the case when an `exclude` pattern ending with "*" matches the
+    folder path followed by a "/" (like "node_modules/*" or ".*"), and no
+    `include` pattern names a path inside that folder.
+
+    An `include` pattern without a "/" (like "favicon.ico") can match the
+    name of a file at any depth. If it's a literal name, the folder is not
+    pruned when a file with that name is directly inside it, which is checked,
+    inside `src`, without listing the folder. Deeper ones aren't found.
+    If it has wildcards, or there is no `src`, no folder is pruned.
+    """
+    sep = os.path.normcase("/")
+    exclude = [
+        translate(os.path.normcase(_normalize_str(pattern)))
+        for pattern in exclude
+        if pattern.endswith("*")
+    ]
+    rx = re.compile("|".join(exclude)) if exclude else None
+    root = "" if src is None else str(src)
+    names = [
+        pattern for pattern in include
+        if src is not None and "/" not in pattern and not RX_WILDCARD.search(pattern)
+    ]
+    if any("/" not in pattern and pattern not in names for pattern in include):
+        rx = None
+    prefixes = [
+        RX_WILDCARD.split(os.path.normcase(_normalize_str(pattern)), 1)[0]
+        for pattern in include
+        if "/" in pattern
+    ]
+
+    def must_prune(folder):
+        if rx is None:
+            return False
+        path = str(folder)
+        folder, _ = _split_path(path)
+        folder += sep
+        if not rx.match(folder):
+            return False
+        if any(
+            folder.startswith(prefix) or prefix.startswith(folder)
+            for prefix in prefixes
+        ):
+            return False
+        return not any(
+            os.path.lexists(os.path.join(root, path, name)) for name in names
+        )
+
+    return must_prune
+
+
 def make_filter(must_exclude, must_include):
     """Returns a function that evaluates if a path name must be
     excluded or not.
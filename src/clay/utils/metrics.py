@@ -0,0 +1,131 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any
+
+
+__all__ = ("Metrics", "RequestTimer")
+
+QUANTILES = (0.5, 0.95, 0.99)
+OTHER_ROUTE = "__other__"
+
+
+class RequestTimer:
+    """Measures the phases of a request, to report them in
+    a `Server-Timing` header.
+    """
+
+    def __init__(self):
+        self.started_at = perf_counter()
+        self.phases = {}
+        self.route = None
+
+    @contextmanager
+    def measure(self, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + perf_counter() - start
+
+    @property
+    def elapsed(self):
+        return perf_counter() - self.started_at
+
+    def header(self):
+        """Returns the value of the `Server-Timing` header, in milliseconds."""
+        timings = [f"{phase};dur={secs * 1000:.3f}" for phase, secs in self.phases.items()]
+        timings.append(f"total;dur={self.elapsed * 1000:.3f}")
+        return ", ".join(timings)
+
+
+class Metrics:
+    """Rolling duration stats of the requests, per route, and totals
+    per phase.
+
+    Only the last `window` durations of each route are kept to calculate the
+    quantiles. After `max_routes` distinct routes, the new ones are counted
+    together as "__other__".
+    """
+
+    def __init__(self, window=1024, max_routes=500):
+        self.window = window
+        self.max_routes = max_routes
+        # route: [durations, count, total seconds]
+        self.routes = {}
+        # phase: [count, total seconds]
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, seconds, phases=None):
+        with self._lock:
+            if route not in self.routes and len(self.routes) >= self.max_routes:
+                route = OTHER_ROUTE
+            stats: list[Any] | None = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = [deque(maxlen=self.window), 0, 0.0]
+            stats[0].append(seconds)
+            stats[1] += 1
+            stats[2] += seconds
+            for phase, secs in (phases or {}).items():
+                total = self.phases.setdefault(phase, [0, 0.0])
+                total[0] += 1
+                total[1] += secs
+
+    def quantiles(self, route):
+        with self._lock:
+            durations = sorted(self.routes[route][0])
+        return {q: _quantile(durations, q) for q in QUANTILES}
+
+    def to_prometheus(self, extra=None):
+        """Returns the metrics in the Prometheus text exposition format.
+        `extra` is an optional dict of `{name: value}` to add, as counters
+        if their names end with "_total" and as gauges otherwise.
+        """
+        lines = [
+            "# HELP clay_request_duration_seconds Duration of the requests per route.",
+            "# TYPE clay_request_duration_seconds summary",
+        ]
+        with self._lock:
+            routes = {
+                route: (sorted(durations), count, total)
+                for route, (durations, count, total) in self.routes.items()
+            }
+            phases = {phase: tuple(total) for phase, total in self.phases.items()}
+
+        for route, (durations, count, total) in sorted(routes.items()):
+            label = _escape(route)
+            for q in QUANTILES:
+                value = _quantile(durations, q)
+                lines.append(
+                    f'clay_request_duration_seconds{{route="{label}",quantile="{q}"}} {value:.6f}'
+                )
+            lines.append(f'clay_request_duration_seconds_sum{{route="{label}"}} {total:.6f}')
+            lines.append(f'clay_request_duration_seconds_count{{route="{label}"}} {count}')
+
+        lines += [
+            "# HELP clay_request_phase_seconds Time spent on each phase of the requests.",
+            "# TYPE clay_request_phase_seconds summary",
+        ]
+        for phase, (count, total) in sorted(phases.items()):
+            lines.append(f'clay_request_phase_seconds_sum{{phase="{phase}"}} {total:.6f}')
+            lines.append(f'clay_request_phase_seconds_count{{phase="{phase}"}} {count}')
+
+        for name, value in (extra or {}).items():
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(durations, q):
+    if not durations:
+        return 0.0
+    index = min(len(durations) - 1, int(q * len(durations)))
+    return durations[index]
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
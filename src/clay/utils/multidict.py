@@ -1,22 +1,35 @@
-from collections import defaultdict
-
-
 __all__ = ("MultiDict", )
 
 
-class MultiDict(defaultdict):
-    """A `MultiDict` is a defaultdict subclass customized to deal with
-    multiple values for the same key.
+class MultiDict(dict):
+    """A `MultiDict` is a dict customized to deal with multiple values for
+    the same key. The values of each key are always a list.
+
+    Reading a missing key returns an empty list but, unlike with
+    a `defaultdict`, it doesn't add the key.
     """
 
+    __slots__ = ()
+
     def __init__(self, *mapping):
-        super().__init__(list)
+        super().__init__()
         for key, value in mapping or []:
-            self[key].append(value)
+            self.add(key, value)
+
+    def __missing__(self, key):
+        return []
 
     def __repr__(self):
         return f"<Multidict {self.keys()} >"
 
+    def add(self, key, value):
+        """Add a value to the list of values of the key."""
+        values = dict.get(self, key)
+        if values is None:
+            self[key] = [value]
+        else:
+            values.append(value)
+
     def get(self, key, default=None, *, index=-1):
         """Return the first value of the key of `default` one if the key
         doesn't exist.
@@ -35,7 +48,7 @@ class MultiDict(defaultdict):
                 is chosen.
 
         """
-        values = self[key]
+        values = dict.get(self, key)
         value = values[index] if values else None
         if value is None:
             return default
@@ -51,7 +64,7 @@ class MultiDict(defaultdict):
                 The key to be looked up.
 
         """
-        return defaultdict.__getitem__(self, key)
+        return self[key]
 
     # shallow compatibility with other Request objects
     # Aliases to mimic other multi-dict APIs (Django, Flask, etc.)
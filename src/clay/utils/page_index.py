@@ -0,0 +1,245 @@
+import hashlib
+import os
+import posixpath
+import threading
+from stat import S_ISREG
+
+import yaml
+
+from .walk import TreeWalker
+
+
+__all__ = ("Page", "PageIndex", "read_meta")
+
+# The metadata of a page is a YAML block inside a Jinja comment at its start,
+# so it's not part of the rendered page:
+#
+#     {#---
+#     title: Hello world
+#     date: 2024-01-31
+#     ---#}
+#
+META_START = "{#---"
+META_END = "---#}"
+MAX_META_SIZE = 16 * 1024
+SORT_ATTRS = ("path", "size", "mtime")
+
+
+def read_meta(path):
+    """Returns the metadata at the start of the file at `path`, as a dict."""
+    try:
+        with open(path, encoding="utf8") as f:
+            head = f.read(MAX_META_SIZE)
+    except (OSError, UnicodeDecodeError):
+        return {}
+    if not head.startswith(META_START):
+        return {}
+    end = head.find(META_END)
+    if end == -1:
+        return {}
+    try:
+        meta = yaml.safe_load(head[len(META_START):end])
+    except yaml.YAMLError:
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+class Page(str):
+    """The path of a page, as listed, with its `path` relative to the
+    project, `size`, `mtime` and the `meta` from its front matter, read
+    only if used.
+    """
+
+    path: str
+    size: int
+    mtime: float
+    _abspath: str
+    _meta: dict | None
+
+    def __new__(cls, value, path, abspath, size, mtime):
+        page = super().__new__(cls, value)
+        page.path = path
+        page.size = size
+        page.mtime = mtime
+        page._abspath = abspath
+        page._meta = None
+        return page
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = read_meta(self._abspath)
+        return self._meta
+
+    def __reduce__(self):
+        return Page, (str(self), self.path, self._abspath, self.size, self.mtime)
+
+
+class PageIndex:
+    """An index of the pages of the project, so listing them again, like in
+    the navigation of every page, doesn't touch the disk.
+
+    Each folder listed is walked only once, the first time, like
+    `list_pages()` always did: the files of the folder first, sorted by name,
+    and then those of each subfolder, skipping the paths (relative to that
+    folder) that `exclude` matches and the subfolders `must_prune` matches.
+    The lists are also cached, by their arguments.
+
+    Call `scan()` to start over or `update()` with the paths of the files
+    that changed.
+    """
+
+    def __init__(self, src, *, must_prune=None, exclude=None):
+        self.src = str(src)
+        self.must_prune = must_prune
+        self.exclude = exclude
+        # folder: the pages inside it, in the order they were found
+        self._folders = {}
+        self._lists = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def scan(self):
+        """Forgets every folder and indexes the pages of the project again."""
+        pages = self._walk("")
+        with self._lock:
+            self._folders = {"": pages}
+            self._lists = {}
+            self._signature = None
+
+    def update(self, changed):
+        """Updates the folders with any of the `changed` paths, relative
+        to `src`.
+
+        Returns `True` if any list of pages could be different: if pages
+        were added or removed, or if the changed ones had their metadata
+        read or were listed sorted by size or mtime.
+        """
+        with self._lock:
+            by_state = any(key[2] in ("size", "mtime") for key in self._lists)
+            different = False
+            for folder, pages in list(self._folders.items()):
+                touched = {
+                    path for path in changed if self._could_list(folder, path)
+                }
+                if not touched:
+                    continue
+                new_pages = self._folders[folder] = self._walk(folder)
+                if [page.path for page in pages] != [page.path for page in new_pages]:
+                    different = True
+                elif by_state or any(
+                    page._meta is not None for page in pages if page.path in touched
+                ):
+                    different = True
+            self._lists = {}
+            self._signature = None
+            return different
+
+    def signature(self):
+        """Returns a hash of the path, size and mtime of every page of the
+        project, that changes whenever any list of pages could be different.
+
+        Only the root folder, with every page, is used, so the hash doesn't
+        depend on which other folders were listed so far.
+        """
+        if "" not in self._folders:
+            self.scan()
+        with self._lock:
+            if self._signature is None:
+                states = [
+                    (page.path, page.size, page.mtime) for page in self._folders[""]
+                ]
+                self._signature = hashlib.sha1(repr(states).encode("utf8")).hexdigest()
+            return self._signature
+
+    def list(self, folder=".", sub=True, sort=None, reverse=False, page=None, per_page=None):
+        """Returns the pages inside `folder`, relative to it, and inside its
+        subfolders if `sub` is `True`.
+
+        By default they are in the order they were found, but they can be
+        sorted by `sort`: "path", "size", "mtime" or the name of a field of
+        their metadata. They can also be split in pages of `per_page`
+        pages: `page` is the number of the one to return, starting from 1.
+        """
+        folder = folder.replace("..", "").replace("\\", "/").strip("/")
+        folder = posixpath.normpath(folder) if folder else ""
+        folder = "" if folder == "." else folder
+        key = (folder, bool(sub), sort, bool(reverse))
+        with self._lock:
+            pages = self._lists.get(key)
+        if pages is None:
+            pages = self._select(self._get_folder(folder), *key[1:])
+            with self._lock:
+                self._lists[key] = pages
+        if per_page:
+            start = (max(int(page or 1), 1) - 1) * int(per_page)
+            return pages[start:start + int(per_page)]
+        return list(pages)
+
+    # Private
+
+    def _get_folder(self, folder):
+        with self._lock:
+            pages = self._folders.get(folder)
+        if pages is None:
+            pages = self._walk(folder)
+            with self._lock:
+                self._folders[folder] = pages
+        return pages
+
+    def _walk(self, folder):
+        top = os.path.join(self.src, folder)
+        pages = []
+        for abs_folder, relfolder, files in TreeWalker(top, must_prune=self.must_prune):
+            if self.exclude and self.exclude(relfolder):
+                continue
+            for name in sorted(files):
+                relpath = os.path.join(relfolder, name)
+                if self.exclude and self.exclude(relpath):
+                    continue
+                path = relpath.replace(os.sep, "/")
+                if folder:
+                    path = f"{folder}/{path}"
+                page = self._make_page(relpath, path, os.path.join(abs_folder, name))
+                if page is not None:
+                    pages.append(page)
+        return pages
+
+    def _select(self, pages, sub, sort, reverse):
+        if not sub:
+            pages = [page for page in pages if os.sep not in page]
+        if sort is None:
+            return pages[::-1] if reverse else list(pages)
+        if sort in SORT_ATTRS:
+            return sorted(pages, key=lambda page: getattr(page, sort), reverse=reverse)
+        # The pages without that field go last
+        with_field = [page for page in pages if page.meta.get(sort) is not None]
+        with_field.sort(key=lambda page: page.meta[sort], reverse=reverse)
+        return with_field + [page for page in pages if page.meta.get(sort) is None]
+
+    def _could_list(self, folder, path):
+        """Returns `True` if `path`, relative to `src`, could be one of the
+        pages listed for `folder`.
+        """
+        if folder:
+            if not path.startswith(folder + "/"):
+                return False
+            path = path[len(folder) + 1:]
+        relfolder = posixpath.dirname(path)
+        parts = relfolder.split("/") if relfolder else []
+        for i in range(1, len(parts) + 1):
+            if self.must_prune and self.must_prune(os.path.join(*parts[:i])):
+                return False
+        relpath = path.replace("/", os.sep)
+        if self.exclude and (self.exclude(os.path.dirname(relpath)) or self.exclude(relpath)):
+            return False
+        return True
+
+    def _make_page(self, value, path, abspath):
+        try:
+            stat = os.stat(abspath)
+        except OSError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return Page(value, path, abspath, stat.st_size, stat.st_mtime)
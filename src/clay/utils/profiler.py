@@ -0,0 +1,200 @@
+import json
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+
+
+__all__ = ("BuildProfiler",)
+
+PHASES = ("render", "relativize", "write", "copy")
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class BuildProfiler:
+    """Measures where the time of a build goes.
+
+    - The wall time of each phase (render, relativize, write or copy)
+      of every page.
+    - The self time of every template, including the layouts, partials
+      and blocks used by the pages.
+    - The peak memory used, as reported by `tracemalloc`.
+
+    Tracing the memory makes every allocation slower, so, with
+    `trace_memory=True`, all the times are inflated by a similar factor.
+    They are still good to compare the pages and templates between them,
+    but use `trace_memory=False` for their real values.
+
+    The templates are patched to measure them, until `stop()` is called.
+
+    The data can be printed as a summary table or saved as JSON and in the
+    "evented" format of https://speedscope.app
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.pages = {}
+        # name: [calls, self_time, total_time]
+        self.templates = {}
+        self.peak_memory = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stack = []
+        self._frames = {}
+        self._events = []
+        # (template, root_render_func, blocks) of the patched templates
+        self._patched = []
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started_at = perf_counter()
+
+    def stop(self):
+        """Ends the measures and restores the render functions of the
+        templates, that could be reused after the build.
+        """
+        if self.started_at is not None:
+            self.elapsed = perf_counter() - self.started_at
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        for tmpl, root_render_func, blocks in self._patched:
+            tmpl.root_render_func = root_render_func
+            tmpl.blocks.update(blocks)
+            del tmpl._clay_profiled
+        self._patched = []
+
+    @contextmanager
+    def phase(self, page, name):
+        """Measure the wall time of a phase of a page."""
+        page = str(page)
+        self._open(f"{name} {page}")
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self._close(f"{name} {page}")
+            phases = self.pages.setdefault(page, dict.fromkeys(PHASES, 0.0))
+            phases[name] += elapsed
+
+    def wrap_template(self, tmpl):
+        """Wraps the render functions of a template so every time it runs its
+        time is added to the template stats. Templates are wrapped only once.
+        """
+        if getattr(tmpl, "_clay_profiled", False):
+            return
+        tmpl._clay_profiled = True
+        self._patched.append((tmpl, tmpl.root_render_func, dict(tmpl.blocks)))
+        name = tmpl.name or "<string>"
+        tmpl.root_render_func = self._wrap(name, tmpl.root_render_func)
+        for block, func in tmpl.blocks.items():
+            tmpl.blocks[block] = self._wrap(f"{name}#{block}", func)
+
+    def summary(self, limit=20):
+        """Returns the summary tables as a string."""
+        lines = [
+            f" Build time: {self.elapsed:.3f}s",
+            f" Peak memory: {self.peak_memory / 1024 / 1024:.1f}MB",
+            "",
+            f" {'calls':>8} {'self ms':>10} {'total ms':>10}  template",
+        ]
+        templates = sorted(self.templates.items(), key=lambda item: -item[1][1])
+        for name, (calls, self_time, total_time) in templates[:limit]:
+            lines.append(
+                f" {calls:>8} {self_time * 1000:>10.2f} {total_time * 1000:>10.2f}  {name}"
+            )
+
+        header = "".join(f" {phase + ' ms':>13}" for phase in PHASES)
+        lines += ["", f"{header} {'total ms':>10}  page"]
+        pages = sorted(self.pages.items(), key=lambda item: -sum(item[1].values()))
+        for page, phases in pages[:limit]:
+            row = "".join(f" {phases[phase] * 1000:>13.2f}" for phase in PHASES)
+            lines.append(f"{row} {sum(phases.values()) * 1000:>10.2f}  {page}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "elapsed": self.elapsed,
+            "peak_memory": self.peak_memory,
+            "templates": {
+                name: {"calls": calls, "self": self_time, "total": total_time}
+                for name, (calls, self_time, total_time) in self.templates.items()
+            },
+            "pages": self.pages,
+        }
+
+    def to_speedscope(self, name="clay build"):
+        frames = sorted(self._frames.items(), key=lambda item: item[1])
+        end = self._events[-1]["at"] if self._events else 0
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "shared": {"frames": [{"name": frame} for frame, _ in frames]},
+            "profiles": [
+                {
+                    "type": "evented",
+                    "name": name,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": end,
+                    "events": self._events,
+                }
+            ],
+            "name": name,
+            "exporter": "clay",
+        }
+
+    def save(self, path, speedscope_path=None):
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2))
+        if speedscope_path:
+            Path(speedscope_path).write_text(json.dumps(self.to_speedscope()))
+
+    # Private
+
+    def _wrap(self, name, func):
+        def profiled(*args, **kwargs):
+            gen = func(*args, **kwargs)
+            self.templates.setdefault(name, [0, 0.0, 0.0])[0] += 1
+            self._open(name)
+            start = perf_counter()
+            try:
+                while True:
+                    self._enter(name)
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        self._exit()
+                    yield item
+            finally:
+                self.templates[name][2] += perf_counter() - start
+                self._close(name)
+
+        return profiled
+
+    def _enter(self, name):
+        now = perf_counter()
+        if self._stack:
+            self._stack[-1][2] += now - self._stack[-1][1]
+        self._stack.append([name, now, 0.0])
+
+    def _exit(self):
+        name, started_at, self_time = self._stack.pop()
+        now = perf_counter()
+        stats = self.templates.setdefault(name, [0, 0.0, 0.0])
+        stats[1] += self_time + now - started_at
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def _open(self, name):
+        frame = self._frames.setdefault(name, len(self._frames))
+        self._event("O", frame)
+
+    def _close(self, name):
+        self._event("C", self._frames[name])
+
+    def _event(self, type_, frame):
+        at = (perf_counter() - self.started_at) * 1000 if self.started_at else 0
+        self._events.append({"type": type_, "frame": frame, "at": at})
@@ -0,0 +1,174 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+__all__ = ("RenderCache", "mark_volatile", "no_cache", "track_volatile")
+
+_volatile: ContextVar[dict | None] = ContextVar("clay_volatile", default=None)
+_END = object()
+
+
+def mark_volatile():
+    """Marks the page being rendered as one that must not be cached, because
+    its output can change even if its templates don't (like when it
+    uses `now()` or `shuffle`).
+    """
+    tracker = _volatile.get()
+    if tracker is not None:
+        tracker["volatile"] = True
+
+
+def no_cache():
+    """Template global to opt a page out of the render cache:
+    `{{ no_cache() }}`.
+    """
+    mark_volatile()
+    return ""
+
+
+@contextmanager
+def track_volatile():
+    """Context manager that yields a dict whose "volatile" key is set to
+    `True` if `mark_volatile()` is called inside it.
+    """
+    tracker = {"volatile": False}
+    token = _volatile.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _volatile.reset(token)
+
+
+class RenderCache:
+    """An in-memory LRU cache of rendered pages for the server.
+
+    Each entry remembers the state (mtime and size) of the templates used to
+    render it, so it's discarded as soon as the page, or any layout or partial
+    it uses, changes.
+
+    The total size of the cached bodies, and of their compressed versions,
+    is kept under `max_size` bytes, discarding the least recently used
+    ones first.
+    """
+
+    def __init__(self, src, max_size=0):
+        self.src = src
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key: [body, states, {encoding: compressed body}, size]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached body for `key`, if it's still valid, or `None`."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            body, states, _, _ = entry
+            if all(self._get_state(name) == state for name, state in states.items()):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return body
+            self.discard(key)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get_compressed(self, key, body, encoding, compress):
+        """Returns `body`, the one cached for `key`, compressed with
+        `compress(data, encoding)`. The result is cached with the body, so
+        each version of a page is only compressed once per encoding.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not body:
+                entry = None
+            elif encoding in entry[2]:
+                return entry[2][encoding]
+
+        data = compress(body.encode("utf8"), encoding)
+        if entry is None:
+            return data
+        with self._lock:
+            if self._entries.get(key) is entry and encoding not in entry[2]:
+                entry[2][encoding] = data
+                entry[3] += len(data)
+                self.size += len(data)
+                self._evict()
+        return data
+
+    def set(self, key, body, dependencies):
+        size = len(body)
+        if not self.max_size or size > self.max_size:
+            return
+        states = {name: self._get_state(name) for name in dependencies}
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[3]
+            self._entries[key] = [body, states, {}, size]
+            self.size += size
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def track(self):
+        """See `track_volatile()`."""
+        return track_volatile()
+
+    def track_stream(self, chunks, tracker):
+        """Iterates over `chunks` setting `tracker["volatile"]` like `track()`
+        does. Each chunk can be pulled from a different thread.
+        """
+        chunks = iter(chunks)
+        while True:
+            token = _volatile.set(tracker)
+            try:
+                chunk = next(chunks, _END)
+            finally:
+                _volatile.reset(token)
+            if chunk is _END:
+                return
+            yield chunk
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "size": self.size,
+        }
+
+    # Private
+
+    def _evict(self):
+        while self.size > self.max_size and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry[3]
+
+    def _get_state(self, name):
+        try:
+            stat = os.stat(os.path.join(self.src, name))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
@@ -1,27 +1,91 @@
 import re
+from http.cookies import CookieError, SimpleCookie
 
 import multipart
 
 from .multidict import MultiDict
+from .render_cache import mark_volatile
 
 
 RX_INDEX = re.compile(r"/index\.html$")
+# Headers that, in the WSGI environ, don't start with "HTTP_"
+CONTENT_HEADERS = ("CONTENT_TYPE", "CONTENT_LENGTH")
 
 
 class Request:
+    """The request a page is rendered for.
+
+    Besides the path, everything is read from the `environ` only when
+    used, since most pages never look at the query, headers or cookies.
+
+    The server caches the pages by their path, query and `ajax`, so reading
+    anything else that can change between requests (the `environ`, headers,
+    cookies, method or remote address) marks the page as volatile.
+    """
+
+    __slots__ = ("_environ", "_path", "_query", "_headers", "_cookies")
+
     def __init__(self, environ=None, path=None):
-        environ = environ or {}
-        self.environ = environ
-        self.path = path or self.get_path()
-        self.query = self.get_query()
-        self.ajax = self.is_xhr
-        self.method = environ.get("REQUEST_METHOD", "GET").upper()
-        self.remote_addr = environ.get("REMOTE_ADDR", "127.0.0.1")
+        self._environ = environ or {}
+        self._path = path
+        self._query = None
+        self._headers = None
+        self._cookies = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = self.get_path()
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        self._path = value
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = self.get_query()
+        return self._query
+
+    @property
+    def environ(self):
+        mark_volatile()
+        return self._environ
+
+    @property
+    def headers(self):
+        """The HTTP headers, like `request.headers["User-Agent"]`."""
+        mark_volatile()
+        if self._headers is None:
+            self._headers = self.get_headers()
+        return self._headers
+
+    @property
+    def cookies(self):
+        mark_volatile()
+        if self._cookies is None:
+            self._cookies = self.get_cookies()
+        return self._cookies
+
+    @property
+    def method(self):
+        mark_volatile()
+        return self._environ.get("REQUEST_METHOD", "GET").upper()
+
+    @property
+    def remote_addr(self):
+        mark_volatile()
+        return self._environ.get("REMOTE_ADDR", "127.0.0.1")
+
+    @property
+    def ajax(self):
+        return self.is_xhr
 
     @property
     def is_xhr(self):
-        if "HTTP_X_REQUESTED_WITH" in self.environ:
-            return self.environ["HTTP_X_REQUESTED_WITH"] == "XMLHttpRequest"
+        if "HTTP_X_REQUESTED_WITH" in self._environ:
+            return self._environ["HTTP_X_REQUESTED_WITH"] == "XMLHttpRequest"
         return False
 
     @property
@@ -29,16 +93,34 @@ class Request:
         return re.sub(RX_INDEX, "", self.path)
 
     def get_path(self):
-        path_info = self.environ.get("PATH_INFO")
+        path_info = self._environ.get("PATH_INFO")
         if not path_info:
             return ""
         path = path_info.encode("iso-8859-1", "replace").decode("utf-8", "replace")
         return path[1:] + "index.html" if path.endswith("/") else path[1:]
 
     def get_query(self):
-        query_string = self.environ.get("QUERY_STRING")
+        query_string = self._environ.get("QUERY_STRING")
         return parse_query_string(query_string)
 
+    def get_headers(self):
+        headers = {}
+        for key, value in self._environ.items():
+            if key.startswith("HTTP_"):
+                key = key[5:]
+            elif key not in CONTENT_HEADERS:
+                continue
+            headers[key.replace("_", "-").title()] = value
+        return headers
+
+    def get_cookies(self):
+        cookie = SimpleCookie()
+        try:
+            cookie.load(self._environ.get("HTTP_COOKIE", ""))
+        except CookieError:
+            return {}
+        return {name: morsel.value for name, morsel in cookie.items()}
+
 
 def parse_query_string(query_string):
     """Parse a query string into a MultiDict.
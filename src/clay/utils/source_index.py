@@ -0,0 +1,300 @@
+import ctypes
+import ctypes.util
+import os
+import posixpath
+import struct
+import threading
+import time
+import weakref
+
+from .walk import TreeWalker
+
+
+__all__ = ("SourceIndex",)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+    | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+ADDED = IN_CREATE | IN_MOVED_TO
+REMOVED = IN_DELETE | IN_MOVED_FROM
+
+EVENT = struct.Struct("iIII")
+MAX_LOOKUPS = 10_000
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+    return libc
+
+
+class SourceIndex:
+    """An in-memory index of the files of the source tree, so finding if a
+    page exists is a dict lookup instead of several `stat()` calls.
+
+    The answers, positive and negative, are memoized until something changes.
+    On Linux the index is kept current with inotify: the pending events are
+    read, without blocking, before each lookup. Everywhere else (or if
+    inotify can't be used) the tree is scanned again if it's been more than
+    `interval` seconds since the last time.
+
+    `must_filter(relpath)` returns `True` for the files that must be ignored,
+    and `must_prune(relfolder)` for the folders that must not be indexed.
+    Symbolic links to folders are followed, so their pages can be served.
+
+    The functions in `listeners` are called with the set of the paths that
+    have been added, deleted or modified, each time a change is found.
+    """
+
+    def __init__(self, src, *, must_filter=None, must_prune=None, interval=1.0, inotify=True):
+        self.src = str(src)
+        self.must_filter = must_filter
+        self.must_prune = must_prune
+        self.interval = interval
+        self.files = set()
+        self.listeners = []
+        self._lookups = {}
+        self._states = {}
+        self._lock = threading.Lock()
+        self._libc = _load_libc() if inotify else None
+        self._fd = None
+        self._pid = None
+        self._wds = {}
+        self._scanned_at = 0.0
+        self._finalizer = None
+        self.start()
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def start(self):
+        """Builds the index and, if possible, starts watching the tree.
+        It must be called again after a fork (`refresh()` does it).
+        """
+        with self._lock:
+            self.close()
+            self._pid = os.getpid()
+            if self._libc is not None:
+                fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+                if fd >= 0:
+                    self._fd = fd
+                    self._finalizer = weakref.finalize(self, os.close, fd)
+            self.files = self._scan("")
+            self._lookups = {}
+
+    def close(self):
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        self._fd = None
+        self._wds = {}
+
+    def exists(self, path):
+        """Returns `True` if `path` is a file of the source tree that is
+        not filtered out.
+        """
+        self.refresh()
+        found = self._lookups.get(path)
+        if found is None:
+            found = self._lookup(path)
+            if len(self._lookups) >= MAX_LOOKUPS:
+                self._lookups = {}
+            self._lookups[path] = found
+        return found
+
+    def refresh(self):
+        """Updates the index with the changes since the last call and
+        returns the relative paths of the files that changed.
+        """
+        if self._pid != os.getpid():
+            self.start()
+            return set()
+
+        if self._fd is not None:
+            with self._lock:
+                changed = self._read_events()
+        elif time.monotonic() - self._scanned_at >= self.interval:
+            with self._lock:
+                changed = self._poll()
+        else:
+            return set()
+
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+        return changed
+
+    # Private
+
+    def _lookup(self, path):
+        relpath = posixpath.normpath(path)
+        if relpath.startswith(("../", "/")) or relpath in (".", ".."):
+            return False
+        if self.must_filter and self.must_filter(relpath):
+            return False
+        return relpath in self.files
+
+    def _poll(self):
+        files = self._scan("")
+        changed = files ^ self.files
+        if self.listeners:
+            # Modified files can only be noticed by comparing their state
+            states = {path: self._get_state(path) for path in files}
+            changed.update(
+                path for path, state in states.items()
+                if self._states.get(path, state) != state
+            )
+            self._states = states
+        self.files = files
+        if changed:
+            self._lookups = {}
+        return changed
+
+    def _get_state(self, relpath):
+        try:
+            stat = os.stat(os.path.join(self.src, relpath))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _scan(self, relfolder):
+        """Returns the files inside `relfolder` and, if using inotify,
+        watches it and its subfolders.
+        """
+        files = set()
+        top = os.path.join(self.src, relfolder)
+        walker = TreeWalker(
+            top, must_prune=self._must_prune(relfolder), follow_symlinks=True
+        )
+        for folder, subfolder, names in walker:
+            relsub = posixpath.join(relfolder, subfolder.replace(os.sep, "/")).strip("/")
+            self._watch(folder, relsub)
+            files.update(posixpath.join(relsub, name) if relsub else name for name in names)
+        self._scanned_at = time.monotonic()
+        return files
+
+    def _must_prune(self, relfolder):
+        must_prune = self.must_prune
+        if not must_prune:
+            return None
+        if not relfolder:
+            return must_prune
+        return lambda sub: must_prune(os.path.join(relfolder, sub))
+
+    def _watch(self, folder, relfolder):
+        fd, libc = self._fd, self._libc
+        if fd is None or libc is None:
+            return
+        wd = libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            # Probably over the `max_user_watches` limit, so poll instead
+            self.close()
+            return
+        # The same folder can be watched through several links
+        relfolders = self._wds.setdefault(wd, [])
+        if relfolder not in relfolders:
+            relfolders.append(relfolder)
+
+    def _read_events(self):
+        changed = set()
+        while self._fd is not None:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError:
+                self.close()
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, size = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset:offset + size].rstrip(b"\0"))
+                offset += size
+                self._apply_event(wd, mask, name, changed)
+
+        if changed:
+            self._lookups = {}
+        return changed
+
+    def _apply_event(self, wd, mask, name, changed):
+        if mask & IN_Q_OVERFLOW:
+            old = self.files
+            self._wds = {}
+            self.files = self._scan("")
+            changed.update(old ^ self.files)
+            return
+
+        relfolders = self._wds.get(wd)
+        if relfolders is None:
+            return
+        if mask & IN_IGNORED:
+            del self._wds[wd]
+            return
+        if not name:
+            return
+        for relfolder in list(relfolders):
+            relpath = posixpath.join(relfolder, name) if relfolder else name
+            self._apply_change(relpath, mask, changed)
+
+    def _apply_change(self, relpath, mask, changed):
+        is_dir = mask & IN_ISDIR
+        if not is_dir:
+            # A link to a folder is indexed like the folder
+            if mask & REMOVED:
+                is_dir = relpath not in self.files
+            else:
+                is_dir = os.path.isdir(os.path.join(self.src, relpath))
+        if not is_dir:
+            if mask & REMOVED:
+                self.files.discard(relpath)
+            else:
+                self.files.add(relpath)
+            changed.add(relpath)
+            return
+
+        if mask & REMOVED:
+            prefix = relpath + "/"
+            removed = {path for path in self.files if path.startswith(prefix)}
+            self.files -= removed
+            changed.update(removed)
+            for sub_wd, subs in list(self._wds.items()):
+                kept = [sub for sub in subs if sub != relpath and not sub.startswith(prefix)]
+                if len(kept) == len(subs):
+                    continue
+                if kept:
+                    self._wds[sub_wd] = kept
+                    continue
+                del self._wds[sub_wd]
+                fd, libc = self._fd, self._libc
+                if mask & IN_MOVED_FROM and fd is not None and libc is not None:
+                    libc.inotify_rm_watch(fd, sub_wd)
+        elif mask & ADDED:
+            if self.must_prune and self.must_prune(relpath):
+                return
+            added = self._scan(relpath)
+            self.files |= added
+            changed.update(added)
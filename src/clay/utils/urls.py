@@ -1,32 +1,128 @@
 import re
 
+from .fingerprint import fingerprint_url
 
-__all__ = ("get_relative_url", "make_absolute_urls_relative")
+
+__all__ = (
+    "get_relative_url",
+    "make_absolute_urls_relative",
+    "make_absolute_urls_relative_stream",
+)
 
 RX_ABS_URL = re.compile(
     r"""\s(src|href|data-[a-z0-9_-]+)\s*=\s*['"](\/(?:[a-z0-9_-][^'"]*)?)[\'"]""",
     re.UNICODE | re.IGNORECASE,
 )
+# The start of a possible match of `RX_ABS_URL` cut by the end of the text
+RX_PARTIAL_URL = re.compile(
+    r"""\s[a-z0-9_-]*(?:\s*(?:=\s*(?:['"](?:\/[^'"]*)?)?)?)?\Z""",
+    re.UNICODE | re.IGNORECASE,
+)
+# Longer possible matches are not URLs, so there's no need to hold them back
+MAX_PARTIAL = 64 * 1024
 
 
-def get_relative_url(base_path, relpath, currurl):
-    depth = relpath.count("/")
-    url = (r"../" * depth) + currurl.lstrip("/")
+def get_relative_url(base_path, relpath, currurl, folders=None):
+    """Returns `currurl` relative to the page at `relpath`.
 
-    if not url:
-        return "index.html"
-    if (base_path / relpath).is_dir():
-        return url.rstrip("/") + "/index.html"
+    `folders` is an optional set of the relative paths of the folders
+    in `base_path`, used instead of checking the filesystem.
+    """
+    return _relative_url(
+        "../" * relpath.count("/"),
+        currurl,
+        _is_folder(base_path, relpath, folders),
+    )
 
-    return url
 
+def make_absolute_urls_relative(
+    base_path, relpath, content, folders=None, assets=None, relativize=True
+):
+    """Rewrites, in a single pass, the absolute URLs of `content` as relative
+    to the page at `relpath`.
+
+    `folders` is an optional set of the relative paths of the folders
+    in `base_path`, used instead of checking the filesystem.
+
+    `assets` is an optional map of the paths of static files to their
+    fingerprinted names, used in the same pass. With `relativize=False`,
+    the URLs are only fingerprinted and stay absolute.
+    """
+    replace = _make_replace(base_path, str(relpath), folders, assets, relativize)
+    return RX_ABS_URL.sub(replace, content)
+
+
+def make_absolute_urls_relative_stream(
+    base_path, relpath, chunks, folders=None, assets=None, relativize=True
+):
+    """Like `make_absolute_urls_relative` but for an iterable of chunks of
+    text, yielding the rewritten chunks as they come.
+
+    The end of each chunk that could be the start of a URL attribute is held
+    back until the next one arrives, so the result is the same as rewriting
+    the whole text at once.
+    """
+    replace = _make_replace(base_path, str(relpath), folders, assets, relativize)
 
-def make_absolute_urls_relative(base_path, relpath, content):
-    relpath = str(relpath)
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk
+        parts = []
+        pos = 0
+        for match in RX_ABS_URL.finditer(text):
+            parts.append(text[pos:match.start()])
+            parts.append(replace(match))
+            pos = match.end()
+        # Only after the last match, or it could cut one in half
+        partial = RX_PARTIAL_URL.search(text, pos)
+        cut = partial.start() if partial else len(text)
+        if len(text) - cut > MAX_PARTIAL:
+            cut = len(text)
+        parts.append(text[pos:cut])
+        carry = text[cut:]
+        yield "".join(parts)
+    if carry:
+        yield RX_ABS_URL.sub(replace, carry)
 
-    for attr, url in RX_ABS_URL.findall(content):
-        newurl = get_relative_url(base_path, relpath, url)
-        repl = r' %s="%s"' % (attr, newurl)
-        content = re.sub(RX_ABS_URL, repl, content, count=1)
 
-    return content
+def _make_replace(base_path, relpath, folders, assets, relativize=True):
+    if not relativize:
+        return _make_fingerprint_replace(assets)
+    prefix = "../" * relpath.count("/")
+    is_folder = _is_folder(base_path, relpath, folders)
+
+    def replace(match):
+        attr, url = match.groups()
+        url = fingerprint_url(url, assets)
+        return ' %s="%s"' % (attr, _relative_url(prefix, url, is_folder))
+
+    return replace
+
+
+def _make_fingerprint_replace(assets):
+    def replace(match):
+        url = match.group(2)
+        newurl = fingerprint_url(url, assets)
+        text = match.group(0)
+        if newurl == url:
+            return text
+        # Only the URL, leaving the rest of the attribute as it was
+        start, end = match.start(2) - match.start(), match.end(2) - match.start()
+        return text[:start] + newurl + text[end:]
+
+    return replace
+
+
+def _is_folder(base_path, relpath, folders):
+    if folders is None:
+        return (base_path / relpath).is_dir()
+    return relpath in folders
+
+
+def _relative_url(prefix, currurl, is_folder):
+    url = prefix + currurl.lstrip("/")
+    if not url:
+        return "index.html"
+    if is_folder:
+        return url.rstrip("/") + "/index.html"
+    return url
@@ -0,0 +1,77 @@
+import os
+
+
+__all__ = ("TreeWalker",)
+
+
+class TreeWalker:
+    """Walks a folder tree top-down, like `os.walk`, but using `os.scandir`
+    and without entering the subfolders for which `must_prune(relfolder)`
+    is `True`.
+
+    Yields a `(folder, relfolder, files)` tuple for each folder, where
+    `relfolder` is relative to `top` ("" for `top` itself).
+
+    After the walk, `pruned` is the number of folders that were skipped.
+    As with `os.walk`, symbolic links to folders are not followed unless
+    `follow_symlinks` is `True`. Even then, the links to a folder that is
+    being walked, like to one of its parents, are skipped, so the walk ends.
+    """
+
+    def __init__(self, top, must_prune=None, follow_symlinks=False):
+        self.top = str(top)
+        self.must_prune = must_prune
+        self.follow_symlinks = follow_symlinks
+        self.pruned = 0
+
+    def __iter__(self):
+        self.pruned = 0
+        # With the (device, inode) of the folder and its parents, when
+        # following links
+        parents = frozenset()
+        if self.follow_symlinks:
+            try:
+                stat = os.stat(self.top)
+            except OSError:
+                pass
+            else:
+                parents = frozenset({(stat.st_dev, stat.st_ino)})
+        stack = [(self.top, "", parents)]
+        while stack:
+            folder, relfolder, parents = stack.pop()
+            try:
+                scandir_it = os.scandir(folder)
+            except OSError:
+                continue
+
+            files = []
+            subfolders = []
+            with scandir_it:
+                for entry in scandir_it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        files.append(entry.name)
+                        continue
+                    if not self.follow_symlinks and entry.is_symlink():
+                        continue
+                    subrelfolder = os.path.join(relfolder, entry.name)
+                    if self.must_prune and self.must_prune(subrelfolder):
+                        self.pruned += 1
+                        continue
+                    subparents = parents
+                    if self.follow_symlinks:
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        key = (stat.st_dev, stat.st_ino)
+                        if key in parents:
+                            continue
+                        subparents = parents | {key}
+                    subfolders.append((entry.path, subrelfolder, subparents))
+
+            yield folder, relfolder, files
+            stack.extend(reversed(subfolders))
@@ -0,0 +1,184 @@
+import asyncio
+import gzip
+import os
+import time
+
+from clay.asgi import make_asgi_app
+from clay.main import Clay
+from clay.utils.asgi_server import serve
+from clay.utils.compress import compress_tree
+
+
+def request(app, path, method="GET", query=b"", headers=()):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": list(headers),
+        "client": ("127.0.0.1", 1234),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start, *bodies = messages
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in bodies)
+    return start["status"], headers, body, bodies
+
+
+def test_render(dst):
+    (dst / "page.html").write_text("{{ request.path }} {{ request.query.get('a') }}")
+    app = make_asgi_app(Clay(dst))
+
+    status, headers, body, _ = request(app, "/page.html", query=b"a=1")
+    assert status == 200
+    assert headers["content-type"] == "text/html"
+    assert "render;dur=" in headers["server-timing"]
+    assert body == b"page.html 1"
+
+    # The second time, it comes whole from the render cache
+    headers, body = request(app, "/page.html", query=b"a=1")[1:3]
+    assert headers["content-length"] == str(len(body))
+    assert body == b"page.html 1"
+
+
+def test_render_is_streamed(dst):
+    (dst / "big.html").write_text("{% for i in range(30000) %}{{ i }}<br>{% endfor %}")
+    app = make_asgi_app(Clay(dst))
+
+    _, headers, body, bodies = request(app, "/big.html")
+    assert "content-length" not in headers
+    assert len(bodies) > 2
+    assert body.decode() == "".join(f"{i}<br>" for i in range(30000))
+
+
+def test_render_index_and_not_found(dst):
+    os.mkdir(dst / "foo")
+    (dst / "foo" / "index.html").write_text("index")
+    app = make_asgi_app(Clay(dst))
+
+    assert request(app, "/foo/")[2] == b"index"
+    status, _, body, _ = request(app, "/qwertyuio")
+    assert status == 404
+    assert b"not found" in body
+
+
+def test_static_is_streamed(dst):
+    os.mkdir(dst / "static")
+    data = os.urandom(150_000)
+    (dst / "static" / "data.bin").write_bytes(data)
+    (dst / "static" / "style.css").write_text("{{ not rendered }}")
+    app = make_asgi_app(Clay(dst))
+
+    status, headers, body, bodies = request(app, "/static/data.bin")
+    assert status == 200
+    assert headers["content-length"] == "150000"
+    assert body == data
+    assert len(bodies) == 3
+
+    assert request(app, "/static/style.css")[2] == b"{{ not rendered }}"
+    assert request(app, "/static/../page.html")[0] == 404
+    assert request(app, "/static/data.bin", method="HEAD")[2] == b""
+
+
+def test_static_precompressed(dst):
+    os.mkdir(dst / "static")
+    (dst / "static" / "app.js").write_text("var a = 1;" * 200)
+    compress_tree(dst / "static")
+    app = make_asgi_app(Clay(dst))
+
+    headers = [(b"accept-encoding", b"gzip, deflate")]
+    _, resp_headers, body, _ = request(app, "/static/app.js", headers=headers)
+    assert resp_headers["content-encoding"] == "gzip"
+    assert resp_headers["content-type"] == "text/javascript"
+    assert resp_headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == b"var a = 1;" * 200
+
+    _, resp_headers, body, _ = request(app, "/static/app.js")
+    assert "content-encoding" not in resp_headers
+    assert body == b"var a = 1;" * 200
+
+    # An outdated copy is ignored
+    (dst / "static" / "app.js").write_text("var b = 2;")
+    _, resp_headers, body, _ = request(app, "/static/app.js", headers=headers)
+    assert "content-encoding" not in resp_headers
+    assert body == b"var b = 2;"
+
+
+def test_metrics(dst):
+    (dst / "page.html").write_text("hello")
+    app = make_asgi_app(Clay(dst))
+    request(app, "/page.html")
+
+    body = request(app, "/__clay/metrics")[2].decode()
+    assert 'clay_request_duration_seconds_count{route="page.html"} 1' in body
+
+
+def test_metrics_streamed_page(dst):
+    (dst / "page.html").write_text("x" * 70_000 + "{{ wait() }}")
+    clay = Clay(dst)
+    clay.render.render.globals["wait"] = lambda: time.sleep(0.05) or ""
+    app = make_asgi_app(clay)
+
+    assert len(request(app, "/page.html")[2]) == 70_000
+    assert app.metrics.phases["render"][1] >= 0.05
+
+
+def test_builtin_server(dst):
+    (dst / "page.html").write_text("hello")
+    app = make_asgi_app(Clay(dst))
+
+    async def main():
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(
+            serve(app, "127.0.0.1", 0, on_start=started.set_result)
+        )
+        server = await started
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /page.html HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert b"transfer-encoding: chunked\r\n" in head
+        assert await reader.readuntil(b"0\r\n\r\n") == b"5\r\nhello\r\n0\r\n\r\n"
+
+        # Now from the render cache
+        writer.write(b"GET /page.html HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert b"content-length: 5\r\n" in head
+        assert await reader.readexactly(5) == b"hello"
+        writer.close()
+        task.cancel()
+
+    asyncio.run(main())
+
+
+def test_builtin_server_bad_content_length(dst):
+    app = make_asgi_app(Clay(dst))
+
+    async def main():
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(
+            serve(app, "127.0.0.1", 0, on_start=started.set_result)
+        )
+        server = await started
+        port = server.sockets[0].getsockname()[1]
+        for length in (b"nope", b"-1"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                b"POST /page.html HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Length: " + length + b"\r\n\r\n"
+            )
+            head = await reader.readuntil(b"\r\n\r\n")
+            assert head.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+            writer.close()
+        task.cancel()
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import gzip
+import os
+
+from webtest import TestApp
+
+from clay.build_server import make_build_app
+from clay.cli import cli
+from clay.main import Clay
+from clay.utils.fingerprint import AssetManifest
+
+
+def call(app, path, **environ):
+    # Called directly, because WebTest decompresses the responses
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = status
+        response.update(headers)
+
+    environ = {"PATH_INFO": path, "REQUEST_METHOD": "GET", **environ}
+    return response, b"".join(app(environ, start_response))
+
+
+def test_serve_build(dst):
+    os.mkdir(dst / "static")
+    (dst / "index.html").write_text("hello")
+    (dst / "404.html").write_text("custom not found")
+    (dst / "static" / "main.css").write_text("body {}")
+    # Not fingerprinted by the build, even if it looks like it
+    (dst / "static" / "report.20240131.pdf").write_text("report")
+    cli.build(source=dst, incremental=True, fingerprint=True)
+    assets = AssetManifest(dst, dst / "build", folder=dst / ".clay_cache")
+    assets.load()
+    app = TestApp(make_build_app(Clay(dst)))
+
+    resp = app.get("/")
+    assert resp.text == "hello"
+    assert resp.headers["Content-Type"] == "text/html; charset=utf-8"
+    etag = resp.headers["ETag"]
+    resp = app.get("/", headers={"If-None-Match": etag}, status=304)
+
+    resp = app.get("/static/main.css")
+    assert "immutable" not in resp.headers["Cache-Control"]
+    css = assets.assets["static/main.css"]
+    assert css != "static/main.css"
+    resp = app.get(f"/{css}")
+    assert "immutable" in resp.headers["Cache-Control"]
+    report = assets.assets["static/report.20240131.pdf"]
+    resp = app.get("/static/report.20240131.pdf")
+    assert "immutable" not in resp.headers["Cache-Control"]
+    resp = app.get(f"/{report}")
+    assert "immutable" in resp.headers["Cache-Control"]
+
+    # The manifests are not in the build, so they can't be served
+    assert not (dst / "build" / ".clay-manifest.json").exists()
+    assert not (dst / "build" / ".clay-assets.json").exists()
+    resp = app.get("/.clay-assets.json", status=404)
+    assert resp.text == "custom not found"
+
+    # Indexed only at startup
+    (dst / "build" / "new.html").write_text("new")
+    app.get("/new.html", status=404)
+
+
+def test_serve_precompressed(dst):
+    text = "hello world " * 200
+    (dst / "a.html").write_text(text)
+    (dst / "b.html").write_text(text)
+    cli.build(source=dst, compress=True)
+    # Changed by a build without `--compress`
+    (dst / "build" / "b.html").write_text("new " * 500)
+    os.utime(dst / "build" / "b.html", ns=(0, 10**18))
+    app = make_build_app(Clay(dst))
+
+    headers, body = call(app, "/a.html", HTTP_ACCEPT_ENCODING="gzip, deflate")
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(body).decode() == text
+
+    headers, body = call(app, "/a.html")
+    assert "Content-Encoding" not in headers
+    assert body.decode() == text
+
+    headers, body = call(app, "/b.html", HTTP_ACCEPT_ENCODING="gzip")
+    assert "Content-Encoding" not in headers
+    assert body.decode() == "new " * 500
@@ -1,7 +1,15 @@
+import gzip
+import json
 import os
+import re
 from datetime import datetime
 
+import pytest
+from jinja2.exceptions import SecurityError
+
 from clay.cli import cli
+from clay.main import Clay
+from clay.utils.compress import compress_tree
 
 
 def test_new_cwd(dst):
@@ -11,6 +19,25 @@ def test_new_cwd(dst):
     assert (dest / "clay.yaml").is_file()
 
 
+def test_new_no_sandbox(dst):
+    dest = dst / "demo"
+    cli.new(dest, sandbox=False)
+    assert (dest / "clay.yaml").is_file()
+
+
+def test_build_no_sandbox(dst):
+    (dst / "clay.yaml").write_text("sandbox: false")
+    (dst / "_part.html").write_text("{{ ''.__class__.__name__ }}")
+    (dst / "page.html").write_text("{% include '_part.html' %}")
+    clay = Clay(dst)
+    assert clay.render_file("page.html") == "str"
+    assert clay.dependencies == {"page.html", "_part.html"}
+
+    (dst / "clay.yaml").unlink()
+    with pytest.raises(SecurityError):
+        Clay(dst).render_file("page.html")
+
+
 def test_render(dst):
     (dst / "test.txt").write_text("{{ now() }}")
     cli.build(source=dst)
@@ -35,6 +62,18 @@ def test_build_raw_controls_url_relativization(dst):
     assert (raw / "build" / "index.html").read_text() == template
 
 
+def test_build_big_page_in_chunks(dst):
+    (dst / "foo").mkdir()
+    (dst / "foo" / "index.html").write_text(
+        '{% for i in range(20000) %}<a href="/p{{ i }}.html">{{ i }}</a>{% endfor %}'
+    )
+    cli.build(source=dst)
+
+    expected = "".join(f'<a href="../p{i}.html">{i}</a>' for i in range(20000))
+    assert (dst / "build" / "foo" / "index.html").read_text() == expected
+    assert not list((dst / "build").glob(".clay-*.tmp"))
+
+
 def test_do_not_render_static(dst):
     text = "{{ now() }}"
     os.mkdir(dst / "static")
@@ -91,3 +130,299 @@ def test_render_active(dst):
     assert (dst / "build" / "a" / "name.html").read_text() == ""
     assert (dst / "build" / "a" / "exact.html").read_text() == "active"
     assert (dst / "build" / "a" / "custom.html").read_text() == "yeah"
+
+
+def test_build_jobs_is_identical_to_serial(dst):
+    serial = dst / "serial"
+    parallel = dst / "parallel"
+    for source in (serial, parallel):
+        (source / "static").mkdir(parents=True)
+        (source / "_base.html").write_text("<a href='/'>{% block body %}{% endblock %}</a>")
+        (source / "static" / "test.txt").write_text("{{ now() }}")
+        for i in range(20):
+            folder = source / f"f{i % 3}"
+            folder.mkdir(exist_ok=True)
+            (folder / f"p{i}.html").write_text(
+                "{% extends '_base.html' %}{% block body %}{{ request.path }}{% endblock %}"
+            )
+
+    cli.build(source=serial)
+    cli.build(source=parallel, jobs=3)
+
+    files = sorted(
+        path.relative_to(serial / "build") for path in (serial / "build").rglob("*")
+    )
+    assert files == sorted(
+        path.relative_to(parallel / "build") for path in (parallel / "build").rglob("*")
+    )
+    for path in files:
+        if (serial / "build" / path).is_file():
+            assert (serial / "build" / path).read_bytes() == (
+                parallel / "build" / path
+            ).read_bytes()
+
+
+def test_incremental_build(dst):
+    (dst / "_base.html").write_text("base {% block body %}{% endblock %}")
+    (dst / "_part.html").write_text("part")
+    (dst / "a.html").write_text("{% extends '_base.html' %}{% block body %}a{% endblock %}")
+    (dst / "b.html").write_text("{% include '_part.html' with x=1 %} b")
+    (dst / "c.html").write_text("c {{ now() }}")
+    cli.build(source=dst, incremental=True)
+
+    c_output = (dst / "build" / "c.html").read_text()
+    (dst / "_part.html").write_text("new part")
+    cli.build(source=dst, incremental=True)
+
+    assert (dst / "build" / "a.html").read_text() == "base a"
+    assert (dst / "build" / "b.html").read_text() == "new part b"
+    assert (dst / "build" / "c.html").read_text() == c_output
+
+    (dst / "_base.html").write_text("new base {% block body %}{% endblock %}")
+    cli.build(source=dst, incremental=True)
+
+    assert (dst / "build" / "a.html").read_text() == "new base a"
+    assert (dst / "build" / "c.html").read_text() == c_output
+
+
+def test_incremental_build_deletes_removed_pages(dst):
+    (dst / "a.html").write_text("a")
+    (dst / "b.html").write_text("b")
+    cli.build(source=dst, incremental=True)
+    assert (dst / "build" / "b.html").exists()
+
+    (dst / "b.html").unlink()
+    cli.build(source=dst, incremental=True)
+
+    assert (dst / "build" / "a.html").exists()
+    assert not (dst / "build" / "b.html").exists()
+
+
+def test_incremental_build_state_outside_the_build(dst):
+    (dst / "a.html").write_text("a")
+    (dst / "build").mkdir()
+    # Saved there by the previous versions
+    (dst / "build" / ".clay-manifest.json").write_text("{}")
+    cli.build(source=dst, incremental=True)
+
+    assert (dst / ".clay_cache" / ".clay-manifest.json").exists()
+    assert not (dst / "build" / ".clay-manifest.json").exists()
+    assert (dst / "build" / "a.html").read_text() == "a"
+
+def test_incremental_build_lists_changed_pages(dst):
+    (dst / "posts").mkdir()
+    (dst / "posts" / "a.html").write_text("{#---\ntitle: First\n---#}a")
+    (dst / "posts" / "b.html").write_text("{#---\ntitle: Second\n---#}b")
+    (dst / "index.html").write_text(
+        "{% for post in list_pages('posts', sort='title') %}"
+        "{{ post.meta.title }};{% endfor %}"
+    )
+    (dst / "about.html").write_text("about {{ now() }}")
+    cli.build(source=dst, incremental=True)
+    assert (dst / "build" / "index.html").read_text() == "First;Second;"
+    about_output = (dst / "build" / "about.html").read_text()
+
+    (dst / "posts" / "b.html").write_text("{#---\ntitle: Another\n---#}b")
+    cli.build(source=dst, incremental=True)
+
+    assert (dst / "build" / "index.html").read_text() == "Another;First;"
+    assert (dst / "build" / "about.html").read_text() == about_output
+
+
+def test_build_compress(dst):
+    (dst / "a.html").write_text("a" * 2000)
+    (dst / "b.html").write_text("b" * 2000)
+    (dst / "c.html").write_text("c")
+    cli.build(source=dst, incremental=True, compress=True)
+
+    assert gzip.decompress((dst / "build" / "a.html.gz").read_bytes()) == b"a" * 2000
+    assert (dst / "build" / "b.html.gz").exists()
+    assert not (dst / "build" / "c.html.gz").exists()
+
+    (dst / "b.html").unlink()
+    cli.build(source=dst, incremental=True, compress=True)
+    assert (dst / "build" / "a.html.gz").exists()
+    assert not (dst / "build" / "b.html.gz").exists()
+
+
+def test_build_compress_skips_hidden_files(dst):
+    (dst / "static").mkdir()
+    (dst / "static" / "main.css").write_text("a" * 2000)
+    (dst / "a.html").write_text("a" * 2000)
+    cli.build(source=dst, incremental=True, fingerprint=True, compress=True)
+    (dst / "build" / ".well-known").mkdir()
+    (dst / "build" / ".well-known" / "b.json").write_text("b" * 2000)
+    compress_tree(dst / "build", min_size=0)
+
+    assert (dst / ".clay_cache" / ".clay-assets.json").exists()
+    assert (dst / "build" / "a.html.gz").exists()
+    assert [path.name for path in (dst / "build").rglob(".*.gz")] == []
+    assert not (dst / "build" / ".well-known" / "b.json.gz").exists()
+
+
+def test_build_fingerprint(dst):
+    (dst / "static" / "img").mkdir(parents=True)
+    (dst / "static" / "img" / "logo.png").write_bytes(b"logo")
+    (dst / "static" / "main.css").write_text(".a { background: url(img/logo.png); }")
+    (dst / "static" / "main.js").write_text("main")
+    (dst / "foo").mkdir()
+    (dst / "foo" / "page.html").write_text(
+        '<link href="/static/main.css"><img src="/static/img/logo.png?v=1">'
+        "<script src=\"{{ asset_url('/static/main.js') }}\"></script>"
+    )
+    cli.build(source=dst, incremental=True, fingerprint=True)
+
+    assets = json.loads((dst / ".clay_cache" / ".clay-assets.json").read_text())["assets"]
+    logo = assets["static/img/logo.png"]
+    css = assets["static/main.css"]
+    js = assets["static/main.js"]
+    assert re.fullmatch(r"static/img/logo\.[0-9a-f]{10}\.png", logo)
+    assert (dst / "build" / logo).read_bytes() == b"logo"
+    # Also with the original name, for the references that weren't rewritten
+    assert (dst / "build" / "static" / "img" / "logo.png").read_bytes() == b"logo"
+    assert (dst / "build" / css).read_text() == \
+        f".a {{ background: url(img/{logo.rsplit('/', 1)[1]}); }}"
+    assert (dst / "build" / "static" / "main.css").read_text() == \
+        (dst / "build" / css).read_text()
+    assert (dst / "build" / "foo" / "page.html").read_text() == (
+        f'<link href="../{css}"><img src="../{logo}?v=1">'
+        f'<script src="../{js}"></script>'
+    )
+
+    # Unchanged files keep their names
+    cli.build(source=dst, incremental=True, fingerprint=True)
+    assert json.loads((dst / ".clay_cache" / ".clay-assets.json").read_text())["assets"] == assets
+
+    # A new version of the image changes the stylesheet that uses it too
+    (dst / "static" / "img" / "logo.png").write_bytes(b"new logo")
+    cli.build(source=dst, incremental=True, fingerprint=True)
+    new_assets = json.loads((dst / ".clay_cache" / ".clay-assets.json").read_text())["assets"]
+    assert new_assets["static/img/logo.png"] != logo
+    assert new_assets["static/main.css"] != css
+    assert new_assets["static/main.js"] == js
+    page = (dst / "build" / "foo" / "page.html").read_text()
+    assert new_assets["static/img/logo.png"] in page
+    assert new_assets["static/main.css"] in page
+    assert (dst / "build" / "static" / "img" / "logo.png").read_bytes() == b"new logo"
+
+    (dst / "static" / "main.js").unlink()
+    cli.build(source=dst, incremental=True, fingerprint=True)
+    assert not (dst / "build" / js).exists()
+    assert not (dst / "build" / "static" / "main.js").exists()
+
+
+def test_build_fingerprint_raw(dst):
+    (dst / "static").mkdir()
+    (dst / "static" / "main.css").write_text("main")
+    (dst / "foo").mkdir()
+    (dst / "foo" / "page.html").write_text(
+        "<link href='/static/main.css'><a href=\"/foo/page.html\">"
+    )
+    cli.build(source=dst, raw=True, fingerprint=True)
+
+    assets = json.loads((dst / ".clay_cache" / ".clay-assets.json").read_text())["assets"]
+    css = assets["static/main.css"]
+    assert (dst / "build" / css).read_text() == "main"
+    assert (dst / "build" / "foo" / "page.html").read_text() == (
+        f"<link href='/{css}'><a href=\"/foo/page.html\">"
+    )
+
+
+def test_build_prunes_excluded_folders(dst, monkeypatch):
+    (dst / "node_modules" / "lib").mkdir(parents=True)
+    (dst / "node_modules" / "lib" / "index.js").write_text("{{ nope }")
+    (dst / "index.html").write_text("{{ list_pages() }}")
+
+    scanned = []
+    scandir = os.scandir
+
+    def spy(path):
+        scanned.append(os.path.relpath(path, dst))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", spy)
+    cli.build(source=dst)
+
+    assert scanned
+    assert not any(path.startswith("node_modules") for path in scanned)
+    assert not (dst / "build" / "node_modules").exists()
+    assert (dst / "build" / "index.html").read_text() == "['index.html']"
+
+
+def test_build_keeps_included_names_in_excluded_folders(dst):
+    (dst / "clay.yaml").write_text("include: ['logo.png']")
+    (dst / "node_modules" / "pkg").mkdir(parents=True)
+    (dst / "node_modules" / "pkg" / "logo.png").write_bytes(b"logo")
+    (dst / "node_modules" / "pkg" / "index.js").write_text("index")
+    (dst / "_assets").mkdir()
+    (dst / "_assets" / "logo.png").write_bytes(b"logo")
+    cli.build(source=dst)
+
+    # Only the folders with the name directly inside are walked
+    assert not (dst / "build" / "node_modules").exists()
+    assert (dst / "build" / "_assets" / "logo.png").exists()
+
+    (dst / "node_modules" / "logo.png").write_bytes(b"logo")
+    cli.build(source=dst)
+
+    assert (dst / "build" / "node_modules" / "logo.png").exists()
+    assert (dst / "build" / "node_modules" / "pkg" / "logo.png").exists()
+    assert not (dst / "build" / "node_modules" / "pkg" / "index.js").exists()
+
+
+def test_sync_static(dst):
+    (dst / "static").mkdir()
+    (dst / "static" / "a.css").write_text("a")
+    (dst / "static" / "b.css").write_text("b")
+    cli.build(source=dst, sync=True)
+
+    built_a = dst / "build" / "static" / "a.css"
+    built_b = dst / "build" / "static" / "b.css"
+    mtime_a = built_a.stat().st_mtime_ns
+    (dst / "static" / "b.css").write_text("new b")
+    cli.build(source=dst, sync=True)
+
+    assert built_a.stat().st_mtime_ns == mtime_a
+    assert built_b.read_text() == "new b"
+
+    (dst / "static" / "b.css").unlink()
+    cli.build(source=dst, sync=True)
+    assert not built_b.exists()
+
+
+def test_link_static(dst):
+    (dst / "static").mkdir()
+    (dst / "static" / "a.css").write_text("a")
+    cli.build(source=dst, link=True)
+
+    assert (dst / "build" / "static" / "a.css").samefile(dst / "static" / "a.css")
+
+
+def test_build_profile(dst):
+    (dst / "_base.html").write_text("base {% block body %}{% endblock %}")
+    (dst / "a.html").write_text("{% extends '_base.html' %}{% block body %}a{% endblock %}")
+    cli.build(source=dst, profile=True, jobs=2)
+
+    assert (dst / "build" / "a.html").read_text() == "base a"
+    profile = json.loads((dst / ".clay-profile.json").read_text())
+    assert set(profile["templates"]) == {"a.html", "_base.html", "a.html#body"}
+    assert profile["templates"]["_base.html"]["calls"] == 1
+    assert profile["pages"]["a.html"]["render"] > 0
+    assert profile["peak_memory"] > 0
+
+    speedscope = json.loads((dst / ".clay-profile.speedscope.json").read_text())
+    assert speedscope["profiles"][0]["type"] == "evented"
+
+
+def test_build_profile_restores_the_templates(dst):
+    (dst / "_base.html").write_text("base {% block body %}{% endblock %}")
+    (dst / "a.html").write_text("{% extends '_base.html' %}{% block body %}a{% endblock %}")
+    clay = Clay(dst)
+    clay.build(profile=True)
+
+    env = clay.render.render.env
+    for name in ("_base.html", "a.html"):
+        tmpl = env.get_template(name)
+        assert not hasattr(tmpl, "_clay_profiled")
+        assert tmpl.root_render_func.__name__ == "root"
+        assert all(func.__name__.startswith("block_") for func in tmpl.blocks.values())
@@ -0,0 +1,48 @@
+import gzip
+import os
+
+from clay.utils.compress import choose_encoding, compress_tree
+
+
+ENCODINGS = {"br": None, "gzip": None}
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate, br", ENCODINGS) == "br"
+    assert choose_encoding("gzip, br;q=0.5", ENCODINGS) == "gzip"
+    assert choose_encoding("br;q=0, gzip", ENCODINGS) == "gzip"
+    assert choose_encoding("*", ENCODINGS) == "br"
+    assert choose_encoding("*;q=0.1, br;q=0", ENCODINGS) == "gzip"
+    assert choose_encoding("identity", ENCODINGS) is None
+    assert choose_encoding("gzip;q=nope", ENCODINGS) is None
+    assert choose_encoding("", ENCODINGS) is None
+    assert choose_encoding(None, ENCODINGS) is None
+
+
+def test_compress_tree(dst):
+    text = "hello world " * 200
+    (dst / "sub").mkdir()
+    (dst / "page.html").write_text(text)
+    (dst / "sub" / "style.css").write_text(text)
+    (dst / "small.html").write_text("hello")
+    (dst / "image.png").write_bytes(os.urandom(4000))
+
+    assert compress_tree(dst, min_size=1024) == (2, 0)
+    assert gzip.decompress((dst / "page.html.gz").read_bytes()).decode() == text
+    assert (dst / "sub" / "style.css.gz").exists()
+    assert not (dst / "small.html.gz").exists()
+    assert not (dst / "image.png.gz").exists()
+    mtime = (dst / "page.html").stat().st_mtime_ns
+    assert (dst / "page.html.gz").stat().st_mtime_ns == mtime
+
+
+def test_compress_tree_skips_current(dst):
+    (dst / "a.html").write_text("a" * 2000)
+    (dst / "b.html").write_text("b" * 2000)
+    compress_tree(dst)
+
+    (dst / "b.html").write_text("c" * 2000)
+    os.utime(dst / "b.html", ns=(0, 10**18))
+    assert compress_tree(dst) == (1, 1)
+    assert gzip.decompress((dst / "b.html.gz").read_bytes()) == b"c" * 2000
+    assert compress_tree(dst) == (0, 2)
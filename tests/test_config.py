@@ -1,6 +1,8 @@
 import yaml
 
 from clay.cli import cli
+from clay.main import Clay
+from clay.utils import bytecode_cache
 
 
 def set_config(dst, **config):
@@ -38,3 +40,54 @@ def test_include(dst):
     assert (dst / "build" / "nope" / "meh" / "b").exists()
     assert not (dst / "build" / "nope" / "lorem.txt").exists()
     assert not (dst / "build" / "nope" / "meh" / "ipsum.txt").exists()
+
+
+def test_bytecode_cache(dst):
+    (dst / "_base.html").write_text("{% block body %}{% endblock %}")
+    (dst / "index.html").write_text("{% extends '_base.html' %}")
+
+    clay = Clay(dst)
+    clay.list_pages()
+    clay.bytecode_cache.evict(0)
+    # Only created when there is something to save
+    assert not (dst / ".clay_cache").exists()
+
+    clay.render_file("index.html")
+    assert clay.bytecode_cache.stats() == {"hits": 0, "misses": 2}
+    assert (dst / ".clay_cache").is_dir()
+
+    clay = Clay(dst)
+    clay.render_file("index.html")
+    assert clay.bytecode_cache.stats() == {"hits": 2, "misses": 0}
+
+
+def test_bytecode_cache_per_version(dst, monkeypatch):
+    (dst / "index.html").write_text("{{ 1 }}")
+    Clay(dst).render_file("index.html")
+
+    monkeypatch.setattr(bytecode_cache, "__version__", "0.0.0.dev0")
+    clay = Clay(dst)
+    clay.render_file("index.html")
+    assert clay.bytecode_cache.stats() == {"hits": 0, "misses": 1}
+
+
+def test_bytecode_cache_disabled(dst):
+    set_config(dst, bytecode_cache=False)
+    clay = Clay(dst)
+
+    assert clay.bytecode_cache is None
+    assert not (dst / ".clay_cache").exists()
+
+
+def test_bytecode_cache_eviction(dst):
+    clay = Clay(dst)
+    cache = clay.bytecode_cache
+    for i in range(10):
+        (dst / f"page{i}.html").write_text("{{ %d }}" % i)
+        clay.render_file(f"page{i}.html")
+
+    entries = list((dst / ".clay_cache").iterdir())
+    assert len(entries) == 10
+    cache.evict(sum(path.stat().st_size for path in entries) // 2)
+
+    assert len(list((dst / ".clay_cache").iterdir())) < 10
@@ -0,0 +1,64 @@
+from clay.utils.fingerprint import AssetManifest, fingerprint_url, rewrite_css_urls
+
+
+ASSETS = {
+    "static/img/logo.png": "static/img/logo.0123456789.png",
+    "static/fonts/a.woff2": "static/fonts/a.abcdef0123.woff2",
+    "static/base.css": "static/base.aaaaaaaaaa.css",
+}
+
+
+def test_fingerprint_url():
+    assert fingerprint_url("/static/img/logo.png", ASSETS) == "/static/img/logo.0123456789.png"
+    assert fingerprint_url("/static/img/logo.png?v=1#top", ASSETS) == \
+        "/static/img/logo.0123456789.png?v=1#top"
+    assert fingerprint_url("/static/other.png", ASSETS) == "/static/other.png"
+    assert fingerprint_url("static/img/logo.png", ASSETS) == "static/img/logo.png"
+    assert fingerprint_url("/static/img/logo.png", {}) == "/static/img/logo.png"
+
+
+def test_rewrite_css_urls():
+    css = """
+@import "base.css";
+@import url(https://fonts.example.com/css);
+.a { background: url(img/logo.png); }
+.b { background: url( "../static/img/logo.png" ); }
+.c { background: url('/static/img/logo.png#icon'); }
+@font-face { src: url(fonts/a.woff2?v=2) format("woff2"); }
+.d { background: url(data:image/png;base64,AAAA); }
+.e { background: url(img/missing.png); }
+"""
+    expected = """
+@import "base.aaaaaaaaaa.css";
+@import url(https://fonts.example.com/css);
+.a { background: url(img/logo.0123456789.png); }
+.b { background: url( "../static/img/logo.0123456789.png" ); }
+.c { background: url('/static/img/logo.0123456789.png#icon'); }
+@font-face { src: url(fonts/a.abcdef0123.woff2?v=2) format("woff2"); }
+.d { background: url(data:image/png;base64,AAAA); }
+.e { background: url(img/missing.png); }
+"""
+    assert rewrite_css_urls(css, "static/main.css", ASSETS) == expected
+
+
+def test_asset_manifest_imported_stylesheets(dst):
+    (dst / "static" / "css").mkdir(parents=True)
+    (dst / "static" / "logo.png").write_bytes(b"logo")
+    (dst / "static" / "main.css").write_text('@import "css/base.css";')
+    (dst / "static" / "css" / "base.css").write_text(".a { background: url(../logo.png); }")
+    relpaths = ["static/main.css", "static/css/base.css", "static/logo.png"]
+
+    manifest = AssetManifest(dst, dst / "build")
+    manifest.update(relpaths)
+    base = manifest.assets["static/css/base.css"]
+    assert manifest.contents["static/main.css"] == f'@import "css/{base.rsplit("/", 1)[1]}";'
+
+    # The names don't depend on the order the files are found
+    other = AssetManifest(dst, dst / "build")
+    other.update(reversed(relpaths))
+    assert other.assets == manifest.assets
+
+    (dst / "static" / "logo.png").write_bytes(b"new logo")
+    manifest.update(relpaths)
+    assert manifest.assets["static/css/base.css"] != base
+    assert manifest.assets["static/main.css"] != other.assets["static/main.css"]
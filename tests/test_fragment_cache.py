@@ -0,0 +1,124 @@
+import json
+import os
+
+from clay.main import PAGES_SIGNATURE, Clay
+from clay.utils.blueprint_render import get_context
+
+
+MENU = "{% cache 'menu' %}{% include '_menu.html' %}{% endcache %}"
+
+
+def render(clay, path):
+    return clay.render_file(path, **get_context(path))
+
+
+def touch(path, text):
+    path.write_text(text)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_cache_fragment(dst):
+    (dst / "_menu.html").write_text("menu of {{ request.path }}")
+    (dst / "a.html").write_text(MENU)
+    (dst / "b.html").write_text(MENU)
+    clay = Clay(dst)
+
+    assert render(clay, "a.html") == "menu of a.html"
+    assert render(clay, "b.html") == "menu of a.html"
+    assert clay.fragment_cache.stats()["hits"] == 1
+    # The page still depends on the templates used by the fragment
+    assert {"b.html", "_menu.html"} <= clay.dependencies
+
+    touch(dst / "_menu.html", "new menu")
+    assert render(clay, "b.html") == "new menu"
+
+
+def test_cache_fragment_vary(dst):
+    (dst / "a.html").write_text("{% cache 'x', vary=request.path %}{{ request.path }}{% endcache %}")
+    (dst / "b.html").write_text("{% include 'a.html' %}")
+    clay = Clay(dst)
+
+    assert render(clay, "a.html") == "a.html"
+    assert render(clay, "b.html") == "b.html"
+    assert render(clay, "b.html") == "b.html"
+    assert clay.fragment_cache.stats()["hits"] == 1
+
+
+def test_cache_fragment_list_pages(dst):
+    (dst / "_nav.html").write_text("{{ list_pages()|join(',') }}")
+    (dst / "a.html").write_text("{% cache 'nav' %}{% include '_nav.html' %}{% endcache %}")
+    clay = Clay(dst)
+    assert render(clay, "a.html") == "a.html"
+
+    (dst / "b.html").write_text("b")
+    clay.page_index.update({"b.html"})
+    assert render(clay, "a.html") == "a.html,b.html"
+    assert clay.dependencies == {"a.html", "_nav.html", PAGES_SIGNATURE}
+
+
+def test_volatile_fragment(dst):
+    (dst / "a.html").write_text("{% cache 'now' %}{{ now() }}{% endcache %}")
+    clay = Clay(dst)
+    render(clay, "a.html")
+    assert len(clay.fragment_cache) == 0
+
+
+def test_no_fragment_cache(dst):
+    (dst / "clay.yaml").write_text("fragment_cache_size: 0")
+    (dst / "a.html").write_text("{% cache 'a' %}{{ request.path }}{% endcache %}")
+    clay = Clay(dst)
+    assert clay.fragment_cache is None
+    assert render(clay, "a.html") == "a.html"
+
+
+def test_fragment_cache_folder(dst):
+    (dst / "clay.yaml").write_text("fragment_cache_folder: .clay_cache/fragments")
+    (dst / "_menu.html").write_text("menu of {{ request.path }}")
+    (dst / "a.html").write_text(MENU)
+    (dst / "b.html").write_text(MENU)
+    assert render(Clay(dst), "a.html") == "menu of a.html"
+    assert len(os.listdir(dst / ".clay_cache" / "fragments")) == 1
+
+    clay = Clay(dst)
+    assert render(clay, "b.html") == "menu of a.html"
+    assert clay.fragment_cache.stats()["hits"] == 1
+
+    touch(dst / "_menu.html", "new menu")
+    assert render(Clay(dst), "b.html") == "new menu"
+
+
+def test_build_summary(dst, capsys):
+    (dst / "_menu.html").write_text("menu")
+    for name in "abc":
+        (dst / f"{name}.html").write_text(MENU)
+    Clay(dst).build()
+    assert "fragments  2 cached, 1 rendered" in capsys.readouterr().out
+    assert (dst / "build" / "c.html").read_text() == "menu"
+
+
+def test_build_summary_parallel(dst, capsys):
+    (dst / "_menu.html").write_text("menu")
+    for name in "abcdefgh":
+        (dst / f"{name}.html").write_text(MENU)
+    Clay(dst).build(jobs=2)
+    out = capsys.readouterr().out
+    assert "fragments" in out
+    assert "8 rendered" not in out
+
+
+def test_fragment_cache_asset_url(dst, capsys):
+    (dst / "clay.yaml").write_text("fragment_cache_folder: .clay_cache/fragments")
+    (dst / "static").mkdir()
+    (dst / "static" / "main.css").write_text("a")
+    (dst / "page.html").write_text(
+        "{% cache 'head' %}<link href=\"{{ asset_url('/static/main.css') }}\">{% endcache %}"
+    )
+    Clay(dst).build(incremental=True, fingerprint=True)
+    (dst / "static" / "main.css").write_text("new")
+    Clay(dst).build(incremental=True, fingerprint=True)
+
+    assets = json.loads((dst / ".clay_cache" / ".clay-assets.json").read_text())["assets"]
+    page = (dst / "build" / "page.html").read_text()
+    assert page == f'<link href="{assets["static/main.css"]}">'
+    assert "0 cached, 1 rendered" in capsys.readouterr().out
@@ -0,0 +1,41 @@
+import jinja2
+import pytest
+
+from clay.utils.jinja_includewith import IncludeWith
+
+
+@pytest.fixture()
+def env():
+    loader = jinja2.DictLoader({"part.html": "[{{ a }} {{ b }} {{ c }}]"})
+    return jinja2.Environment(loader=loader, extensions=[IncludeWith])
+
+
+def render(env, source, **data):
+    return env.from_string(source).render(**data)
+
+
+def test_include_with(env):
+    data = {"a": "A", "b": "B", "c": "C"}
+    assert render(env, "{% include 'part.html' with a=1 %}", **data) == "[1 B C]"
+    assert render(env, "{% include 'part.html' with a=3, b=2+2, c='yes' %}") == "[3 4 yes]"
+    assert render(env, "{% include 'part.html' with\n  a=1,\n  b=2\n%}") == "[1 2 ]"
+    assert render(env, "{% include name with b=a %}", name="part.html", a="x") == "[x x ]"
+    assert render(env, "{% set c = 5 %}{% include 'part.html' with a=1 %}") == "[1  5]"
+
+
+def test_include_with_context(env):
+    assert render(env, "{% include 'part.html' with context %}", a=1) == "[1  ]"
+    assert render(env, "{% include 'part.html' without context %}", a=1) == "[  ]"
+    assert render(env, "{% include 'part.html' %}", a=1) == "[1  ]"
+
+
+def test_include_with_options(env):
+    assert render(env, "{% include 'nope.html' ignore missing with a=1 %}") == ""
+    assert render(env, "x {%- include 'part.html' with a=1 -%} x") == "x[1  ]x"
+    assert render(env, "{{ a }}{% include 'part.html' with a=1 %}{{ a }}", a=0) == "0[1  ]0"
+
+
+def test_include_with_errors(env):
+    with pytest.raises(jinja2.TemplateSyntaxError) as excinfo:
+        env.from_string("\n\n{% include 'part.html' with a %}")
+    assert excinfo.value.lineno == 3
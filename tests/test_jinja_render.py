@@ -0,0 +1,27 @@
+from clay.utils.jinja_render import JinjaRender
+
+
+def test_string(dst):
+    render = JinjaRender(dst)
+    compiled = []
+    from_string = render.env.from_string
+
+    def spy(source):
+        compiled.append(source)
+        return from_string(source)
+
+    render.env.from_string = spy
+    assert render.string("index.html") == "index.html"
+    assert render.string("a b.html") == "a b.html"
+    assert compiled == []
+
+    assert render.string("{{ name }}.html", name="a") == "a.html"
+    assert render.string("{{ name }}.html", name="b") == "b.html"
+    assert render.string("{# no #}c.html") == "c.html"
+    assert compiled == ["{{ name }}.html", "{# no #}c.html"]
+
+
+def test_string_custom_syntax(dst):
+    render = JinjaRender(dst, variable_start_string="[[", variable_end_string="]]")
+    assert render.string("{{ name }}.html", name="a") == "{{ name }}.html"
+    assert render.string("[[ name ]].html", name="a") == "a.html"
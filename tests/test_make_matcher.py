@@ -0,0 +1,95 @@
+import os
+from fnmatch import fnmatch
+
+from clay.main import DEFAULT_CONFIG
+from clay.utils.binaries import KNOWN_BINARIES
+from clay.utils.make_matcher import _normalize_str, make_matcher, make_pruner
+
+
+PATHS = [
+    "index.html",
+    "static/img/logo.PNG",
+    "static/img/logo.png",
+    ".git/config",
+    "a/.hidden",
+    "_layouts/base.html",
+    "node_modules",
+    "node_modules/lib/index.js",
+    "png",
+    ".png",
+    "archive.tar.gz",
+    "señal/año.jpg",
+    "sénal/ñ.html",
+    "docs/~draft.html",
+]
+PATTERNS = list(KNOWN_BINARIES) + list(DEFAULT_CONFIG["exclude"]) + [
+    "*.tar.gz",
+    "docs/*.html",
+    "a[!b]?c",
+    "señal/*",
+]
+
+
+def fnmatch_any(path, patterns):
+    path = _normalize_str(path)
+    name = os.path.basename(path)
+    return any(
+        fnmatch(name, _normalize_str(pattern)) or fnmatch(path, _normalize_str(pattern))
+        for pattern in patterns
+    )
+
+
+def test_make_matcher_is_like_fnmatch():
+    for patterns in (KNOWN_BINARIES, DEFAULT_CONFIG["exclude"], PATTERNS, []):
+        match = make_matcher(patterns)
+        for path in PATHS:
+            assert match(path) == fnmatch_any(path, patterns), (path, patterns)
+
+
+def test_make_matcher_paths():
+    match = make_matcher(["*.png", "nope/*"])
+    assert match("a.png")
+    assert match(os.path.join("static", "a.png"))
+    assert match(os.path.join("nope", "meh", "a.txt"))
+    assert not match("png")
+    assert not match("a.png.txt")
+
+
+def test_make_pruner():
+    must_prune = make_pruner(
+        DEFAULT_CONFIG["exclude"] + ("nope/*",),
+        ["nope/keep/*"],
+    )
+    assert must_prune("node_modules")
+    assert must_prune(".git")
+    assert must_prune("_layouts")
+    assert must_prune(os.path.join("node_modules", "lib"))
+    assert not must_prune("static")
+    assert not must_prune(os.path.join("a", ".git"))
+    assert not must_prune("nope")
+    assert not must_prune(os.path.join("nope", "keep"))
+    assert must_prune(os.path.join("nope", "other"))
+
+
+def test_make_pruner_basename_include():
+    # Without the source folder, "logo.png" could be anywhere
+    must_prune = make_pruner(DEFAULT_CONFIG["exclude"], ["logo.png"])
+    assert not must_prune("node_modules")
+    assert not must_prune(os.path.join("node_modules", "pkg"))
+    assert not must_prune("_assets")
+
+
+def test_make_pruner_literal_include(dst):
+    (dst / "node_modules" / "pkg").mkdir(parents=True)
+    (dst / "node_modules" / "pkg" / "logo.png").write_bytes(b"logo")
+    (dst / "_assets").mkdir()
+    (dst / "_assets" / "logo.png").write_bytes(b"logo")
+    must_prune = make_pruner(DEFAULT_CONFIG["exclude"], ["logo.png"], src=dst)
+    assert must_prune("node_modules")
+    assert not must_prune(os.path.join("node_modules", "pkg"))
+    assert not must_prune("_assets")
+    assert not must_prune("static")
+
+    # A name with wildcards could be anywhere
+    must_prune = make_pruner(DEFAULT_CONFIG["exclude"], ["*.png"], src=dst)
+    assert not must_prune("node_modules")
@@ -0,0 +1,113 @@
+import pickle
+
+from clay.main import Clay
+
+
+def make_site(dst):
+    (dst / "blog" / "2024").mkdir(parents=True)
+    (dst / "_partials").mkdir()
+    (dst / "_partials" / "nav.html").write_text("nav")
+    (dst / "index.html").write_text("index")
+    (dst / "about.html").write_text("about")
+    (dst / "blog" / "index.html").write_text("blog")
+    (dst / "blog" / "first.html").write_text("{#---\ntitle: First\ndate: 2024-01-02\n---#}first")
+    (dst / "blog" / "second.html").write_text("{#---\ntitle: Second\ndate: 2024-03-04\n---#}second")
+    (dst / "blog" / "2024" / "recap.html").write_text("recap")
+
+
+def test_list_pages(dst):
+    make_site(dst)
+    clay = Clay(dst)
+
+    # The files of each folder first, then those of its subfolders
+    assert clay.list_pages() == [
+        "about.html",
+        "index.html",
+        "blog/first.html",
+        "blog/index.html",
+        "blog/second.html",
+        "blog/2024/recap.html",
+    ]
+    assert clay.list_pages(sub=False) == ["about.html", "index.html"]
+    assert clay.list_pages("blog") == [
+        "first.html", "index.html", "second.html", "2024/recap.html",
+    ]
+    pages = clay.list_pages("blog", sub=False)
+    assert pages == ["first.html", "index.html", "second.html"]
+    assert [page.path for page in pages] == [
+        "blog/first.html", "blog/index.html", "blog/second.html",
+    ]
+    assert clay.list_pages("/blog/2024/") == ["recap.html"]
+    assert clay.list_pages("../blog/2024") == ["recap.html"]
+    assert clay.list_pages("nope") == []
+
+
+def test_list_pages_of_excluded_folder(dst):
+    make_site(dst)
+    (dst / "static" / "img").mkdir(parents=True)
+    (dst / "static" / "app.css").write_text("css")
+    (dst / "static" / "img" / "logo.png").write_text("png")
+    (dst / "static" / "img" / ".hidden").write_text("no")
+    clay = Clay(dst)
+
+    # What is excluded is relative to the folder listed
+    assert clay.list_pages("static") == ["app.css", "img/logo.png"]
+    assert clay.list_pages("static", sub=False) == ["app.css"]
+    assert "static/app.css" not in clay.list_pages()
+
+
+def test_list_pages_sorted_by_path(dst):
+    make_site(dst)
+    clay = Clay(dst)
+
+    assert clay.list_pages(sort="path") == [
+        "about.html",
+        "blog/2024/recap.html",
+        "blog/first.html",
+        "blog/index.html",
+        "blog/second.html",
+        "index.html",
+    ]
+    assert clay.list_pages(sort="path", reverse=True)[0] == "index.html"
+
+
+def test_list_pages_sorted_and_paginated(dst):
+    make_site(dst)
+    clay = Clay(dst)
+
+    pages = clay.list_pages("blog", sort="date", reverse=True)
+    assert pages[:2] == ["second.html", "first.html"]
+    assert pages[0].meta["title"] == "Second"
+    assert set(pages[2:]) == {"2024/recap.html", "index.html"}
+    assert pages[2].meta == {}
+
+    pages = clay.list_pages(sort="size")
+    assert [page.size for page in pages] == sorted(page.size for page in pages)
+
+    assert clay.list_pages("blog", sort="title", per_page=1) == ["first.html"]
+    assert clay.list_pages("blog", sort="title", page=2, per_page=1) == ["second.html"]
+    assert clay.list_pages("blog", sort="title", page=9, per_page=1) == []
+
+
+def test_list_pages_is_indexed(dst, monkeypatch):
+    make_site(dst)
+    clay = Clay(dst)
+    clay.list_pages()
+    clay.list_pages("blog")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("walked again")
+
+    monkeypatch.setattr("clay.utils.page_index.TreeWalker", fail)
+    pages = clay.list_pages("blog", sort="path")
+    pages.append("modified")
+    assert clay.list_pages("blog", sort="path") == pages[:-1]
+    assert clay.list_pages(sub=False) == ["about.html", "index.html"]
+    assert pickle.loads(pickle.dumps(pages[0])).path == "blog/2024/recap.html"
+
+
+def test_meta_is_not_rendered(dst):
+    make_site(dst)
+    clay = Clay(dst)
+    assert clay.render_file("blog/first.html") == "first"
+
@@ -0,0 +1,56 @@
+import pytest
+
+from clay.utils.multidict import MultiDict
+from clay.utils.request import Request
+
+
+def test_multidict_reads_dont_insert():
+    md = MultiDict(("a", "1"), ("a", "2"), ("b", "3"))
+    assert md["a"] == ["1", "2"]
+    assert md.get("a") == "2"
+    assert md.get("a", index=0) == "1"
+    assert md.getall("b") == ["3"]
+
+    assert md["missing"] == []
+    assert md.get("missing") is None
+    assert md.get("missing", "default") == "default"
+    assert md.getlist("missing") == []
+    assert "missing" not in md
+    assert len(md) == 2
+
+
+def test_request():
+    request = Request({
+        "PATH_INFO": "/foo/",
+        "QUERY_STRING": "a=1&a=2&b",
+        "REQUEST_METHOD": "post",
+        "HTTP_USER_AGENT": "test",
+        "HTTP_X_REQUESTED_WITH": "XMLHttpRequest",
+        "HTTP_COOKIE": "theme=dark; lang=es",
+        "CONTENT_TYPE": "text/plain",
+    })
+    assert request.path == "foo/index.html"
+    assert request.parent_path == "foo"
+    assert request.method == "POST"
+    assert request.remote_addr == "127.0.0.1"
+    assert request.ajax
+    assert request.query.getall("a") == ["1", "2"]
+    assert request.query.get("b") is True
+    assert request.headers["User-Agent"] == "test"
+    assert request.headers["Content-Type"] == "text/plain"
+    assert request.cookies == {"theme": "dark", "lang": "es"}
+
+    request.path = "bar.html"
+    assert request.path == "bar.html"
+    with pytest.raises(AttributeError):
+        request.foo = "bar"
+
+
+def test_request_is_lazy():
+    request = Request({"PATH_INFO": "/a", "QUERY_STRING": "a=1", "HTTP_COOKIE": "x"})
+    assert request._query is None
+    assert request._headers is None
+    assert request._cookies is None
+    query = request.query
+    assert request.query is query
+    assert request.cookies == {}
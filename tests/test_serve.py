@@ -1,4 +1,13 @@
+import gzip
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from webtest import TestApp
+
+from clay.main import Clay
+from clay.server import make_app
 
 
 def test_render(dst, server):
@@ -9,6 +18,20 @@ def test_render(dst, server):
     assert resp.text == "hello world"
 
 
+def test_render_symlinked_folder(dst, server):
+    os.makedirs(dst / "shared" / "posts")
+    (dst / "shared" / "posts" / "index.html").write_text("{{ request.path }}")
+    os.symlink(dst / "shared" / "posts", dst / "blog")
+
+    assert server.get("/blog/index.html").text == "blog/index.html"
+    (dst / "shared" / "posts" / "new.html").write_text("new")
+    assert server.get("/blog/new.html").text == "new"
+    assert server.get("/shared/posts/new.html").text == "new"
+
+    (dst / "blog").unlink()
+    assert server.get("/blog/index.html", expect_errors=True).status_int == 404
+
+
 def test_render_unicode(dst, server):
     text = "[✓] It works! 😅 ç ¡yay!"
     (dst / "hello").write_text(text)
@@ -113,3 +136,358 @@ def test_folder_with_index_pattern(dst, server):
     resp = server.get("/hello")
     assert resp.status == "200 OK"
     assert resp.text == "hello world"
+
+
+def test_render_cache(dst):
+    (dst / "_part.html").write_text("part")
+    (dst / "page.html").write_text("{% include '_part.html' %} {{ request.query.get('a') }}")
+    clay = Clay(dst)
+    app = make_app(clay)
+    server = TestApp(app)
+    cache = app.render_cache
+
+    assert server.get("/page.html").text == "part None"
+    assert server.get("/page.html").text == "part None"
+    assert cache.stats()["hits"] == 1
+
+    assert server.get("/page.html?a=1").text == "part 1"
+    assert cache.stats()["hits"] == 1
+
+    (dst / "_part.html").write_text("new part")
+    assert server.get("/page.html").text == "new part None"
+    assert cache.stats()["hits"] == 1
+
+
+def test_render_cache_per_url(dst):
+    (dst / "foo").mkdir()
+    (dst / "foo" / "index.html").write_text("{{ request.path }}")
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+
+    assert server.get("/foo/").text == "foo/index.html"
+    assert server.get("/foo").text == "foo"
+    assert server.get("/foo/index.html").text == "foo/index.html"
+    assert server.get("/foo").text == "foo"
+    assert len(app.render_cache) == 3
+
+
+def test_render_cache_list_pages(dst):
+    (dst / "blog").mkdir()
+    (dst / "blog" / "first.html").write_text("first")
+    (dst / "nav.html").write_text("{{ list_pages('blog')|join(',') }}")
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+
+    assert server.get("/nav.html").text == "first.html"
+    assert server.get("/nav.html").text == "first.html"
+
+    (dst / "blog" / "second.html").write_text("second")
+    app.index.refresh()
+    assert server.get("/nav.html").text == "first.html,second.html"
+
+
+def test_render_cache_per_user_pages(dst):
+    (dst / "page.html").write_text(
+        'hi {{ request.cookies.get("user") }} {{ request.remote_addr }}'
+    )
+    (dst / "agent.html").write_text('{{ request.headers.get("User-Agent") }}')
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+
+    alice = {"HTTP_COOKIE": "user=alice", "REMOTE_ADDR": "1.1.1.1"}
+    bob = {"HTTP_COOKIE": "user=bob", "REMOTE_ADDR": "2.2.2.2"}
+    assert server.get("/page.html", extra_environ=alice).text == "hi alice 1.1.1.1"
+    assert server.get("/page.html", extra_environ=bob).text == "hi bob 2.2.2.2"
+
+    assert server.get("/agent.html", headers={"User-Agent": "a"}).text == "a"
+    assert server.get("/agent.html", headers={"User-Agent": "b"}).text == "b"
+    assert len(app.render_cache) == 0
+
+
+def test_render_cache_volatile_pages(dst):
+    (dst / "now.html").write_text("{{ now() }}")
+    (dst / "datetime.html").write_text("{{ datetime.now().isoformat() }}")
+    (dst / "date.html").write_text("{{ datetime(2024, 1, 2).year }}")
+    (dst / "opt-out.html").write_text("{{ no_cache() }}hello")
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+
+    assert server.get("/now.html").text != server.get("/now.html").text
+    assert server.get("/datetime.html").text != server.get("/datetime.html").text
+    assert server.get("/opt-out.html").text == "hello"
+    assert server.get("/opt-out.html").text == "hello"
+    assert app.render_cache.stats()["hits"] == 0
+    assert len(app.render_cache) == 0
+    assert server.get("/date.html").text == "2024"
+    assert len(app.render_cache) == 1
+
+
+def test_render_cache_exclude(dst):
+    (dst / "clay.yaml").write_text("render_cache_exclude: ['*.json']")
+    (dst / "data.json").write_text("{}")
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+
+    server.get("/data.json")
+    server.get("/data.json")
+    assert len(app.render_cache) == 0
+
+
+def test_server_timing(dst):
+    (dst / "page.html").write_text("hello")
+    os.mkdir(dst / "static")
+    (dst / "static" / "test.txt").write_text("static")
+    server = TestApp(make_app(Clay(dst)))
+
+    timing = server.get("/page.html").headers["Server-Timing"]
+    assert "resolve;dur=" in timing
+    assert "exists;dur=" in timing
+    assert "render;dur=" in timing
+    assert "total;dur=" in timing
+
+    timing = server.get("/static/test.txt").headers["Server-Timing"]
+    assert "static;dur=" in timing
+
+
+def test_metrics(dst):
+    (dst / "page.html").write_text("hello")
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+    server.get("/page.html")
+    server.get("/page.html")
+    server.get("/qwertyuio", expect_errors=True)
+
+    resp = server.get("/__clay/metrics")
+    assert resp.content_type == "text/plain"
+    assert 'clay_request_duration_seconds{route="page.html",quantile="0.99"}' in resp.text
+    assert 'clay_request_duration_seconds_count{route="page.html"} 2' in resp.text
+    assert 'clay_request_duration_seconds_count{route="not_found"} 1' in resp.text
+    assert 'clay_request_phase_seconds_count{phase="render"} 3' in resp.text
+    assert "# TYPE clay_render_cache_hits_total counter" in resp.text
+    assert "clay_render_cache_hits_total 1" in resp.text
+    assert "# TYPE clay_render_cache_entries gauge" in resp.text
+    assert "/__clay/metrics" not in app.metrics.routes
+
+
+def test_metrics_streamed_page(dst):
+    # Longer than a chunk, so `wait()` runs while the page is being sent
+    (dst / "page.html").write_text("x" * 70_000 + "{{ wait() }}")
+    clay = Clay(dst)
+    clay.render.render.globals["wait"] = lambda: time.sleep(0.05) or ""
+    app = make_app(clay)
+    server = TestApp(app)
+
+    assert len(server.get("/page.html").text) == 70_000
+    count, seconds = app.metrics.routes["page.html"][1:]
+    assert count == 1
+    assert seconds >= 0.05
+    assert app.metrics.phases["render"][1] >= 0.05
+
+
+def test_livereload_script(dst):
+    (dst / "page.html").write_text("<html><body>hello</body></html>")
+    (dst / "data.json").write_text("{}")
+    server = TestApp(make_app(Clay(dst), livereload=True))
+
+    text = server.get("/page.html").text
+    assert text.startswith("<html><body>hello<script>")
+    assert '"page.html"' in text
+    assert text.endswith("</script></body></html>")
+    assert server.get("/data.json").text == "{}"
+
+
+def test_livereload_script_escapes_the_path(dst):
+    (dst / "404.html").write_text("<html><body>not found</body></html>")
+    server = TestApp(make_app(Clay(dst), livereload=True))
+
+    resp = server.get("/%3C/script%3E%3Cscript%3Ealert(1)%3C/script%3E&", status=404)
+    assert resp.text.count("<script>") == 1
+    assert resp.text.count("</script>") == 1
+    assert '"\\u003c/script\\u003e\\u003cscript\\u003ealert(1)' in resp.text
+    assert "\\u0026" in resp.text
+
+
+def test_livereload_events(dst):
+    (dst / "_layouts").mkdir()
+    (dst / "_layouts" / "base.html").write_text("{% block content %}{% endblock %}")
+    (dst / "_other.html").write_text("other")
+    (dst / "page.html").write_text(
+        "{% extends '_layouts/base.html' %}{% block content %}page{% endblock %}"
+    )
+    os.mkdir(dst / "static")
+    app = make_app(Clay(dst), livereload=True)
+    server = TestApp(app)
+    server.get("/page.html")
+
+    app.index.interval = 0
+    livereload = app.livereload
+    livereload.start = lambda: None
+    stream = livereload.stream("page.html")
+    assert next(stream) == b"retry: 1000\n\n"
+
+    livereload.notify({"_other.html"})
+    livereload.notify({"static/main.css"})
+    assert next(stream) == b"event: css\ndata: /static/main.css\n\n"
+
+    (dst / "_layouts" / "base.html").write_text("new {% block content %}{% endblock %}")
+    assert app.index.refresh() == {"_layouts/base.html"}
+    assert next(stream) == b"event: reload\ndata: \n\n"
+    stream.close()
+    assert not livereload.clients
+
+
+def test_livereload_disabled(dst):
+    (dst / "page.html").write_text("<html><body>hello</body></html>")
+    server = TestApp(make_app(Clay(dst)))
+
+    assert server.get("/page.html").text == "<html><body>hello</body></html>"
+    server.get("/__clay/livereload", status=404)
+
+
+def test_render_is_streamed(dst):
+    (dst / "big.html").write_text("{% for i in range(30000) %}{{ i }}<br>{% endfor %}")
+    app = make_app(Clay(dst))
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/big.html"}
+    headers = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        headers.update(response_headers)
+
+    chunks = list(app(environ, start_response))
+    assert "Content-Length" not in headers
+    assert len(chunks) > 1
+    assert b"".join(chunks).decode() == "".join(f"{i}<br>" for i in range(30000))
+
+    # Now from the render cache
+    chunks = list(app(environ, start_response))
+    assert len(chunks) == 1
+    assert headers["Content-Length"] == str(len(chunks[0]))
+
+
+def test_compressed_render_cache(dst, monkeypatch):
+    from clay.utils import compress
+
+    text = "hello world " * 200
+    (dst / "page.html").write_text(text)
+    (dst / "small.html").write_text("hello")
+    app = make_app(Clay(dst))
+    calls = []
+    real_compress = compress.compress
+
+    def counted_compress(data, encoding):
+        calls.append(encoding)
+        return real_compress(data, encoding)
+
+    monkeypatch.setattr("clay.server.compress", counted_compress)
+
+    def get(path, accept_encoding="gzip"):
+        # Called directly, because WebTest decompresses the responses
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response.update(headers)
+
+        environ = {"PATH_INFO": path, "HTTP_ACCEPT_ENCODING": accept_encoding}
+        return response, b"".join(app(environ, start_response))
+
+    # Not cached yet, so sent as it's rendered
+    headers, body = get("/page.html")
+    assert "Content-Encoding" not in headers
+    assert body.decode() == text
+
+    for _ in range(3):
+        headers, body = get("/page.html")
+        assert headers["Content-Encoding"] == "gzip"
+        assert headers["Vary"] == "Accept-Encoding"
+        assert headers["Content-Length"] == str(len(body))
+        assert gzip.decompress(body).decode() == text
+    assert calls == ["gzip"]
+
+    headers, body = get("/page.html", accept_encoding="identity")
+    assert "Content-Encoding" not in headers
+    assert body.decode() == text
+
+    get("/small.html")
+    headers, body = get("/small.html")
+    assert "Content-Encoding" not in headers
+    assert body == b"hello"
+
+    # A new version of the page is compressed again
+    (dst / "page.html").write_text("bye " * 500)
+    os.utime(dst / "page.html", ns=(0, 10**18))
+    get("/page.html")
+    headers, body = get("/page.html")
+    assert gzip.decompress(body).decode() == "bye " * 500
+    assert calls == ["gzip", "gzip"]
+
+
+def test_server_options(dst):
+    app = make_app(Clay(dst))
+    assert app.get_server_options() == {
+        "workers": 1, "worker_class": "sync", "threads": 1, "preload_app": False,
+    }
+    options = app.get_server_options(workers="4", threads="8", preload=True)
+    assert options == {
+        "workers": 4, "worker_class": "gthread", "threads": 8, "preload_app": True,
+    }
+    assert app.get_server_options(worker_class="gthread")["threads"] == 1
+    with pytest.raises(ValueError):
+        app.get_server_options(worker_class="eventlet")
+    with pytest.raises(ValueError):
+        app.get_server_options(worker_class="sync", threads=4)
+
+    app = make_app(Clay(dst), livereload=True)
+    assert app.get_server_options()["worker_class"] == "gthread"
+    assert app.get_server_options()["threads"] > 1
+
+
+def test_warm_up(dst):
+    os.mkdir(dst / "_includes")
+    (dst / "_includes" / "header.html").write_text("header")
+    (dst / "_base.html").write_text("{% block body %}{% endblock %}")
+    (dst / "page.html").write_text("{% extends '_base.html' %}")
+    (dst / "broken.html").write_text("{% if %}")
+    (dst / "favicon.ico").write_bytes(b"\x00\x01")
+    os.mkdir(dst / "static")
+    (dst / "static" / "style.css").write_text("{{ nope }")
+    clay = Clay(dst)
+
+    assert clay.warm_up() == 3
+    cached = {key[1] for key in clay.render.render.env.cache}
+    assert cached == {"_includes/header.html", "_base.html", "page.html"}
+
+
+def test_concurrent_renders(dst):
+    (dst / "_base.html").write_text("<{% block body %}{% endblock %}>")
+    for i in range(20):
+        (dst / f"_part{i}.html").write_text(f"part{i}")
+        (dst / f"page{i}.html").write_text(
+            f"{{% extends '_base.html' %}}{{% block body %}}"
+            f"{{% for j in range(2000) %}}{{% include '_part{i}.html' %}}{{% endfor %}}"
+            "{% endblock %}"
+        )
+    app = make_app(Clay(dst))
+    server = TestApp(app)
+
+    def get(i):
+        return i, server.get(f"/page{i}.html").text
+
+    with ThreadPoolExecutor(8) as pool:
+        for _ in range(3):
+            for i, text in pool.map(get, list(range(20)) * 2):
+                assert text == f"<{f'part{i}' * 2000}>"
+
+    cache = app.render_cache
+    assert len(cache) == 20
+    for (path, *_), (_, states, _, _) in cache._entries.items():
+        i = path[len("page"):-len(".html")]
+        assert set(states) == {path, "_base.html", f"_part{i}.html"}
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 120
+
+
+def test_no_sandbox(dst):
+    (dst / "clay.yaml").write_text("sandbox: false")
+    (dst / "page.html").write_text("{{ request.__class__.__name__ }}")
+    server = TestApp(make_app(Clay(dst)))
+    assert server.get("/page.html").text == "Request"
@@ -0,0 +1,89 @@
+import os
+import shutil
+
+import pytest
+
+from clay.utils.make_matcher import make_matcher, make_pruner
+from clay.utils.source_index import SourceIndex
+
+
+@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+def make_index(request):
+    def make(dst, **kwargs):
+        return SourceIndex(dst, inotify=request.param, interval=0, **kwargs)
+    return make
+
+
+def test_index_files(dst, make_index):
+    (dst / "page.html").write_text("")
+    os.mkdir(dst / "foo")
+    (dst / "foo" / "index.html").write_text("")
+    index = make_index(dst)
+
+    assert index.exists("page.html")
+    assert index.exists("foo/index.html")
+    assert index.exists("foo//index.html")
+    assert not index.exists("foo")
+    assert not index.exists("nope.html")
+    assert not index.exists("../page.html")
+    assert not index.exists("")
+
+
+def test_index_changes(dst, make_index):
+    index = make_index(dst)
+    assert not index.exists("page.html")
+
+    (dst / "page.html").write_text("")
+    assert index.exists("page.html")
+
+    os.makedirs(dst / "foo" / "bar")
+    (dst / "foo" / "bar" / "index.html").write_text("")
+    assert index.exists("foo/bar/index.html")
+
+    shutil.move(dst / "foo", dst / "moved")
+    assert not index.exists("foo/bar/index.html")
+    assert index.exists("moved/bar/index.html")
+
+    shutil.rmtree(dst / "moved")
+    (dst / "page.html").unlink()
+    assert not index.exists("moved/bar/index.html")
+    assert not index.exists("page.html")
+
+
+def test_index_symlinked_folders(dst, make_index):
+    os.makedirs(dst / "shared" / "posts")
+    (dst / "shared" / "posts" / "index.html").write_text("")
+    os.symlink(dst / "shared" / "posts", dst / "blog")
+    # A link to a parent folder is only walked once
+    os.symlink(dst, dst / "shared" / "posts" / "loop")
+    index = make_index(dst)
+
+    assert index.exists("blog/index.html")
+    assert index.exists("shared/posts/index.html")
+    assert not any(path.startswith("blog/loop/") for path in index.files)
+
+
+def test_index_filtered(dst, make_index):
+    os.mkdir(dst / ".git")
+    (dst / ".git" / "config").write_text("")
+    (dst / ".hidden").write_text("")
+    exclude = (".*", ".*/*")
+    index = make_index(
+        dst,
+        must_filter=make_matcher(exclude),
+        must_prune=make_pruner(exclude),
+    )
+
+    assert not index.exists(".hidden")
+    assert not index.exists(".git/config")
+    assert ".git/config" not in index.files
+
+
+def test_index_refresh_reports_changes(dst):
+    index = SourceIndex(dst)
+    if not index.uses_inotify:
+        pytest.skip("inotify is not available")
+
+    (dst / "page.html").write_text("")
+    assert index.refresh() == {"page.html"}
+    assert index.refresh() == set()
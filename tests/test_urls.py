@@ -0,0 +1,59 @@
+from clay.utils.urls import (
+    make_absolute_urls_relative,
+    make_absolute_urls_relative_stream,
+)
+
+
+def test_make_absolute_urls_relative(dst):
+    content = (
+        '<a href="/">a</a>\n<img src=\'/static/a.png\'>'
+        '<div data-url="/b/c.html"\nhref="/b/"></div><a href="http://example.com/">'
+    )
+    assert make_absolute_urls_relative(dst, "a/index.html", content) == (
+        '<a href="../">a</a>\n<img src="../static/a.png">'
+        '<div data-url="../b/c.html" href="../b/"></div><a href="http://example.com/">'
+    )
+
+
+def test_make_absolute_urls_relative_root(dst):
+    assert make_absolute_urls_relative(dst, "index.html", '<a href="/">') == (
+        '<a href="index.html">'
+    )
+
+
+def test_make_absolute_urls_relative_with_folders(dst):
+    content = '<a href="/b/">'
+    assert make_absolute_urls_relative(dst, "a", content, folders={"a"}) == (
+        '<a href="b/index.html">'
+    )
+    assert make_absolute_urls_relative(dst, "a", content, folders=set()) == (
+        '<a href="b/">'
+    )
+
+
+def test_make_absolute_urls_relative_stream(dst):
+    content = (
+        '<a href="/">a</a>\n<img src=\'/static/a.png\'>'
+        '<div data-url="/b/c.html"\nhref="/b/"></div><a href="http://example.com/">'
+        '<a href="/b/ c" title=\'x\'><p class="x y"> href="/end'
+    )
+    expected = make_absolute_urls_relative(dst, "a/index.html", content, folders=set())
+    for size in range(1, 20):
+        chunks = [content[i:i + size] for i in range(0, len(content), size)]
+        result = make_absolute_urls_relative_stream(dst, "a/index.html", chunks, folders=set())
+        assert "".join(result) == expected
+
+
+def test_fingerprint_absolute_urls(dst):
+    assets = {"static/a.png": "static/a.0123456789.png"}
+    content = "<img src='/static/a.png?v=1'>\n<a href = \"/b/\">"
+    expected = "<img src='/static/a.0123456789.png?v=1'>\n<a href = \"/b/\">"
+    result = make_absolute_urls_relative(
+        dst, "a/index.html", content, assets=assets, relativize=False
+    )
+    assert result == expected
+    chunks = [content[:10], content[10:]]
+    result = make_absolute_urls_relative_stream(
+        dst, "a/index.html", chunks, assets=assets, relativize=False
+    )
+    assert "".join(result) == expected